@@ -0,0 +1,408 @@
+import argparse
+import difflib
+import ftplib
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from ftp_sessions import open_connection
+from ftp_tasks import connect_to_directory, stat_remote_file, transfer
+from oscam_config import diff_readers, format_diff, parse_oscam_server
+
+BACKUP_DIR = "oscam_backups"
+# Fleet backups of several hosts update index.json from parallel threads
+INDEX_LOCK = threading.Lock()
+
+
+class RemoteFile:
+    def __init__(self, name, size=None, modify=None):
+        self.name = name
+        self.size = size
+        self.modify = modify
+
+    def unchanged(self, entry):
+        # Without a modification time a same-size file could still differ
+        return self.modify is not None and entry.get("modify") == self.modify and entry.get("size") == self.size
+
+
+def list_remote_files(ftp):
+    try:
+        return [
+            RemoteFile(name, int(facts["size"]) if "size" in facts else None, facts.get("modify"))
+            for name, facts in ftp.mlsd(facts=["type", "size", "modify"])
+            if facts.get("type") == "file"
+        ]
+    except ftplib.error_perm:
+        pass
+
+    files = []
+    names = ftp.nlst()
+    # Many servers refuse SIZE in ASCII mode, which NLST just switched to
+    ftp.voidcmd("TYPE I")
+    for name in names:
+        name = os.path.basename(name)
+        try:
+            size, modify = stat_remote_file(ftp, name)
+        except ftplib.error_perm:
+            # SIZE is refused for directories
+            continue
+        files.append(RemoteFile(name, size, modify))
+    return files
+
+
+class BackupStore:
+    # Files are stored once under objects/ by the SHA-256 of their content,
+    # zlib compressed. Every backup is a snapshot manifest under
+    # snapshots/<host>/ that refers to them by hash, and index.json lists all
+    # snapshots with the hash of each file, so they can be found and a file's
+    # history followed without opening each manifest.
+    def __init__(self, root=BACKUP_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest + ".z")
+
+    def has(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def add(self, tmp_path, digest):
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressor = zlib.compressobj(9)
+        # Compressed next to the download itself: two files with the same content
+        # may be added at the same time by different download threads
+        with open(tmp_path, "rb") as source, open(tmp_path + ".z", "wb") as target:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                target.write(compressor.compress(chunk))
+            target.write(compressor.flush())
+        os.replace(tmp_path + ".z", path)
+        os.remove(tmp_path)
+
+    def read(self, digest):
+        with open(self.object_path(digest), "rb") as file:
+            return zlib.decompress(file.read())
+
+    def host_dir(self, host):
+        return os.path.join(self.snapshots_dir, re.sub(r"[^\w.-]", "_", host))
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"snapshots": []}
+
+    def snapshots(self, host=None, directory=None):
+        return [
+            entry for entry in self.load_index()["snapshots"]
+            if (host is None or entry["host"] == host) and (directory is None or entry["directory"] == directory)
+        ]
+
+    def find_snapshot(self, snapshot_id):
+        for entry in self.snapshots():
+            if entry["id"] == snapshot_id:
+                return self.load_snapshot(entry["manifest"])
+        raise KeyError(f"Unknown snapshot '{snapshot_id}'")
+
+    def load_snapshot(self, manifest):
+        with open(os.path.join(self.root, manifest), "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def latest_snapshot(self, host, directory):
+        entries = self.snapshots(host, directory)
+        return self.load_snapshot(entries[-1]["manifest"]) if entries else None
+
+    def write_snapshot(self, snapshot):
+        host_dir = self.host_dir(snapshot["host"])
+        os.makedirs(host_dir, exist_ok=True)
+        with INDEX_LOCK:
+            index = self.load_index()
+            # The timestamp names the snapshot; a second one with the same
+            # name gets a counter instead of replacing the first manifest
+            ids = {entry["id"] for entry in index["snapshots"]}
+            timestamp = snapshot["timestamp"]
+            counter = 1
+            while (f"{snapshot['host']}/{snapshot['timestamp']}" in ids
+                   or os.path.exists(os.path.join(host_dir, f"{snapshot['timestamp']}.json"))):
+                snapshot["timestamp"] = f"{timestamp}-{counter}"
+                counter += 1
+            path = os.path.join(host_dir, f"{snapshot['timestamp']}.json")
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(snapshot, file, indent=1)
+            os.replace(path + ".tmp", path)
+
+            index["snapshots"].append({
+                "id": f"{snapshot['host']}/{snapshot['timestamp']}",
+                "host": snapshot["host"],
+                "directory": snapshot["directory"],
+                "timestamp": snapshot["timestamp"],
+                "files": len(snapshot["files"]),
+                "digests": {name: entry["sha256"] for name, entry in snapshot["files"].items()},
+                "manifest": os.path.relpath(path, self.root),
+            })
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix="index.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as file:
+                    json.dump(index, file, indent=1)
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return path
+
+    def file_history(self, host, name):
+        history = []
+        for entry in self.snapshots(host):
+            if "digests" in entry:
+                digest = entry["digests"].get(name)
+            else:
+                # Indexed before the file hashes were kept in index.json
+                digest = self.load_snapshot(entry["manifest"])["files"].get(name, {}).get("sha256")
+            if digest:
+                history.append((entry["id"], digest))
+        return history
+
+
+class SnapshotDiff:
+    def __init__(self, old, new):
+        old_files = old["files"]
+        new_files = new["files"]
+        self.added = sorted(name for name in new_files if name not in old_files)
+        self.removed = sorted(name for name in old_files if name not in new_files)
+        self.changed = sorted(
+            name for name in new_files
+            if name in old_files and new_files[name]["sha256"] != old_files[name]["sha256"]
+        )
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed"
+
+
+def diff_snapshots(store, old_id, new_id):
+    return SnapshotDiff(store.find_snapshot(old_id), store.find_snapshot(new_id))
+
+
+def diff_file(store, old_id, new_id, name):
+    old = store.find_snapshot(old_id)["files"].get(name)
+    new = store.find_snapshot(new_id)["files"].get(name)
+    old_lines = store.read(old["sha256"]).decode("utf-8", errors="replace").splitlines(True) if old else []
+    new_lines = store.read(new["sha256"]).decode("utf-8", errors="replace").splitlines(True) if new else []
+    return "".join(difflib.unified_diff(old_lines, new_lines, f"{old_id}/{name}", f"{new_id}/{name}"))
+
+
+def diff_snapshot_readers(store, old_id, new_id, name="oscam.server"):
+    # A file missing from a snapshot compares as empty: every reader is added or removed
+    servers = []
+    for snapshot_id in (old_id, new_id):
+        entry = store.find_snapshot(snapshot_id)["files"].get(name)
+        servers.append(parse_oscam_server(store.read(entry["sha256"]) if entry else b""))
+    return diff_readers(*servers)
+
+
+def restore_file(target, task, snapshot_id, name, backup_dir=BACKUP_DIR):
+    store = BackupStore(backup_dir)
+    entry = store.find_snapshot(snapshot_id)["files"].get(name)
+    if entry is None:
+        task.error(f"Error restoring {name}: not in snapshot {snapshot_id}")
+        return
+    data = store.read(entry["sha256"])
+    try:
+        transfer(lambda: connect_to_directory(target, task), "STOR", name, io.BytesIO(data), task)
+        task.log(f"Restored {name} from {snapshot_id} to {target.directory}")
+    except ftplib.all_errors as e:
+        task.error(f"Error restoring {name}: {str(e)}")
+
+
+class ConnectionPerThread:
+    def __init__(self, target):
+        self.target = target
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        ftp = getattr(self.local, "ftp", None)
+        if ftp is None:
+            ftp = self.local.ftp = open_connection(self.target)
+            ftp.cwd(self.target.directory)
+            with self.lock:
+                self.connections.append(ftp)
+        return ftp
+
+    @contextmanager
+    def session(self):
+        ftp = self.get()
+        try:
+            yield ftp
+        except ftplib.error_perm:
+            raise
+        except BaseException:
+            # Reconnect on next use, like the shared sessions do; the closed
+            # connection is not quit again by close()
+            self.local.ftp = None
+            with self.lock:
+                self.connections.remove(ftp)
+            ftp.close()
+            raise
+
+    def close(self):
+        for ftp in self.connections:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+
+
+def download_to_store(connections, store, name, task):
+    fd, tmp_path = tempfile.mkstemp(dir=store.objects_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "w+b") as file:
+            transfer(connections.session, "RETR", name, file, task)
+            # Hashed after the transfer, since a resumed download is written in pieces
+            file.seek(0)
+            sha256 = hashlib.sha256()
+            for block in iter(lambda: file.read(1 << 16), b""):
+                sha256.update(block)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    digest = sha256.hexdigest()
+    store.add(tmp_path, digest)
+    return digest
+
+
+def backup_configuration(target, task, backup_dir=BACKUP_DIR, max_connections=4):
+    store = BackupStore(backup_dir)
+    try:
+        with connect_to_directory(target, task) as ftp:
+            remote_files = list_remote_files(ftp)
+    except ftplib.all_errors as e:
+        task.error(f"FTP Error during backup: {str(e)}")
+        return None
+
+    previous = store.latest_snapshot(target.host, target.directory)
+    previous_files = previous["files"] if previous else {}
+
+    files = {}
+    changed = []
+    for remote_file in remote_files:
+        entry = previous_files.get(remote_file.name)
+        if entry and remote_file.unchanged(entry) and store.has(entry["sha256"]):
+            files[remote_file.name] = entry
+        else:
+            changed.append(remote_file)
+    task.log(f"{len(remote_files)} files on {target.host}, {len(changed)} new or changed since the last backup")
+
+    failed = 0
+    if changed:
+        connections = ConnectionPerThread(target)
+        executor = ThreadPoolExecutor(max_workers=min(max_connections, len(changed)))
+        try:
+            futures = {
+                executor.submit(download_to_store, connections, store, remote_file.name, task): remote_file
+                for remote_file in changed
+            }
+            for number, future in enumerate(as_completed(futures), 1):
+                remote_file = futures[future]
+                try:
+                    digest = future.result()
+                except ftplib.all_errors as e:
+                    failed += 1
+                    task.error(f"Error backing up {remote_file.name}: {str(e)}")
+                    continue
+                files[remote_file.name] = {"size": remote_file.size, "modify": remote_file.modify, "sha256": digest}
+                task.log(f"Backed up {remote_file.name} ({number}/{len(changed)})")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            connections.close()
+
+    snapshot = {
+        "host": target.host,
+        "directory": target.directory,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S_%f"),
+        "files": dict(sorted(files.items())),
+    }
+    path = store.write_snapshot(snapshot)
+    task.log(f"Backup completed successfully in {path}")
+    task.log(f"Total files backed up: {len(files)} ({len(changed) - failed} downloaded, "
+             f"{len(files) - len(changed) + failed} unchanged, {failed} failed)")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the oscam.server backup archive")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR, help="archive directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="list snapshots, or the files of one snapshot")
+    list_parser.add_argument("--host", help="only snapshots of this host")
+    list_parser.add_argument("snapshot", nargs="?", help="snapshot id (host/timestamp)")
+
+    diff_parser = commands.add_parser("diff", help="compare two snapshots, or one file between them")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("file", nargs="?")
+
+    readers_parser = commands.add_parser("readers", help="compare the readers of oscam.server between two snapshots")
+    readers_parser.add_argument("old")
+    readers_parser.add_argument("new")
+    readers_parser.add_argument("file", nargs="?", default="oscam.server")
+
+    show_parser = commands.add_parser("show", help="write one file of a snapshot to stdout")
+    show_parser.add_argument("snapshot")
+    show_parser.add_argument("file")
+
+    history_parser = commands.add_parser("history", help="list the snapshots that contain a file")
+    history_parser.add_argument("host")
+    history_parser.add_argument("file")
+
+    args = parser.parse_args(argv)
+    store = BackupStore(args.backup_dir)
+
+    try:
+        if args.command == "list" and args.snapshot:
+            for name, entry in store.find_snapshot(args.snapshot)["files"].items():
+                print(f"{entry['sha256'][:12]}  {entry['size'] if entry['size'] is not None else '?':>10}  {name}")
+        elif args.command == "list":
+            for entry in store.snapshots(args.host):
+                print(f"{entry['id']:<40}{entry['directory']:<32}{entry['files']:>6} files")
+        elif args.command == "diff" and args.file:
+            sys.stdout.write(diff_file(store, args.old, args.new, args.file))
+        elif args.command == "diff":
+            difference = diff_snapshots(store, args.old, args.new)
+            for prefix, names in (("+", difference.added), ("-", difference.removed), ("~", difference.changed)):
+                for name in names:
+                    print(f"{prefix} {name}")
+            print(difference)
+        elif args.command == "readers":
+            print("\n".join(format_diff(diff_snapshot_readers(store, args.old, args.new, args.file))))
+        elif args.command == "show":
+            entry = store.find_snapshot(args.snapshot)["files"][args.file]
+            sys.stdout.buffer.write(store.read(entry["sha256"]))
+        elif args.command == "history":
+            for snapshot_id, digest in store.file_history(args.host, args.file):
+                print(f"{snapshot_id:<40}{digest[:12]}")
+    except KeyError as e:
+        print(f"Error: {e.args[0]}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
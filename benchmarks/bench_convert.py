@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import ConversionSettings, ReaderRenderer, convert_file
+from readers import load_readers, parse_file
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+def generate_cccam_cfg(path, lines):
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(lines):
+            kind = i % 4
+            if kind == 0:
+                file.write(f"C: host{i}.example.com {10000 + i % 50000} user{i} pass{i}\n")
+            elif kind == 1:
+                file.write(f"N: host{i}.example.com {15000 + i % 50000} user{i} pass{i} 01 02 03 04 05 06 07 08 09 10 11 12 13 14\n")
+            elif kind == 2:
+                file.write(f"N: host{i}.example.com {15000 + i % 50000} user{i} pass{i} 01 02 03 04 05 06 07 08 09 10 11 12 13 14 # 0963:{i % 1000:06d}\n")
+            else:
+                file.write(f"# comment line {i}\n")
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_parse_render(source):
+    renderer = ReaderRenderer(ConversionSettings())
+    for record in parse_file(source):
+        renderer.render(record)
+
+
+def bench_parse_file_held(source):
+    # Keeps every parsed reader alive, as dedup and diff do
+    return load_readers(source)
+
+
+def bench_convert_file(source, destination):
+    convert_file(source, destination, ConversionSettings())
+
+
+def bench_convert_cached(source, destination):
+    # An unchanged file converted again with the cache of the previous run
+    convert_file(source, destination, ConversionSettings(), cache_path=destination + ".cache")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CCcam.cfg to oscam.server conversion")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of CCcam.cfg lines to generate (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    print(f"{'benchmark':<16}{'lines':>10}{'seconds':>10}{'lines/sec':>14}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            source = os.path.join(tmp_dir, f"CCcam_{size}.cfg")
+            destination = os.path.join(tmp_dir, f"oscam_{size}.server")
+            generate_cccam_cfg(source, size)
+
+            benchmarks = [
+                ("parse_render", bench_parse_render, (source,)),
+                ("parse_file_held", bench_parse_file_held, (source,)),
+                ("convert_file", bench_convert_file, (source, destination)),
+                ("convert_cached", bench_convert_cached, (source, destination)),
+            ]
+            bench_convert_cached(source, destination)
+            for name, function, function_args in benchmarks:
+                elapsed, peak = measure(function, *function_args)
+                print(f"{name:<16}{size:>10}{elapsed:>10.3f}{size / elapsed:>14,.0f}{peak / 1024 / 1024:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import hashlib
+
+# The ciphers used by the CCcam and newcamd logins, in plain Python so the
+# handshake check needs no extra packages. Only a few blocks are encrypted
+# per login, so speed does not matter here.
+
+
+class CCcamCipher:
+    # RC4-like stream cipher of the CCcam protocol; the state byte is chained
+    # with the plaintext, so each direction of a connection has its own cipher
+    def __init__(self, key):
+        table = list(range(256))
+        j = 0
+        for i in range(256):
+            j = (j + key[i % len(key)] + table[i]) & 0xff
+            table[i], table[j] = table[j], table[i]
+        self.table = table
+        self.state = key[0]
+        self.counter = 0
+        self.sum = 0
+
+    def crypt(self, data, decrypt):
+        table = self.table
+        output = bytearray(data)
+        for i, byte in enumerate(output):
+            self.counter = (self.counter + 1) & 0xff
+            self.sum = (self.sum + table[self.counter]) & 0xff
+            table[self.counter], table[self.sum] = table[self.sum], table[self.counter]
+            output[i] = byte ^ table[(table[self.counter] + table[self.sum]) & 0xff] ^ self.state
+            self.state ^= output[i] if decrypt else byte
+        return bytes(output)
+
+    def encrypt(self, data):
+        return self.crypt(data, False)
+
+    def decrypt(self, data):
+        return self.crypt(data, True)
+
+
+def cccam_xor(data):
+    # Mixes the 16 byte server greeting with "CCcam" before it is hashed
+    data = bytearray(data)
+    for i in range(8):
+        data[8 + i] = (i * data[i]) & 0xff
+        if i < 5:
+            data[i] ^= b"CCcam"[i]
+    return bytes(data)
+
+
+def cccam_ciphers(greeting, server=False):
+    # Both sides derive the same pair of ciphers from the greeting; what the
+    # client encrypts with, the server decrypts with and the other way round
+    seed = cccam_xor(greeting)
+    digest = hashlib.sha1(seed).digest()
+    first = CCcamCipher(digest)
+    seed = first.decrypt(seed)
+    second = CCcamCipher(seed)
+    digest = second.decrypt(digest)
+    receive, send = (second, first) if server else (first, second)
+    return receive, send, digest
+
+
+# DES tables, bit 1 being the most significant bit
+IP = (58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4,
+      62, 54, 46, 38, 30, 22, 14, 6, 64, 56, 48, 40, 32, 24, 16, 8,
+      57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+      61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7)
+FP = tuple(IP.index(bit) + 1 for bit in range(1, 65))
+E = (32, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 9, 8, 9, 10, 11, 12, 13, 12, 13, 14, 15, 16, 17,
+     16, 17, 18, 19, 20, 21, 20, 21, 22, 23, 24, 25, 24, 25, 26, 27, 28, 29, 28, 29, 30, 31, 32, 1)
+P = (16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+     2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25)
+PC1 = (57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18,
+       10, 2, 59, 51, 43, 35, 27, 19, 11, 3, 60, 52, 44, 36,
+       63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22,
+       14, 6, 61, 53, 45, 37, 29, 21, 13, 5, 28, 20, 12, 4)
+PC2 = (14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10, 23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+       41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48, 44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32)
+ROTATIONS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+SBOXES = (
+    (14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7, 0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0, 15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13),
+    (15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10, 3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15, 13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9),
+    (10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8, 13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7, 1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12),
+    (7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15, 13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4, 3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14),
+    (2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9, 14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14, 11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3),
+    (12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11, 10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6, 4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13),
+    (4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1, 13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2, 6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12),
+    (13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7, 1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8, 2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11),
+)
+
+
+def permute(value, table, width):
+    result = 0
+    for bit in table:
+        result = (result << 1) | ((value >> (width - bit)) & 1)
+    return result
+
+
+def permutation_tables(table, width):
+    # Per input byte, the output bits that byte contributes, so a permutation
+    # costs one lookup per byte instead of one shift per bit
+    return [[permute(byte << (width - 8 - 8 * position), table, width) for byte in range(256)]
+            for position in range(width // 8)]
+
+
+IP_TABLES = permutation_tables(IP, 64)
+FP_TABLES = permutation_tables(FP, 64)
+E_TABLES = permutation_tables(E, 32)
+# S-box i followed by P, indexed by the six expanded bits it reads
+SP_TABLES = [
+    [permute(sbox[((bits & 0x20) | ((bits & 1) << 4)) | ((bits >> 1) & 0xf)] << (28 - 4 * i), P, 32)
+     for bits in range(64)]
+    for i, sbox in enumerate(SBOXES)
+]
+
+
+def apply_tables(value, tables, width):
+    result = 0
+    shift = width - 8
+    for table in tables:
+        result |= table[(value >> shift) & 0xff]
+        shift -= 8
+    return result
+
+
+def des_subkeys(key):
+    bits = permute(int.from_bytes(key, "big"), PC1, 64)
+    left, right = bits >> 28, bits & 0xfffffff
+    subkeys = []
+    for rotation in ROTATIONS:
+        left = ((left << rotation) | (left >> (28 - rotation))) & 0xfffffff
+        right = ((right << rotation) | (right >> (28 - rotation))) & 0xfffffff
+        subkeys.append(permute((left << 28) | right, PC2, 56))
+    return subkeys
+
+
+def des_block(block, subkeys):
+    block = apply_tables(block, IP_TABLES, 64)
+    left, right = block >> 32, block & 0xffffffff
+    for subkey in subkeys:
+        bits = apply_tables(right, E_TABLES, 32) ^ subkey
+        mixed = 0
+        for i, table in enumerate(SP_TABLES):
+            mixed |= table[(bits >> (42 - 6 * i)) & 0x3f]
+        left, right = right, left ^ mixed
+    return apply_tables((right << 32) | left, FP_TABLES, 64)
+
+
+class TripleDES:
+    # Two-key EDE in CBC mode, as newcamd uses it
+    def __init__(self, key):
+        first, second = des_subkeys(key[:8]), des_subkeys(key[8:16])
+        self.encrypt_keys = (first, second[::-1], first)
+        self.decrypt_keys = (first[::-1], second, first[::-1])
+
+    def crypt_block(self, block, keys):
+        for subkeys in keys:
+            block = des_block(block, subkeys)
+        return block
+
+    def encrypt(self, data, iv):
+        output = bytearray()
+        chain = int.from_bytes(iv, "big")
+        for start in range(0, len(data), 8):
+            chain = self.crypt_block(int.from_bytes(data[start:start + 8], "big") ^ chain, self.encrypt_keys)
+            output += chain.to_bytes(8, "big")
+        return bytes(output)
+
+    def decrypt(self, data, iv):
+        output = bytearray()
+        chain = int.from_bytes(iv, "big")
+        for start in range(0, len(data), 8):
+            block = int.from_bytes(data[start:start + 8], "big")
+            output += (self.crypt_block(block, self.decrypt_keys) ^ chain).to_bytes(8, "big")
+            chain = block
+        return bytes(output)
+
+
+def spread_key(key):
+    # 14 key bytes carry the 112 key bits of two DES keys; every 7 bytes are
+    # spread over 8, leaving the low bit of each for the (unused) parity
+    spread = bytearray()
+    for half in (key[:7], key[7:14]):
+        bits = int.from_bytes(half, "big")
+        spread += bytes(((bits >> (49 - 7 * i)) & 0x7f) << 1 for i in range(8))
+    return bytes(spread)
+
+
+def newcamd_key(des_key, modifier):
+    # The configured DES key XORed with the server's 14 random bytes for the
+    # login, or with the crypted password for the rest of the session
+    key = bytearray(des_key)
+    for i, byte in enumerate(modifier):
+        key[i % 14] ^= byte
+    return spread_key(key)
+
+
+ITOA64 = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def md5_crypt(password, salt, magic="$1$"):
+    # The FreeBSD MD5 crypt(3), which newcamd sends instead of the password
+    password = password.encode("utf-8")
+    salt = salt.encode("ascii")[:8]
+    context = hashlib.md5(password + magic.encode("ascii") + salt)
+    final = hashlib.md5(password + salt + password).digest()
+    for length in range(len(password), 0, -16):
+        context.update(final[:min(16, length)])
+    length = len(password)
+    while length:
+        context.update(b"\0" if length & 1 else password[:1])
+        length >>= 1
+    final = context.digest()
+    for i in range(1000):
+        context = hashlib.md5(password if i & 1 else final)
+        if i % 3:
+            context.update(salt)
+        if i % 7:
+            context.update(password)
+        context.update(final if i & 1 else password)
+        final = context.digest()
+
+    encoded = []
+    for a, b, c in ((0, 6, 12), (1, 7, 13), (2, 8, 14), (3, 9, 15), (4, 10, 5)):
+        value = (final[a] << 16) | (final[b] << 8) | final[c]
+        encoded.extend(ITOA64[(value >> (6 * i)) & 0x3f] for i in range(4))
+    encoded.extend(ITOA64[(final[11] >> (6 * i)) & 0x3f] for i in range(2))
+    return f"{magic}{salt.decode('ascii')}${''.join(encoded)}"
@@ -1,12 +1,105 @@
-import datetime
 import os
 import sys
 from PyQt5.QtGui import QIcon, QIntValidator, QPalette, QColor
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, 
                              QTextEdit, QFileDialog, QHBoxLayout, QDialog, QMessageBox, 
-                             QScrollArea, QComboBox, QLineEdit, QStyle, QStyleFactory)
-from PyQt5.QtCore import Qt
+                             QComboBox, QLineEdit, QStyle, QStyleFactory,
+                             QTableWidget, QTableWidgetItem, QHeaderView, QCheckBox)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from ftp_connection import *
+from functools import partial
+from converter import ConversionReport, ConversionSettings, convert_file, convert_text, filter_lines
+from ftp_tasks import CONFIG_FILE
+from handshake import OK, verify_records
+from metrics import MetricsSettings, RunMetrics, timed
+from metrics_panel import MetricsPanel
+from readers import parse_file, parse_lines, scan_file
+from viewer import FileViewerDialog
+
+# Files above this size are converted straight from disk instead of the editor
+LARGE_FILE_SIZE = 16 * 1024 * 1024
+
+class ValidationReportDialog(QDialog):
+    def __init__(self, diagnostics, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Validation Report - {len(diagnostics)} lines skipped")
+        self.resize(800, 400)
+
+        layout = QVBoxLayout(self)
+        table = QTableWidget(len(diagnostics), 3)
+        table.setHorizontalHeaderLabels(["Line", "Reason", "Text"])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+
+        for row, diagnostic in enumerate(diagnostics):
+            lineItem = QTableWidgetItem()
+            lineItem.setData(Qt.DisplayRole, diagnostic.lineno)
+            table.setItem(row, 0, lineItem)
+            table.setItem(row, 1, QTableWidgetItem(diagnostic.reason))
+            table.setItem(row, 2, QTableWidgetItem(diagnostic.text))
+
+        table.resizeColumnToContents(0)
+        table.resizeColumnToContents(1)
+        table.setSortingEnabled(True)
+        layout.addWidget(table)
+
+class HandshakeReportDialog(QDialog):
+    def __init__(self, results, stats, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Login Check - {stats}")
+        self.resize(900, 500)
+
+        layout = QVBoxLayout(self)
+        table = QTableWidget(len(results), 5)
+        table.setHorizontalHeaderLabels(["Line", "Reader", "Status", "Time (ms)", "Detail"])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+
+        for row, result in enumerate(results):
+            lineItem = QTableWidgetItem()
+            lineItem.setData(Qt.DisplayRole, result.record.lineno)
+            table.setItem(row, 0, lineItem)
+            table.setItem(row, 1, QTableWidgetItem(f"{result.record.kind}: {result.record.label}"))
+            statusItem = QTableWidgetItem(result.status)
+            if result.status != OK:
+                statusItem.setForeground(QColor("#ff8080"))
+            table.setItem(row, 2, statusItem)
+            timeItem = QTableWidgetItem()
+            timeItem.setData(Qt.DisplayRole, round(result.duration * 1000))
+            table.setItem(row, 3, timeItem)
+            table.setItem(row, 4, QTableWidgetItem(result.detail))
+
+        for column in range(4):
+            table.resizeColumnToContents(column)
+        table.setSortingEnabled(True)
+        layout.addWidget(table)
+
+class WorkThread(QThread):
+    # Runs work that would block the window: converting a large file, or
+    # anything that connects to every server first
+    completed = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, work, parent=None):
+        super().__init__(parent)
+        self.work = work
+
+    def run(self):
+        # Every failure is reported, so whoever started the work gets its
+        # button back
+        try:
+            result = self.work()
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            return
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {str(e)}")
+            return
+        self.completed.emit(result)
 
 class MainWindow(QWidget):
     def __init__(self):
@@ -16,6 +109,7 @@ class MainWindow(QWidget):
         icon_path = os.path.join(script_dir, "icon.ico")
         self.setWindowIcon(QIcon(icon_path))
         self.resize(700, 700)
+        self.largeFile = None
         self.setupUI()
         self.setStyle(QStyleFactory.create('Fusion'))
         self.setStyleSheet("""
@@ -33,7 +127,7 @@ class MainWindow(QWidget):
             QPushButton:hover {
                 background-color: #5a5a5a;
             }
-            QTextEdit, QLineEdit, QComboBox {
+            QTextEdit, QLineEdit, QComboBox, QListView {
                 background-color: #3a3a3a;
                 border: 1px solid #646464;
                 border-radius: 3px;
@@ -94,9 +188,71 @@ class MainWindow(QWidget):
         groupLayout.addWidget(self.groupComboBox2)
         layout.addLayout(groupLayout)
 
-        convertButton = QPushButton("Convert to oscam.server")
-        convertButton.clicked.connect(self.convert)
-        layout.addWidget(convertButton)
+        groupingLayout = QHBoxLayout()
+        groupingLabel = QLabel("Automatic groups:")
+        self.groupingComboBox = QComboBox()
+        self.groupingComboBox.addItem("Off (groups above)", None)
+        self.groupingComboBox.addItem("Balance by count", "count")
+        self.groupingComboBox.addItem("By CAID", "caid")
+        self.groupingComboBox.addItem("By latency (checks servers)", "latency")
+        self.groupingComboBox.currentIndexChanged.connect(self.groupingChanged)
+        groupingLayout.addWidget(groupingLabel)
+        groupingLayout.addWidget(self.groupingComboBox)
+
+        groupCountLabel = QLabel("over groups:")
+        self.groupCountComboBox = QComboBox()
+        self.groupCountComboBox.addItems([str(i) for i in range(1, 65)])
+        self.groupCountComboBox.setCurrentText("64")
+        self.groupCountComboBox.setEnabled(False)
+        groupingLayout.addWidget(groupCountLabel)
+        groupingLayout.addWidget(self.groupCountComboBox)
+
+        shardsLabel = QLabel("Output files:")
+        self.shardsEdit = QLineEdit()
+        self.shardsEdit.setValidator(QIntValidator(1, 64))
+        self.shardsEdit.setText("1")
+        self.shardsEdit.setFixedWidth(50)
+        self.shardsEdit.setToolTip("Split the readers over this many files, oscam_1.server and so on, one per OSCam instance")
+        groupingLayout.addWidget(shardsLabel)
+        groupingLayout.addWidget(self.shardsEdit)
+        layout.addLayout(groupingLayout)
+
+        duplicatesLayout = QHBoxLayout()
+        duplicatesLabel = QLabel("Duplicate readers (same host, port and user):")
+        self.duplicatesComboBox = QComboBox()
+        self.duplicatesComboBox.addItem("Keep first", "first")
+        self.duplicatesComboBox.addItem("Keep last", "last")
+        self.duplicatesComboBox.addItem("Keep all (suffixed label)", "all")
+        duplicatesLayout.addWidget(duplicatesLabel)
+        duplicatesLayout.addWidget(self.duplicatesComboBox)
+        self.incrementalCheckBox = QCheckBox("Incremental")
+        self.incrementalCheckBox.setToolTip("Reuse readers from the previous conversion and report what changed")
+        duplicatesLayout.addWidget(self.incrementalCheckBox)
+        self.deterministicCheckBox = QCheckBox("Deterministic")
+        self.deterministicCheckBox.setToolTip("Omit the description timestamp and sort readers, so the same input always gives the same file")
+        duplicatesLayout.addWidget(self.deterministicCheckBox)
+        layout.addLayout(duplicatesLayout)
+
+        probeLayout = QHBoxLayout()
+        probeLabel = QLabel("Check servers before writing, readers that do not answer:")
+        self.probeComboBox = QComboBox()
+        self.probeComboBox.addItem("Don't check", None)
+        self.probeComboBox.addItem("Keep (note latency)", "keep")
+        self.probeComboBox.addItem("Use as fallback", "fallback")
+        self.probeComboBox.addItem("Disable", "disable")
+        self.probeComboBox.addItem("Drop", "drop")
+        probeLayout.addWidget(probeLabel)
+        probeLayout.addWidget(self.probeComboBox)
+        layout.addLayout(probeLayout)
+
+        self.convertButton = QPushButton("Convert to oscam.server")
+        self.convertButton.clicked.connect(self.convert)
+        layout.addWidget(self.convertButton)
+
+        self.verifyButton = QPushButton("Check Logins")
+        self.verifyButton.setToolTip("Log in to every server with the C/N-line credentials and report which logins work")
+        self.verifyButton.clicked.connect(self.verifyLogins)
+        layout.addWidget(self.verifyButton)
 
         viewButton = QPushButton("View oscam.server")
         viewButton.clicked.connect(self.viewContent)
@@ -110,6 +266,9 @@ class MainWindow(QWidget):
         helpButton.clicked.connect(self.showHelp)
         layout.addWidget(helpButton)
 
+        self.metricsPanel = MetricsPanel()
+        layout.addWidget(self.metricsPanel)
+
     def openFile(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
@@ -118,108 +277,157 @@ class MainWindow(QWidget):
         )
 
         if fileName:
+            if os.path.getsize(fileName) > LARGE_FILE_SIZE:
+                self.openLargeFile(fileName)
+                return
+
+            self.largeFile = None
+            self.textEdit.setReadOnly(False)
+            metrics = self.runMetrics("open").start()
             with open(fileName, "r", encoding="utf-8") as file:
-                cccam_cfg = file.read()
-                self.textEdit.setText(cccam_cfg)
-                self.filterLines()
+                cccam_cfg = (line.rstrip("\r\n") for line in timed(metrics, file, "read"))
+                self.textEdit.setPlainText("\n".join(timed(metrics, filter_lines(cccam_cfg), "filter")))
+            metrics.count("bytes read", os.path.getsize(fileName))
+            self.metricsPanel.show_metrics(metrics.finish())
+
+    def openLargeFile(self, fileName):
+        metrics = self.runMetrics("open").start()
+        with metrics.stage("scan"):
+            scan = scan_file(fileName)
+        metrics.count("bytes read", scan.size)
+        self.metricsPanel.show_metrics(metrics.finish())
+        self.largeFile = scan
+        self.textEdit.setReadOnly(True)
+        self.textEdit.setPlainText(
+            f"# Large file mode: {fileName}\n"
+            f"# {scan.size / 1024 / 1024:.1f} MB, {scan.c_lines} C-lines, {scan.n_lines} N-lines\n"
+            f"# Showing the first {len(scan.preview)} lines, conversion reads the whole file from disk\n\n"
+            + "\n".join(scan.preview)
+        )
 
     def filterLines(self):
+        if self.largeFile:
+            return
         cccam_cfg = self.textEdit.toPlainText().splitlines()
-        filtered_lines = [line for line in cccam_cfg if line.startswith(("C:", "N:"))]
-        self.textEdit.setText("\n".join(filtered_lines))
+        self.textEdit.setText("\n".join(filter_lines(cccam_cfg)))
+
+    def conversionSettings(self):
+        return ConversionSettings(
+            c_inactivity=self.inactivityEdit1.text(),
+            n_inactivity=self.inactivityEdit2.text(),
+            c_group=self.groupComboBox1.currentText(),
+            n_group=self.groupComboBox2.currentText(),
+            duplicates=self.duplicatesComboBox.currentData(),
+            deterministic=self.deterministicCheckBox.isChecked(),
+            probe=self.probeComboBox.currentData(),
+            grouping=self.groupingComboBox.currentData(),
+            group_count=self.groupCountComboBox.currentText(),
+            shards=self.shardsEdit.text() or "1"
+        )
+
+    def groupingChanged(self):
+        automatic = self.groupingComboBox.currentData() is not None
+        self.groupComboBox1.setEnabled(not automatic)
+        self.groupComboBox2.setEnabled(not automatic)
+        self.groupCountComboBox.setEnabled(automatic)
 
     def convert(self):
+        if self.largeFile:
+            self.convertLargeFile()
+            return
         cccam_cfg = self.textEdit.toPlainText().splitlines()
-        output = self.generate_header()
-
-        for line in cccam_cfg:
-            if line.strip():
-                config = self.process_line(line)
-                if config:
-                    output += config
-
-        if output:
-            self.save_oscam_server(output)
-
-    def generate_header(self):
-        return f"# Created with CCcam2OSCam Converter\n\n\n[reader]\nlabel\t\t= DELETE ME\nprotocol\t\t= cccam\ndevice\t\t= dummy.com,8888\n"
-
-    def process_line(self, line):
-        parts = line.split()
-        if len(parts) < 5:
-            QMessageBox.warning(self, "Format Error", f"Line is incomplete: {line}")
-            return None
-
-        protocol, server, port, user, password = parts[:5]
-        
-        if protocol == "N:":
-            return self.process_n_line(parts)
-        elif protocol == "C:":
-            return self.process_c_line(parts)
+        fileName = self.askSaveFileName()
+        if fileName:
+            self.startConversion(fileName, partial(
+                convert_text, cccam_cfg, fileName, self.conversionSettings(), self.conversionReport(),
+                self.cachePath(fileName)
+            ))
+
+    def checksServers(self):
+        # Probing takes up to a connect timeout, which the button tells while it runs
+        return bool(self.probeComboBox.currentData()) or self.groupingComboBox.currentData() == "latency"
+
+    def runMetrics(self, name):
+        # Settings are read per run, so profiling can be switched on in
+        # cccam2oscam.conf without restarting the GUI
+        return RunMetrics(name, MetricsSettings.load(CONFIG_FILE))
+
+    def conversionReport(self):
+        report = ConversionReport()
+        report.metrics = self.runMetrics("convert")
+        return report
+
+    def cachePath(self, fileName):
+        return fileName + ".cache" if self.incrementalCheckBox.isChecked() else None
+
+    def showValidationReport(self, diagnostics):
+        self.validationReport = ValidationReportDialog(diagnostics, self)
+        self.validationReport.setStyleSheet(self.styleSheet())
+        self.validationReport.move(self.x() + self.width() + 10, self.y())
+        self.validationReport.show()
+
+    def convertLargeFile(self):
+        fileName = self.askSaveFileName()
+        if not fileName:
+            return
+        self.startConversion(fileName, partial(
+            convert_file, self.largeFile.path, fileName, self.conversionSettings(), self.conversionReport(),
+            self.cachePath(fileName)
+        ))
+
+    def startConversion(self, fileName, convert):
+        self.convertThread = WorkThread(convert, self)
+        self.convertThread.completed.connect(lambda report: self.conversionFinished(fileName, report))
+        self.convertThread.failed.connect(self.conversionFailed)
+        self.convertButton.setEnabled(False)
+        self.convertButton.setText("Checking servers..." if self.checksServers() else "Converting...")
+        self.convertThread.start()
+
+    def conversionFinished(self, fileName, report):
+        self.convertButton.setEnabled(True)
+        self.convertButton.setText("Convert to oscam.server")
+        self.metricsPanel.show_metrics(report.metrics)
+        QMessageBox.information(self, "Success", f"File saved successfully: {fileName}\n{report.summary()}")
+        if report.diagnostics:
+            self.showValidationReport(report.diagnostics)
+
+    def conversionFailed(self, message):
+        self.convertButton.setEnabled(True)
+        self.convertButton.setText("Convert to oscam.server")
+        QMessageBox.critical(self, "Error", f"Conversion failed: {message}")
+
+    def verifyLogins(self):
+        if self.largeFile:
+            records = parse_file(self.largeFile.path)
         else:
-            return None
-
-    def process_n_line(self, parts):
-        server, port, user, password = parts[1:5]
-        key = "".join(parts[5:20]).replace(" ", "")
-        ident = ""
-        caid = ""
-
-        if "#" in key:
-            ident = parts[20].replace(" ", "")
-            caid = ident.split(":")[0]
-            key = key.replace("#", "")
-
-        config = f"\n[reader]\n"
-        config += f"label\t\t= {user}@{server}:{port} {ident}\n"
-        config += f"description\t\t= {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += f"protocol\t\t= newcamd\n"
-        config += f"device\t\t= {server},{port}\n"
-        config += f"key\t\t= {key}\n"
-        config += f"user\t\t= {user}\n"
-        config += f"password\t\t= {password}\n"
-        config += f"inactivitytimeout\t\t= {self.inactivityEdit2.text()}\n"
-        config += f"disableserverfilter\t= 1\n"
-        config += f"connectoninit\t\t= 1\n"
-        config += f"caid\t\t= {caid}\n"
-        config += f"ident\t\t= {ident}\n"
-        config += f"group\t\t= {self.groupComboBox2.currentText()}\n"
-        config += f"audisabled\t\t= 1\n"
-
-        return config
-
-    def process_c_line(self, parts):
-        server, port, user, password = parts[1:5]
-
-        config = f"\n[reader]\n"
-        config += f"label\t\t= {user}@{server}:{port}\n"
-        config += f"description\t\t= {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        config += f"protocol\t\t= cccam\n"
-        config += f"device\t\t= {server},{port}\n"
-        config += f"user\t\t= {user}\n"
-        config += f"password\t\t= {password}\n"
-        config += f"inactivitytimeout\t\t= {self.inactivityEdit1.text()}\n"
-        config += f"group\t\t= {self.groupComboBox1.currentText()}\n"
-        config += f"cccversion\t\t= 2.3.2\n"
-        config += f"audisabled\t\t= 1\n"
-
-        return config
-
-    def save_oscam_server(self, output):
+            records = parse_lines(self.textEdit.toPlainText().splitlines())
+        self.verifyThread = WorkThread(partial(verify_records, records), self)
+        self.verifyThread.completed.connect(self.loginsVerified)
+        self.verifyThread.failed.connect(self.verifyFailed)
+        self.verifyButton.setEnabled(False)
+        self.verifyButton.setText("Checking logins...")
+        self.verifyThread.start()
+
+    def loginsVerified(self, verification):
+        self.verifyButton.setEnabled(True)
+        self.verifyButton.setText("Check Logins")
+        results, stats = verification
+        self.handshakeReport = HandshakeReportDialog(results, stats, self)
+        self.handshakeReport.setStyleSheet(self.styleSheet())
+        self.handshakeReport.move(self.x() + self.width() + 10, self.y())
+        self.handshakeReport.show()
+
+    def verifyFailed(self, message):
+        self.verifyButton.setEnabled(True)
+        self.verifyButton.setText("Check Logins")
+        QMessageBox.critical(self, "Error", f"Login check failed: {message}")
+
+    def askSaveFileName(self):
         defaultFileName = "oscam.server"
         fileName, _ = QFileDialog.getSaveFileName(
             self, "Save oscam.server file", defaultFileName, "File oscam.server (*.server)"
         )
-
-        if fileName:
-            output = self.validateOscamServer(output)
-            with open(fileName, "w", encoding="utf-8") as file:
-                file.write(output)
-            QMessageBox.information(self, "Success", f"File saved successfully: {fileName}")
-
-    def validateOscamServer(self, content):
-        lines = content.splitlines()
-        return "\n".join(line.strip() for line in lines if not line.strip().endswith("="))
+        return fileName
 
     def viewContent(self):
         executable_dir = getattr(sys, '_MEIPASS', os.path.dirname(sys.argv[0]))
@@ -231,30 +439,13 @@ class MainWindow(QWidget):
         found_file = next((path for path in file_paths if os.path.exists(path)), None)
 
         if found_file:
-            with open(found_file, "r", encoding="utf-8") as file:
-                content = file.read()
-            if content:
-                self.showContentDialog(content)
+            dialog = FileViewerDialog(found_file, "View oscam.server", self)
+            dialog.move(self.x() + self.width() + 10, self.y())
+            dialog.setStyleSheet(self.styleSheet())
+            dialog.exec()
         else:
             QMessageBox.information(self, "Information", "oscam.server does not exist.")
 
-    def showContentDialog(self, content):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("View oscam.server")
-        dialog.resize(500, 800)
-        dialog.move(self.x() + self.width() + 10, self.y())
-
-        layout = QVBoxLayout(dialog)
-        scrollArea = QScrollArea(dialog)
-        scrollArea.setWidgetResizable(True)
-        contentLabel = QLabel(content)
-        contentLabel.setTextInteractionFlags(Qt.TextSelectableByMouse)
-        scrollArea.setWidget(contentLabel)
-        layout.addWidget(scrollArea)
-
-        dialog.setStyleSheet(self.styleSheet())
-        dialog.exec()
-
     def openWindowFTP(self):
         self.finestraFTP = FTPConnectionWindow()
         self.finestraFTP.show()
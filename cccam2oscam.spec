@@ -11,9 +11,9 @@ import datetime
 now = datetime.datetime.now()
 VERSIONE = f"1.{now.year % 10}.{now.month}.{now.day}"
 
-# Determina la lista di tutti i .py nella cartella
-import glob
-py_files = glob.glob("*.py")
+# Solo la GUI e' uno script di avvio: gli altri moduli (alcuni hanno una
+# propria CLI) vengono inclusi tramite i suoi import
+py_files = ["cccam2oscam.py"]
 
 
 a = Analysis(
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import math
+import os
+import re
+from array import array
+
+DIGEST_SIZE = 16
+# Reused blocks next to each other are copied in ranges of up to this size;
+# the render stage holds a batch of 1024 blocks, so larger ranges cost memory
+COPY_SIZE = 4096
+LABEL_RE = re.compile(rb"\nlabel\t\t= ([^\n]*)\n")
+
+
+class ReaderChanges:
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed"
+
+
+class CacheIndex:
+    # Per reader of a run the digests of its label and of its key, and the
+    # offset and length of its block in the blocks file, column by column
+    def __init__(self):
+        self.labels = bytearray()
+        self.keys = bytearray()
+        self.offsets = array("Q")
+        self.lengths = array("I")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, label, key, offset, length):
+        self.labels += label
+        self.keys += key
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def extend(self, index, start, end):
+        # Rows start to end of another index
+        self.labels += index.labels[start * DIGEST_SIZE:end * DIGEST_SIZE]
+        self.keys += index.keys[start * DIGEST_SIZE:end * DIGEST_SIZE]
+        self.offsets += index.offsets[start:end]
+        self.lengths += index.lengths[start:end]
+
+    def label(self, row):
+        return bytes(self.labels[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE])
+
+    def rows(self):
+        keys = self.keys
+        return {bytes(keys[start:start + DIGEST_SIZE]): row for row, start in enumerate(range(0, len(keys), DIGEST_SIZE))}
+
+    def write(self, file):
+        for column in (self.labels, self.keys, self.offsets, self.lengths):
+            file.write(column)
+
+    @classmethod
+    def read(cls, file, readers):
+        # Raises EOFError when the file is shorter than the index
+        index = cls()
+        index.labels = bytearray(readers * DIGEST_SIZE)
+        index.keys = bytearray(readers * DIGEST_SIZE)
+        for column in (index.labels, index.keys):
+            if file.readinto(column) != len(column):
+                raise EOFError("Cache index is truncated")
+        index.offsets.fromfile(file, readers)
+        index.lengths.fromfile(file, readers)
+        return index
+
+
+class ConversionCache:
+    # Reader blocks rendered by previous runs. A block is appended to the
+    # blocks file when it is rendered and stays there while its reader keeps
+    # the same key, a digest of its fields, the conversion settings and the
+    # suffix, group and probe state; a run only renders and writes the
+    # readers that are new or changed. path holds a JSON header line and the
+    # CacheIndex of the last run.
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = 0
+        self.previous = CacheIndex()
+        self.load()
+        self.rows = self.previous.rows()
+        self.seen = bytearray(len(self.previous))
+        self.current = CacheIndex()
+        # Rows of the current index rendered in this run
+        self.missed = array("L")
+        self.rendered = 0
+        self.reused = 0
+        self.fingerprint = None
+        self.settings_key = None
+        blocks_path = self.blocks_path(self.generation)
+        # Blocks of a cache that did not load are of no use, start over
+        self.blocks_file = open(blocks_path, "ab" if self.previous else "wb")
+        self.size = self.blocks_file.tell()
+        self.blocks = open(blocks_path, "rb")
+        self.position = 0
+
+    def blocks_path(self, generation):
+        return f"{self.path}.blocks.{generation}"
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                header = json.loads(file.readline(4096))
+                if header.get("version") != self.VERSION:
+                    return
+                previous = CacheIndex.read(file, header["readers"])
+            if os.path.getsize(self.blocks_path(header["generation"])) < header["size"]:
+                return
+        except (OSError, EOFError, ValueError, KeyError, TypeError, AttributeError):
+            return
+        self.generation = header["generation"]
+        self.previous = previous
+
+    def save(self):
+        generation = self.generation
+        # Replaced blocks stay in the file until they are more than half of it
+        if self.size > 2 * sum(self.current.lengths) + 1024 * 1024:
+            self.compact()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            header = {"version": self.VERSION, "generation": self.generation, "readers": len(self.current), "size": self.size}
+            file.write(json.dumps(header).encode("utf-8") + b"\n")
+            self.current.write(file)
+        os.replace(tmp_path, self.path)
+        self.close()
+        if self.generation != generation:
+            os.remove(self.blocks_path(generation))
+
+    def compact(self):
+        # Copies the blocks of this run into the blocks file of the next
+        # generation, which the index points to once it is saved
+        self.blocks_file.flush()
+        offsets = self.current.offsets
+        lengths = self.current.lengths
+        position = 0
+        with open(self.blocks_path(self.generation + 1), "wb") as file:
+            for row in range(len(offsets)):
+                file.write(self.read_block(offsets[row], lengths[row]))
+                offsets[row] = position
+                position += lengths[row]
+        self.generation += 1
+        self.size = position
+
+    def close(self):
+        self.blocks.close()
+        self.blocks_file.close()
+
+    def read_block(self, offset, length):
+        # Blocks are mostly read in the order they were written
+        if offset != self.position:
+            self.blocks.seek(offset)
+        self.position = offset + length
+        return self.blocks.read(length)
+
+    def key(self, record, fingerprint):
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.settings_key = hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=DIGEST_SIZE)
+        # Only whether the server answered; a reused block keeps the latency
+        # measured together with the timestamp it was rendered at
+        if record.latency is None:
+            probed = ""
+        else:
+            probed = "unreachable" if record.latency == math.inf else "reachable"
+        key = self.settings_key.copy()
+        key.update(f"{record.kind}\0{record.host}\0{record.port}\0{record.user}\0{record.password}\0{record.key}\0"
+                   f"{record.ident}\0{record.suffix}\0{probed}\0{record.group}".encode("utf-8"))
+        return key.digest()
+
+    def render_blocks(self, records, renderer):
+        # Yields the encoded blocks of records. Readers that are in the last
+        # run one after the other, with their blocks next to each other, are
+        # copied as one range.
+        rows = self.rows
+        offsets = self.previous.offsets
+        lengths = self.previous.lengths
+        start = end = 0
+        copy_start = copy_end = 0
+        for record in records:
+            key = self.key(record, renderer.fingerprint)
+            row = rows.get(key)
+            if row is not None and row == end and offsets[row] == copy_end and copy_end - copy_start < COPY_SIZE:
+                end += 1
+                copy_end += lengths[row]
+                continue
+            if end > start:
+                yield self.reuse(start, end)
+            if row is not None:
+                start, end = row, row + 1
+                copy_start, copy_end = offsets[row], offsets[row] + lengths[row]
+            else:
+                start = end = 0
+                yield self.render(record, renderer, key)
+        if end > start:
+            yield self.reuse(start, end)
+
+    def reuse(self, start, end):
+        previous = self.previous
+        self.seen[start:end] = b"\1" * (end - start)
+        self.current.extend(previous, start, end)
+        self.reused += end - start
+        offset = previous.offsets[start]
+        return self.read_block(offset, previous.offsets[end - 1] + previous.lengths[end - 1] - offset)
+
+    def render(self, record, renderer, key):
+        label_digest = hashlib.blake2b(record.label.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+        data = renderer.render(record).encode("utf-8")
+        self.blocks_file.write(data)
+        self.missed.append(len(self.current))
+        self.current.append(label_digest, key, self.size, len(data))
+        self.size += len(data)
+        self.rendered += 1
+        return data
+
+    def block_label(self, index, row):
+        match = LABEL_RE.search(self.read_block(index.offsets[row], index.lengths[row]))
+        return match.group(1).decode("utf-8") if match else ""
+
+    def changes(self):
+        # A rendered reader whose label was in the last run with another key
+        # changed; the labels are read back from the blocks
+        self.blocks_file.flush()
+        previous = self.previous
+        current = self.current
+        seen = self.seen
+        unseen = {previous.label(row) for row in range(len(seen)) if not seen[row]}
+        missed = {current.label(row) for row in self.missed}
+        added = [self.block_label(current, row) for row in self.missed if current.label(row) not in unseen]
+        changed = [self.block_label(current, row) for row in self.missed if current.label(row) in unseen]
+        removed = [self.block_label(previous, row) for row in range(len(seen)) if not seen[row] and previous.label(row) not in missed]
+        return ReaderChanges(added, removed, changed)
@@ -0,0 +1,388 @@
+import argparse
+import hashlib
+import os
+import sys
+from array import array
+from datetime import datetime
+from collections import defaultdict
+from functools import partial
+from conversion_cache import ConversionCache
+from dedup import POLICIES, DedupStats, deduplicate
+from grouping import GROUPING_MODES, MAX_GROUPS, GroupStats, assign_groups
+from metrics import RUN_LOG, MetricsSettings, RunMetrics, app_data_dir, stage, timed
+from probe import PROBE_POLICIES, UNREACHABLE, ProbeStats, probe_records
+from readers import ReaderTable, parse_file, parse_lines
+
+
+class ConversionSettings:
+    def __init__(self, c_inactivity="600", n_inactivity="-1", c_group="1", n_group="1", duplicates="first", deterministic=False,
+                 probe=None, probe_timeout=3.0, probe_concurrency=256, grouping=None, group_count=MAX_GROUPS, shards=1):
+        self.c_inactivity = str(c_inactivity)
+        self.n_inactivity = str(n_inactivity)
+        self.c_group = str(c_group)
+        self.n_group = str(n_group)
+        self.duplicates = duplicates
+        self.deterministic = deterministic
+        # None, or what to do with readers whose server does not answer
+        self.probe = probe
+        self.probe_timeout = probe_timeout
+        self.probe_concurrency = probe_concurrency
+        # None keeps c_group and n_group, otherwise how readers are spread
+        # over group_count groups; shards > 1 splits the output into files
+        self.grouping = grouping
+        self.group_count = int(group_count)
+        self.shards = int(shards)
+
+    def fingerprint(self):
+        return "|".join((self.c_inactivity, self.n_inactivity, self.c_group, self.n_group, str(self.deterministic), str(self.probe)))
+
+
+class ConversionReport:
+    def __init__(self):
+        self.diagnostics = []
+        self.duplicates = DedupStats()
+        self.readers = 0
+        self.changes = None
+        self.digest = None
+        self.probe = None
+        self.grouping = None
+        self.shards = []
+        # RunMetrics to time the stages of the conversion with, if any
+        self.metrics = None
+
+    def summary(self):
+        summary = f"{self.readers} readers written, {len(self.diagnostics)} lines skipped, {self.duplicates}"
+        if self.probe is not None:
+            summary += f"\n{self.probe}"
+        if self.grouping is not None:
+            summary += f"\n{self.grouping}"
+        if self.shards:
+            summary += "\nShards: " + ", ".join(f"{os.path.basename(path)} ({readers} readers)" for path, readers, _ in self.shards)
+        if self.changes is not None:
+            summary += f"\nChanges since last conversion: {self.changes}"
+        return summary
+
+
+def filter_lines(lines):
+    return (line for line in lines if line.startswith(("C:", "N:")))
+
+
+def generate_header():
+    return f"# Created with CCcam2OSCam Converter\n\n\n[reader]\nlabel\t\t= DELETE ME\nprotocol\t\t= cccam\ndevice\t\t= dummy.com,8888\n"
+
+
+def _line(name, value, separator="\t\t= "):
+    return f"{name}{separator}{value}\n" if value != "" else ""
+
+
+# Settings added to readers whose server did not answer the probe
+DEMOTE_LINES = {"fallback": "fallback\t\t= 1\n", "disable": "enable\t\t= 0\n"}
+
+
+class ReaderRenderer:
+    def __init__(self, settings, timestamp=None):
+        timestamp = timestamp or datetime.now()
+        self.fingerprint = settings.fingerprint()
+        self.probe = settings.probe
+        if settings.deterministic:
+            self.timestamp = None
+            description = ""
+        else:
+            self.timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            description = _line("description", self.timestamp)
+        self.c_head = description + "protocol\t\t= cccam\n"
+        self.c_inactivity = _line("inactivitytimeout", settings.c_inactivity)
+        self.c_group = _line("group", settings.c_group)
+        self.c_tail = "cccversion\t\t= 2.3.2\naudisabled\t\t= 1\n"
+        self.n_head = description + "protocol\t\t= newcamd\n"
+        self.n_inactivity = _line("inactivitytimeout", settings.n_inactivity) + "disableserverfilter\t= 1\nconnectoninit\t\t= 1\n"
+        self.n_group = _line("group", settings.n_group)
+        self.n_tail = "audisabled\t\t= 1\n"
+
+    def annotation(self, record):
+        # Description with the connect latency of a probed reader and, when its
+        # server did not answer, the setting the probe policy demotes it with.
+        # The latency is left out of deterministic output like the timestamp.
+        if record.latency is None:
+            return None
+        unreachable = record.latency == UNREACHABLE
+        annotation = ""
+        if self.timestamp is not None:
+            latency = "unreachable" if unreachable else f"{record.latency * 1000:.0f} ms"
+            annotation = _line("description", f"{self.timestamp}, {latency}")
+        if unreachable:
+            annotation += DEMOTE_LINES.get(self.probe, "")
+        return annotation
+
+    def render(self, record):
+        if record.kind == "C":
+            return self.render_c_line(record)
+        return self.render_n_line(record)
+
+    def render_c_line(self, record):
+        server = record.host
+        port = record.port
+        user = record.user
+        annotation = self.annotation(record)
+        head = self.c_head if annotation is None else annotation + "protocol\t\t= cccam\n"
+        group = self.c_group if record.group is None else f"group\t\t= {record.group}\n"
+        return (
+            f"\n[reader]\nlabel\t\t= {user}@{server}:{port}{record.suffix}\n{head}"
+            f"device\t\t= {server},{port}\nuser\t\t= {user}\npassword\t\t= {record.password}\n"
+            f"{self.c_inactivity}{group}{self.c_tail}"
+        )
+
+    def render_n_line(self, record):
+        server = record.host
+        port = record.port
+        user = record.user
+        ident = record.ident
+        if ident:
+            label = f"{user}@{server}:{port} {ident}{record.suffix}"
+            ident_lines = f"caid\t\t= {record.caid}\nident\t\t= {ident}\n"
+        else:
+            label = f"{user}@{server}:{port}{record.suffix}"
+            ident_lines = ""
+        annotation = self.annotation(record)
+        head = self.n_head if annotation is None else annotation + "protocol\t\t= newcamd\n"
+        group = self.n_group if record.group is None else f"group\t\t= {record.group}\n"
+        return (
+            f"\n[reader]\nlabel\t\t= {label}\n{head}"
+            f"device\t\t= {server},{port}\nkey\t\t= {record.key}\nuser\t\t= {user}\npassword\t\t= {record.password}\n"
+            f"{self.n_inactivity}{ident_lines}{group}{self.n_tail}"
+        )
+
+
+def reader_order(record):
+    return (record.protocol, record.host.lower(), record.port, record.user, record.ident, record.suffix, record.password, record.key)
+
+
+def reader_renderer(settings, timestamp=None, cache=None):
+    # Renders an iterable of records into blocks
+    renderer = ReaderRenderer(settings, timestamp)
+    if cache is not None:
+        return partial(cache.render_blocks, renderer=renderer)
+    return partial(map, renderer.render)
+
+
+def prepare_records(records, settings, report):
+    metrics = report.metrics
+    records = timed(metrics, deduplicate(records, settings.duplicates, report.duplicates), "deduplicate")
+    probe = settings.probe
+    if settings.grouping == "latency" and not probe:
+        # Latency groups need the latencies; nothing is demoted or dropped
+        probe = "keep"
+    if probe:
+        report.probe = ProbeStats()
+        records = timed(metrics, probe_records(records, probe, report.probe, settings.probe_concurrency, settings.probe_timeout), "probe")
+    if settings.grouping or settings.shards > 1:
+        report.grouping = GroupStats(settings.grouping)
+        with stage(metrics, "group"):
+            records = assign_groups(records, settings.grouping, settings.group_count, settings.shards, report.grouping)
+    if settings.deterministic:
+        with stage(metrics, "sort"):
+            records = sorted(records, key=reader_order)
+    return records
+
+
+def counted(records, report):
+    for record in records:
+        report.readers += 1
+        yield record
+
+
+def render_records(records, render, report):
+    yield generate_header()
+    yield from render(counted(records, report))
+
+
+def convert_records(records, settings, report=None, timestamp=None, cache=None):
+    if report is None:
+        report = ConversionReport()
+    render = reader_renderer(settings, timestamp, cache)
+    yield from timed(report.metrics, render_records(prepare_records(records, settings, report), render, report), "render")
+    if cache is not None:
+        report.changes = cache.changes()
+
+
+def digest_path(path):
+    return path + ".sha256"
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_digest(path):
+    # Uses the digest written next to the file by the converter when it is
+    # still current, so unchanged files are recognised without reading them.
+    try:
+        if os.path.getmtime(digest_path(path)) >= os.path.getmtime(path):
+            with open(digest_path(path), "r", encoding="utf-8") as file:
+                return file.read().split()[0]
+    except (OSError, IndexError):
+        pass
+    return file_digest(path)
+
+
+def write_oscam_server(path, blocks):
+    sha256 = hashlib.sha256()
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            # Blocks are rendered without empty values, so they are written as
+            # they are; blocks from the conversion cache are already encoded
+            for block in blocks:
+                data = block if isinstance(block, bytes) else block.encode("utf-8")
+                sha256.update(data)
+                file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # The blocks are generated while writing, so a failed parse or probe
+        # ends up here as well; do not leave the partial file behind
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    digest = sha256.hexdigest()
+    with open(digest_path(path), "w", encoding="utf-8") as file:
+        file.write(f"{digest}  {os.path.basename(path)}\n")
+    return digest
+
+
+def shard_path(path, shard):
+    # oscam.server -> oscam_1.server, one file per OSCam instance
+    root, extension = os.path.splitext(path)
+    return f"{root}_{shard}{extension}"
+
+
+def write_shards(destination, records, settings, report, timestamp=None, cache=None):
+    render = reader_renderer(settings, timestamp, cache)
+    # Sharded readers are grouped into a table, unless they were sorted
+    table = prepare_records(records, settings, report)
+    if not isinstance(table, ReaderTable):
+        table = ReaderTable(table)
+    shards = defaultdict(lambda: array("L"))
+    for row in range(len(table)):
+        shards[table.shard(row)].append(row)
+    for shard in range(1, settings.shards + 1):
+        path = shard_path(destination, shard)
+        records = (table[row] for row in shards[shard])
+        with stage(report.metrics, "write"):
+            digest = write_oscam_server(path, timed(report.metrics, render_records(records, render, report), "render"))
+        report.shards.append((path, len(shards[shard]), digest))
+    if cache is not None:
+        report.changes = cache.changes()
+
+
+def write_conversion(destination, records, settings, report, cache_path=None):
+    metrics = report.metrics
+    if metrics is not None:
+        metrics.start()
+    cache = None
+    try:
+        with stage(metrics, "load cache"):
+            cache = ConversionCache(cache_path) if cache_path else None
+        records = timed(metrics, records, "parse")
+        if settings.shards > 1:
+            write_shards(destination, records, settings, report, cache=cache)
+        else:
+            with stage(metrics, "write"):
+                report.digest = write_oscam_server(destination, convert_records(records, settings, report, cache=cache))
+        if cache is not None:
+            with stage(metrics, "save cache"):
+                cache.save()
+    finally:
+        if cache is not None:
+            cache.close()
+        if metrics is not None:
+            metrics.count("readers written", report.readers)
+            metrics.count("lines skipped", len(report.diagnostics))
+            metrics.count("duplicates removed", report.duplicates.removed)
+            paths = [path for path, _, _ in report.shards] or [destination]
+            metrics.count("bytes written", sum(os.path.getsize(path) for path in paths if os.path.exists(path)))
+            metrics.finish()
+    return report
+
+
+def convert_file(source, destination, settings, report=None, cache_path=None):
+    if report is None:
+        report = ConversionReport()
+    if report.metrics is not None:
+        report.metrics.count("bytes read", os.path.getsize(source))
+    return write_conversion(destination, parse_file(source, report.diagnostics), settings, report, cache_path)
+
+
+def convert_text(lines, destination, settings, report=None, cache_path=None):
+    if report is None:
+        report = ConversionReport()
+    return write_conversion(destination, parse_lines(lines, report.diagnostics), settings, report, cache_path)
+
+
+def add_conversion_arguments(parser):
+    parser.add_argument("--c-inactivity", type=int, default=600, help="inactivity timeout for C-lines in seconds (default: %(default)s)")
+    parser.add_argument("--n-inactivity", type=int, default=-1, help="inactivity timeout for N-lines in seconds (default: %(default)s)")
+    parser.add_argument("--c-group", type=int, choices=range(1, 65), default=1, metavar="1-64", help="group for C-lines (default: %(default)s)")
+    parser.add_argument("--n-group", type=int, choices=range(1, 65), default=1, metavar="1-64", help="group for N-lines (default: %(default)s)")
+    parser.add_argument("--duplicates", choices=POLICIES, default="first", help="keep the first or last of readers with the same host, port and user, or keep all with a suffixed label (default: %(default)s)")
+    parser.add_argument("--deterministic", action="store_true", help="omit the description timestamp and sort readers, so the same input always gives the same file")
+    parser.add_argument("--probe", choices=PROBE_POLICIES, help="connect to every reader's server first and keep, use as fallback, disable or drop the readers whose server does not answer")
+    parser.add_argument("--probe-timeout", type=float, default=3.0, help="connect timeout of the probe in seconds (default: %(default)s)")
+    parser.add_argument("--probe-concurrency", type=int, default=256, help="connections the probe opens at once (default: %(default)s)")
+    parser.add_argument("--auto-groups", choices=GROUPING_MODES, help="spread readers over groups evenly, by CAID or in latency tiers instead of using --c-group and --n-group")
+    parser.add_argument("--groups", type=int, choices=range(1, MAX_GROUPS + 1), default=MAX_GROUPS, metavar=f"1-{MAX_GROUPS}", help="groups --auto-groups spreads readers over (default: %(default)s)")
+
+
+def settings_from_arguments(args, shards=1):
+    return ConversionSettings(args.c_inactivity, args.n_inactivity, args.c_group, args.n_group, args.duplicates, args.deterministic,
+                              args.probe, args.probe_timeout, args.probe_concurrency, args.auto_groups, args.groups, shards)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert CCcam.cfg C/N-lines to oscam.server")
+    parser.add_argument("source", help="CCcam.cfg to convert")
+    parser.add_argument("-o", "--output", default="oscam.server", help="oscam.server to write (default: %(default)s)")
+    parser.add_argument("--cache", metavar="PATH", help="reuse readers rendered by previous runs from this cache file and report what changed")
+    parser.add_argument("--shards", type=int, default=1, help="split readers over this many files, oscam_1.server and so on, for separate OSCam instances (default: %(default)s)")
+    parser.add_argument("--metrics", metavar="PATH", help="also write the stage timings and counts of this run to a JSON file")
+    parser.add_argument("--log-run", action="store_true", help=f"append the stage timings and counts of this run to {RUN_LOG} in {app_data_dir()}")
+    parser.add_argument("--profile-slow", type=float, default=0.0, metavar="SECONDS", help="profile the run with cProfile and keep the dump in profiles/ when it takes this long (default: off)")
+    add_conversion_arguments(parser)
+    args = parser.parse_args(argv)
+
+    settings = settings_from_arguments(args, args.shards)
+    report = ConversionReport()
+    report.metrics = RunMetrics("convert", MetricsSettings(profile_slow=args.profile_slow, log=args.log_run))
+
+    try:
+        convert_file(args.source, args.output, settings, report, cache_path=args.cache)
+        if args.metrics:
+            report.metrics.save(args.metrics)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for diagnostic in report.diagnostics:
+        print(diagnostic, file=sys.stderr)
+    if report.changes is not None:
+        for prefix, labels in (("+", report.changes.added), ("-", report.changes.removed), ("~", report.changes.changed)):
+            for label in labels:
+                print(f"{prefix} {label}")
+    print(f"{args.output}: {report.summary()}")
+    print(report.metrics)
+    if report.shards:
+        for path, _, digest in report.shards:
+            print(f"sha256: {digest}  {path}")
+    else:
+        print(f"sha256: {report.digest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
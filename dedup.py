@@ -0,0 +1,84 @@
+import hashlib
+from readers import ReaderTable
+
+POLICIES = ("first", "last", "all")
+DIGEST_SIZE = 16
+
+
+class DedupStats:
+    def __init__(self):
+        self.exact = 0
+        self.near = 0
+
+    @property
+    def removed(self):
+        return self.exact + self.near
+
+    def __str__(self):
+        return f"{self.removed} duplicate readers removed ({self.exact} exact, {self.near} with different password or key)"
+
+
+def digest(fields):
+    return hashlib.blake2b(repr(fields).encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+def deduplicate(records, policy="first", stats=None):
+    # Readers are indexed by a digest of protocol, host, port, user and
+    # ident, so the index takes the same few bytes per reader however long
+    # the lines are. An exact duplicate also has the same digest of password
+    # and key and is always dropped; a near duplicate differs in password or
+    # key and is resolved by the policy.
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown duplicate policy '{policy}'")
+    if stats is None:
+        stats = DedupStats()
+
+    if policy == "first":
+        index = {}
+        for record in records:
+            identity = digest(record.identity)
+            secret = digest(record.secret)
+            kept = index.get(identity)
+            if kept is None:
+                index[identity] = secret
+                yield record
+            elif kept == secret:
+                stats.exact += 1
+            else:
+                stats.near += 1
+
+    elif policy == "last":
+        # The kept readers wait in a table until the input is read and the
+        # index holds their row
+        table = ReaderTable()
+        index = {}
+        for record in records:
+            identity = digest(record.identity)
+            row = index.get(identity)
+            if row is not None:
+                if table[row].secret == record.secret:
+                    stats.exact += 1
+                    continue
+                stats.near += 1
+            table.append_record(record)
+            index[identity] = len(table) - 1
+        for row in index.values():
+            yield table[row]
+
+    else:
+        # The secrets seen for an identity are their digests one after the
+        # other in a single bytes object
+        index = {}
+        for record in records:
+            identity = digest(record.identity)
+            secret = digest(record.secret)
+            secrets = index.get(identity)
+            if secrets is None:
+                index[identity] = secret
+                yield record
+            elif any(secrets[start:start + DIGEST_SIZE] == secret for start in range(0, len(secrets), DIGEST_SIZE)):
+                stats.exact += 1
+            else:
+                secrets = index[identity] = secrets + secret
+                record.suffix = f"_{len(secrets) // DIGEST_SIZE}"
+                yield record
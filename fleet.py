@@ -0,0 +1,207 @@
+import argparse
+import configparser
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import backup
+import ftp_tasks
+from ftp_tasks import CONFIG_FILE, CONFIG_LOCK, FTPTarget, TaskCancelled, TaskContext
+from readers import Diagnostic
+
+SECTION_RE = re.compile(r"\s*\[([^\]]+)\]")
+OPTION_RE = re.compile(r"([^=:\s][^=:]*?)\s*[=:]")
+
+
+class FleetHost(FTPTarget):
+    def __init__(self, name, host, username, password, directory, groups=(), timeout=30):
+        super().__init__(host, username, password, directory, timeout)
+        self.name = name
+        self.groups = list(groups)
+
+
+class HostResult:
+    def __init__(self, name, status, attempts, duration, message=""):
+        self.name = name
+        self.status = status
+        self.attempts = attempts
+        self.duration = duration
+        self.message = message
+
+    def __str__(self):
+        text = f"{self.name}: {self.status} in {self.duration:.1f}s"
+        if self.attempts > 1:
+            text += f" after {self.attempts} attempts"
+        return f"{text} ({self.message})" if self.message else text
+
+
+def config_lines(path):
+    # Line numbers of the sections and options of an INI file, keyed by the
+    # section and by (section, option); configparser does not keep them
+    lines = {}
+    section = None
+    try:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            for lineno, line in enumerate(file, 1):
+                match = SECTION_RE.match(line)
+                if match:
+                    section = match.group(1)
+                    lines[section] = lineno
+                elif section is not None and line[:1] not in " \t#;":
+                    match = OPTION_RE.match(line)
+                    if match:
+                        lines[(section, match.group(1).lower())] = lineno
+    except OSError:
+        pass
+    return lines
+
+
+def load_inventory(path=CONFIG_FILE, diagnostics=None):
+    # Hosts are [host <name>] sections of cccam2oscam.conf; missing credentials
+    # and directory fall back to the single host [FTP] section. A section
+    # without host, or with a timeout that is not a positive whole number,
+    # is skipped and reported to diagnostics with its line.
+    config = configparser.ConfigParser()
+    config.read(path)
+    defaults = config["FTP"] if config.has_section("FTP") else {}
+    lines = None
+    hosts = []
+    for section in config.sections():
+        if not section.startswith("host "):
+            continue
+        values = config[section]
+        host = values.get("host", "").strip()
+        timeout = values.get("timeout", defaults.get("timeout", "30")).strip()
+        if not host or not timeout.isdigit() or int(timeout) == 0:
+            if diagnostics is not None:
+                lines = lines if lines is not None else config_lines(path)
+                if not host:
+                    diagnostics.append(Diagnostic(lines.get(section), "no host, skipped", f"[{section}]"))
+                else:
+                    lineno = lines.get((section, "timeout")) if "timeout" in values else lines.get(("FTP", "timeout"))
+                    diagnostics.append(Diagnostic(lineno, "timeout is not a positive whole number, skipped", f"timeout = {timeout}"))
+            continue
+        hosts.append(FleetHost(
+            section[len("host "):],
+            host,
+            values.get("username", defaults.get("username", "root")),
+            values.get("password", defaults.get("password", "")),
+            values.get("directory", defaults.get("directory", "/etc/tuxbox/config/")),
+            [group.strip() for group in values.get("groups", "").split(",") if group.strip()],
+            int(timeout)
+        ))
+    return hosts
+
+
+def save_host(host, path=CONFIG_FILE):
+    with CONFIG_LOCK:
+        config = configparser.ConfigParser()
+        config.read(path)
+        config[f"host {host.name}"] = {
+            "host": host.host,
+            "username": host.username,
+            "password": host.password,
+            "directory": host.directory,
+            "groups": ", ".join(host.groups),
+            "timeout": str(host.timeout),
+        }
+        with open(path, "w") as config_file:
+            config.write(config_file)
+
+
+def remove_host(name, path=CONFIG_FILE):
+    with CONFIG_LOCK:
+        config = configparser.ConfigParser()
+        config.read(path)
+        config.remove_section(f"host {name}")
+        with open(path, "w") as config_file:
+            config.write(config_file)
+
+
+def select_hosts(hosts, selection):
+    selection = set(selection or ())
+    if not selection or "all" in selection:
+        return list(hosts)
+    return [host for host in hosts if host.name in selection or selection.intersection(host.groups)]
+
+
+def run_on_host(host, function, task, retries=1, retry_delay=5):
+    started = time.monotonic()
+    for attempt in range(1, retries + 2):
+        host_task = task.child(host.name)
+        value = None
+        try:
+            value = function(host, host_task)
+        except TaskCancelled:
+            return HostResult(host.name, "cancelled", attempt, time.monotonic() - started)
+        except Exception as e:
+            host_task.error(f"Error: {str(e)}")
+        if not host_task.errors:
+            # Operations that return something, like a restart's downtime, report it
+            return HostResult(host.name, "ok", attempt, time.monotonic() - started, "" if value is None else str(value))
+        if attempt <= retries:
+            delay = retry_delay * attempt
+            host_task.log(f"Retrying in {delay}s")
+            if task.cancelled.wait(delay):
+                return HostResult(host.name, "cancelled", attempt, time.monotonic() - started)
+    return HostResult(host.name, "failed", attempt, time.monotonic() - started, host_task.errors[-1])
+
+
+def run_fleet(hosts, function, task, concurrency=8, retries=1, on_result=None):
+    # Hosts run in parallel, so the whole run takes about as long as the
+    # slowest host rather than the sum of all of them.
+    started = time.monotonic()
+    results = []
+    if not hosts:
+        task.log("No hosts selected")
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(hosts))) as executor:
+        futures = [executor.submit(run_on_host, host, function, task, retries) for host in hosts]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            task.log(str(result))
+            if on_result:
+                on_result(result)
+
+    elapsed = time.monotonic() - started
+    succeeded = sum(1 for result in results if result.status == "ok")
+    task.log(f"Fleet finished: {succeeded}/{len(results)} hosts ok in {elapsed:.1f}s "
+             f"(hosts took {sum(result.duration for result in results):.1f}s in total)")
+    return results
+
+
+OPERATIONS = {
+    "upload": ftp_tasks.upload_oscam_server,
+    "reload": partial(ftp_tasks.upload_oscam_server, reload=True),
+    "backup": backup.backup_configuration,
+    "restart": ftp_tasks.restart_oscam,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an operation on every receiver of the inventory in cccam2oscam.conf")
+    parser.add_argument("operation", choices=sorted(OPERATIONS))
+    parser.add_argument("hosts", nargs="*", help="host names or groups (default: all)")
+    parser.add_argument("--file", default="oscam.server", help="oscam.server to upload (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="hosts handled at the same time (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=1, help="retries per failed host (default: %(default)s)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="configuration file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    diagnostics = []
+    hosts = select_hosts(load_inventory(args.config, diagnostics), args.hosts)
+    for diagnostic in diagnostics:
+        print(f"{args.config} {diagnostic}", file=sys.stderr)
+    function = OPERATIONS[args.operation]
+    if args.operation in ("upload", "reload"):
+        function = partial(function, local_path=args.file)
+
+    results = run_fleet(hosts, function, TaskContext(), args.concurrency, args.retries)
+    return 0 if results and all(result.status == "ok" for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,37 @@
 import configparser
-import ftplib
 import os
 import sys
 import inspect
-from datetime import datetime
-import requests
-from PyQt5.QtGui import QIcon
+from PyQt5.QtGui import QIcon, QIntValidator
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QTextEdit, 
                              QVBoxLayout, QWidget, QLabel, QLineEdit, QComboBox, 
                              QHBoxLayout, QDialog, QGridLayout, QMessageBox, 
-                             QStyleFactory)
-from PyQt5.QtCore import Qt
-
-class OscamServerWindow(QDialog):
-    def __init__(self, file_data):
-        super().__init__()
-        self.setWindowTitle("oscam.server Viewer")
+                             QStyleFactory, QListWidget, QTableWidget, 
+                             QTableWidgetItem, QInputDialog, QHeaderView)
+from PyQt5.QtCore import Qt, pyqtSignal
+from functools import partial
+import backup
+import fleet
+import ftp_tasks
+import oscam_config
+from ftp_sessions import SESSIONS
+from ftp_tasks import FTPTarget
+from metrics import MetricsSettings
+from metrics_panel import MetricsPanel
+from viewer import FileViewerDialog
+from workers import Worker, WorkerPool
+
+class OscamServerWindow(FileViewerDialog):
+    def __init__(self, path, streaming=False):
+        super().__init__(path, "oscam.server Viewer", streaming=streaming)
         self.resize(500, 650)
 
-        layout = QVBoxLayout()
-        self.text_edit = QTextEdit()
-        self.text_edit.setReadOnly(True)
-        layout.addWidget(self.text_edit)
-        self.setLayout(layout)
-
-        self.text_edit.setPlainText("\n".join(file_data))
-
         self.setStyleSheet("""
             QWidget {
                 background-color: #2b2b2b;
                 color: #ffffff;
             }
-            QTextEdit {
+            QListView, QLineEdit {
                 background-color: #3a3a3a;
                 border: 1px solid #646464;
                 border-radius: 3px;
@@ -39,7 +39,252 @@ class OscamServerWindow(QDialog):
             }
         """)
 
+class ReaderDiffDialog(QDialog):
+    def __init__(self, difference, old_title, new_title, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Reader Changes - {difference}")
+        self.resize(800, 500)
+
+        rows = [("added", label, "", "", "") for label in difference.added]
+        rows += [("removed", label, "", "", "") for label in difference.removed]
+        rows += [
+            ("changed", label, key, oscam_config.format_value(key, old), oscam_config.format_value(key, new))
+            for label in difference.changed for key, old, new in difference.fields[label]
+        ]
+
+        layout = QVBoxLayout(self)
+        table = QTableWidget(len(rows), 5)
+        table.setHorizontalHeaderLabels(["Change", "Reader", "Setting", old_title, new_title])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                table.setItem(row, column, QTableWidgetItem(value))
+        table.setSortingEnabled(True)
+        layout.addWidget(table)
+        layout.addWidget(QLabel(str(difference)))
+
+class BackupsWindow(QDialog):
+    def __init__(self, ftp_window, target):
+        super().__init__(ftp_window)
+        self.setWindowTitle(f"Backups of {target.host}")
+        self.resize(700, 500)
+        self.ftp_window = ftp_window
+        self.target = target
+        self.store = backup.BackupStore()
+        self.entries = self.store.snapshots(target.host)
+
+        layout = QVBoxLayout(self)
+        lists_layout = QHBoxLayout()
+        self.snapshot_list = QListWidget()
+        for entry in reversed(self.entries):
+            self.snapshot_list.addItem(f"{entry['timestamp']}  {entry['directory']}  ({entry['files']} files)")
+        self.snapshot_list.currentRowChanged.connect(self.show_files)
+        lists_layout.addWidget(self.snapshot_list)
+        self.file_list = QListWidget()
+        lists_layout.addWidget(self.file_list)
+        layout.addLayout(lists_layout)
+
+        self.output = QTextEdit()
+        self.output.setReadOnly(True)
+        layout.addWidget(self.output)
+
+        button_layout = QHBoxLayout()
+        diff_button = QPushButton("Diff with Previous")
+        diff_button.clicked.connect(self.diff_with_previous)
+        button_layout.addWidget(diff_button)
+        readers_button = QPushButton("Reader Diff")
+        readers_button.clicked.connect(self.reader_diff_with_previous)
+        button_layout.addWidget(readers_button)
+        restore_button = QPushButton("Restore File")
+        restore_button.clicked.connect(self.restore_file)
+        button_layout.addWidget(restore_button)
+        layout.addLayout(button_layout)
+
+        self.setStyleSheet(ftp_window.styleSheet())
+
+    def selected_entry(self):
+        row = self.snapshot_list.currentRow()
+        if row < 0:
+            return None, None
+        index = len(self.entries) - 1 - row
+        previous = self.entries[index - 1] if index > 0 else None
+        return self.entries[index], previous
+
+    def show_files(self):
+        entry, _ = self.selected_entry()
+        self.file_list.clear()
+        if entry:
+            self.file_list.addItems(list(self.store.load_snapshot(entry["manifest"])["files"]))
+
+    def diff_with_previous(self):
+        entry, previous = self.selected_entry()
+        if entry is None or previous is None:
+            self.output.setPlainText("Select a snapshot that has an earlier one to compare with.")
+            return
+        file_item = self.file_list.currentItem()
+        if file_item:
+            diff = backup.diff_file(self.store, previous["id"], entry["id"], file_item.text())
+            self.output.setPlainText(diff or f"{file_item.text()} is unchanged")
+        else:
+            difference = backup.diff_snapshots(self.store, previous["id"], entry["id"])
+            lines = [f"{prefix} {name}" for prefix, names in
+                     (("+", difference.added), ("-", difference.removed), ("~", difference.changed))
+                     for name in names]
+            self.output.setPlainText("\n".join(lines + [str(difference)]))
+
+    def reader_diff_with_previous(self):
+        entry, previous = self.selected_entry()
+        if entry is None or previous is None:
+            self.output.setPlainText("Select a snapshot that has an earlier one to compare with.")
+            return
+        file_item = self.file_list.currentItem()
+        name = file_item.text() if file_item else "oscam.server"
+        difference = backup.diff_snapshot_readers(self.store, previous["id"], entry["id"], name)
+        ReaderDiffDialog(difference, previous["timestamp"], entry["timestamp"], self).exec_()
+
+    def restore_file(self):
+        entry, _ = self.selected_entry()
+        file_item = self.file_list.currentItem()
+        if entry is None or file_item is None:
+            self.output.setPlainText("Select a snapshot and a file to restore.")
+            return
+        self.ftp_window.run_task("Restore", backup.restore_file, self.target, entry["id"], file_item.text())
+
+class FleetWindow(QDialog):
+    host_finished = pyqtSignal(object)
+
+    def __init__(self, ftp_window):
+        super().__init__(ftp_window)
+        self.setWindowTitle("Fleet")
+        self.resize(750, 450)
+        self.ftp_window = ftp_window
+        self.rows = {}
+        self.host_finished.connect(self.show_result)
+
+        layout = QVBoxLayout(self)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Group:"))
+        self.group_dropdown = QComboBox()
+        self.group_dropdown.currentIndexChanged.connect(self.show_hosts)
+        filter_layout.addWidget(self.group_dropdown)
+        filter_layout.addWidget(QLabel("Parallel hosts:"))
+        self.concurrency_input = QLineEdit("8")
+        self.concurrency_input.setValidator(QIntValidator(1, 64, self))
+        filter_layout.addWidget(self.concurrency_input)
+        filter_layout.addWidget(QLabel("Retries:"))
+        self.retries_input = QLineEdit("1")
+        self.retries_input.setValidator(QIntValidator(0, 10, self))
+        filter_layout.addWidget(self.retries_input)
+        layout.addLayout(filter_layout)
+
+        self.table = QTableWidget(0, 6)
+        self.table.setHorizontalHeaderLabels(["Name", "Host", "Directory", "Groups", "Status", "Time"])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        layout.addWidget(self.table)
+
+        inventory_layout = QHBoxLayout()
+        add_button = QPushButton("Add Current Host")
+        add_button.clicked.connect(self.add_current_host)
+        inventory_layout.addWidget(add_button)
+        remove_button = QPushButton("Remove Host")
+        remove_button.clicked.connect(self.remove_host)
+        inventory_layout.addWidget(remove_button)
+        layout.addLayout(inventory_layout)
+
+        operation_layout = QHBoxLayout()
+        for label, operation in (("Upload oscam.server", "upload"), ("Upload && Reload Readers", "reload"),
+                                 ("Backup", "backup"), ("Restart Oscam", "restart")):
+            button = QPushButton(label)
+            button.clicked.connect(lambda checked, operation=operation: self.run_operation(operation))
+            operation_layout.addWidget(button)
+        layout.addLayout(operation_layout)
+
+        self.setStyleSheet(ftp_window.styleSheet())
+        self.load_inventory()
+
+    def load_inventory(self):
+        diagnostics = []
+        self.hosts = fleet.load_inventory(diagnostics=diagnostics)
+        for diagnostic in diagnostics:
+            self.ftp_window.console.append(f"{ftp_tasks.CONFIG_FILE} {diagnostic}")
+        groups = sorted({group for host in self.hosts for group in host.groups})
+        self.group_dropdown.blockSignals(True)
+        self.group_dropdown.clear()
+        self.group_dropdown.addItem("All hosts", "all")
+        for group in groups:
+            self.group_dropdown.addItem(group, group)
+        self.group_dropdown.blockSignals(False)
+        self.show_hosts()
+
+    def selected_hosts(self):
+        return fleet.select_hosts(self.hosts, [self.group_dropdown.currentData() or "all"])
+
+    def show_hosts(self):
+        hosts = self.selected_hosts()
+        self.rows = {}
+        self.table.setRowCount(len(hosts))
+        for row, host in enumerate(hosts):
+            self.rows[host.name] = row
+            for column, value in enumerate((host.name, host.host, host.directory, ", ".join(host.groups), "", "")):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+    def add_current_host(self):
+        if not self.ftp_window.check_ftp_configuration():
+            return
+        target = self.ftp_window.ftp_target()
+        name, ok = QInputDialog.getText(self, "Add Host", "Name:", text=target.host)
+        if not ok or not name:
+            return
+        groups, ok = QInputDialog.getText(self, "Add Host", "Groups (comma separated):")
+        if not ok:
+            return
+        fleet.save_host(fleet.FleetHost(
+            name, target.host, target.username, target.password, target.directory,
+            [group.strip() for group in groups.split(",") if group.strip()], target.timeout
+        ))
+        self.load_inventory()
+
+    def remove_host(self):
+        row = self.table.currentRow()
+        if row < 0:
+            return
+        fleet.remove_host(self.table.item(row, 0).text())
+        self.load_inventory()
+
+    def run_operation(self, operation):
+        hosts = self.selected_hosts()
+        if not hosts:
+            self.ftp_window.console.append("No hosts in the inventory, add one first")
+            return
+        for host in hosts:
+            self.table.item(self.rows[host.name], 4).setText("queued")
+            self.table.item(self.rows[host.name], 5).setText("")
+        function = fleet.OPERATIONS[operation]
+        run_fleet = partial(
+            fleet.run_fleet,
+            concurrency=int(self.concurrency_input.text() or 8),
+            retries=int(self.retries_input.text() or 0),
+            on_result=self.host_finished.emit
+        )
+        self.ftp_window.run_task(f"Fleet {operation}", run_fleet, hosts, function)
+
+    def show_result(self, result):
+        row = self.rows.get(result.name)
+        if row is None:
+            return
+        status = result.status if result.attempts == 1 else f"{result.status} ({result.attempts} attempts)"
+        self.table.item(row, 4).setText(status)
+        self.table.item(row, 4).setToolTip(result.message)
+        self.table.item(row, 5).setText(f"{result.duration:.1f}s")
+
 class FTPConnectionWindow(QMainWindow):
+    download_started = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("FTP Connection Enigma2")
@@ -55,6 +300,11 @@ class FTPConnectionWindow(QMainWindow):
         self.default_username = "root"
         self.default_password = ""
         self.default_directory = "/etc/tuxbox/config/"
+        self.default_timeout = "30"
+        self.pool = WorkerPool()
+        self.fleet_window = None
+        self.oscam_server_window = None
+        self.download_started.connect(self.stream_remote_oscam_server)
 
         self.setup_ui()
         self.load_configuration()
@@ -137,6 +387,12 @@ class FTPConnectionWindow(QMainWindow):
         form_layout.addWidget(directory_label, 3, 0)
         form_layout.addWidget(self.directory_dropdown, 3, 1)
 
+        timeout_label = QLabel("Timeout (seconds):")
+        self.timeout_input = QLineEdit(self.default_timeout)
+        self.timeout_input.setValidator(QIntValidator(1, 600))
+        form_layout.addWidget(timeout_label, 4, 0)
+        form_layout.addWidget(self.timeout_input, 4, 1)
+
         layout.addLayout(form_layout)
 
         self.console = QTextEdit()
@@ -144,6 +400,9 @@ class FTPConnectionWindow(QMainWindow):
         self.console.setMinimumHeight(100)
         layout.addWidget(self.console)
 
+        self.metrics_panel = MetricsPanel()
+        layout.addWidget(self.metrics_panel)
+
         button_layout1 = QHBoxLayout()
         test_button = QPushButton("Test Connection")
         test_button.clicked.connect(self.test_connection)
@@ -152,6 +411,10 @@ class FTPConnectionWindow(QMainWindow):
         upload_button = QPushButton("Upload oscam.server")
         upload_button.clicked.connect(self.upload_oscam_server)
         button_layout1.addWidget(upload_button)
+
+        reload_button = QPushButton("Upload && Reload Readers")
+        reload_button.clicked.connect(self.reload_oscam_server)
+        button_layout1.addWidget(reload_button)
         layout.addLayout(button_layout1)
 
         button_layout2 = QHBoxLayout()
@@ -162,6 +425,10 @@ class FTPConnectionWindow(QMainWindow):
         download_button = QPushButton("Download oscam.server")
         download_button.clicked.connect(self.download_oscam_server)
         button_layout2.addWidget(download_button)
+
+        compare_button = QPushButton("Compare with Local")
+        compare_button.clicked.connect(self.compare_oscam_server)
+        button_layout2.addWidget(compare_button)
         layout.addLayout(button_layout2)
 
         button_layout3 = QHBoxLayout()
@@ -169,6 +436,10 @@ class FTPConnectionWindow(QMainWindow):
         backup_button.clicked.connect(self.backup_configuration)
         button_layout3.addWidget(backup_button)
 
+        backups_button = QPushButton("Backups")
+        backups_button.clicked.connect(self.show_backups)
+        button_layout3.addWidget(backups_button)
+
         restart_button = QPushButton("Restart Oscam")
         restart_button.clicked.connect(self.restart_oscam)
         button_layout3.addWidget(restart_button)
@@ -178,207 +449,139 @@ class FTPConnectionWindow(QMainWindow):
         save_button = QPushButton("Save Configuration")
         save_button.clicked.connect(self.save_configuration)
         button_layout4.addWidget(save_button)
+
+        fleet_button = QPushButton("Fleet")
+        fleet_button.clicked.connect(self.show_fleet)
+        button_layout4.addWidget(fleet_button)
+
+        cancel_button = QPushButton("Cancel Operations")
+        cancel_button.clicked.connect(self.cancel_tasks)
+        button_layout4.addWidget(cancel_button)
         layout.addLayout(button_layout4)
 
     def load_configuration(self):
         config = configparser.ConfigParser()
         try:
-            config.read("cccam2oscam.conf")
+            config.read(ftp_tasks.CONFIG_FILE)
             self.host_input.setText(config.get("FTP", "host"))
             self.username_input.setText(config.get("FTP", "username"))
             self.password_input.setText(config.get("FTP", "password"))
             self.directory_dropdown.setCurrentText(config.get("FTP", "directory"))
+            self.timeout_input.setText(config.get("FTP", "timeout", fallback=self.default_timeout))
         except configparser.Error:
             pass
 
     def save_configuration(self):
         config = configparser.ConfigParser()
+        config.read(ftp_tasks.CONFIG_FILE)
         config["FTP"] = {
             "host": self.host_input.text(),
             "username": self.username_input.text(),
             "password": self.password_input.text(),
-            "directory": self.directory_dropdown.currentText()
+            "directory": self.directory_dropdown.currentText(),
+            "timeout": self.timeout_input.text()
         }
-        with open("cccam2oscam.conf", "w") as config_file:
+        with open(ftp_tasks.CONFIG_FILE, "w") as config_file:
             config.write(config_file)
         self.console.append("Configuration saved successfully.")
 
+    def ftp_target(self):
+        return FTPTarget(
+            self.host_input.text(),
+            self.username_input.text(),
+            self.password_input.text(),
+            self.directory_dropdown.currentText(),
+            int(self.timeout_input.text() or 30)
+        )
+
+    def run_task(self, name, function, *args, on_finished=None):
+        worker = Worker(name, function, *args, metrics_settings=MetricsSettings.load(ftp_tasks.CONFIG_FILE))
+        worker.signals.message.connect(self.console.append)
+        worker.signals.measured.connect(self.metrics_panel.show_metrics)
+        worker.signals.progress.connect(self.console.append)
+        worker.signals.failed.connect(self.console.append)
+        if on_finished:
+            worker.signals.finished.connect(on_finished)
+        self.console.append(f"{name} started")
+        self.pool.start(worker)
+
+    def cancel_tasks(self):
+        count = self.pool.cancel_all()
+        self.console.append(f"Cancelling {count} running operation(s)" if count else "No running operations to cancel")
+
     def test_connection(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            username = self.username_input.text()
-            password = self.password_input.text()
-
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(username, password)
-                response = ftp.getwelcome()
-                ftp.quit()
-                self.console.append("Connection successful!")
-                self.console.append(response)
-            except ftplib.all_errors as e:
-                self.console.append("Error connecting to FTP: " + str(e))
+            self.run_task("Test connection", ftp_tasks.test_connection, self.ftp_target())
 
     def upload_oscam_server(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            username = self.username_input.text()
-            password = self.password_input.text()
-            directory = self.directory_dropdown.currentText()
-
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(username, password)
-                ftp.cwd(directory)
-                
-                try:
-                    backup_name = f"oscam.server.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                    ftp.rename("oscam.server", backup_name)
-                    self.console.append(f"Created backup of remote file as {backup_name}")
-                except ftplib.error_perm:
-                    self.console.append("No existing remote file to backup")
-
-                with open("oscam.server", "rb") as file:
-                    ftp.storbinary("STOR oscam.server", file)
-                ftp.quit()
-                self.console.append(f"File 'oscam.server' uploaded successfully to {directory}")
-            except ftplib.all_errors as e:
-                self.console.append("Error uploading file: " + str(e))
+            self.run_task("Upload", ftp_tasks.upload_oscam_server, self.ftp_target())
 
-    def download_oscam_server(self):
+    def reload_oscam_server(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            username = self.username_input.text()
-            password = self.password_input.text()
-            directory = self.directory_dropdown.currentText()
+            self.run_task("Upload and reload", partial(ftp_tasks.upload_oscam_server, reload=True), self.ftp_target())
 
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(username, password)
-                ftp.cwd(directory)
+    def download_oscam_server(self):
+        if self.check_ftp_configuration():
+            self.run_task("Download", ftp_tasks.download_oscam_server, self.ftp_target())
 
-                if os.path.exists("oscam.server"):
-                    backup_name = f"oscam.server.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                    os.rename("oscam.server", backup_name)
-                    self.console.append(f"Created backup of local file as {backup_name}")
+    def view_oscam_server(self):
+        if self.check_ftp_configuration():
+            target = self.ftp_target()
+            # The new viewer replaces the previous one
+            if self.oscam_server_window is not None:
+                self.oscam_server_window.close()
+                self.oscam_server_window = None
+            self.run_task(
+                "View", ftp_tasks.fetch_oscam_server, target, self.download_started.emit,
+                on_finished=lambda path: self.show_remote_oscam_server(path, target.directory)
+            )
 
-                with open("oscam.server", "wb") as file:
-                    ftp.retrbinary("RETR oscam.server", file.write)
+    def stream_remote_oscam_server(self, path):
+        self.oscam_server_window = OscamServerWindow(path, streaming=True)
+        self.oscam_server_window.show()
+
+    def show_remote_oscam_server(self, path, directory):
+        window = self.oscam_server_window
+        if not path:
+            if window is not None:
+                window.close()
+                self.oscam_server_window = None
+            return
+        if window is not None:
+            window.finishStreaming()
+        else:
+            self.oscam_server_window = OscamServerWindow(path)
+            self.oscam_server_window.show()
+        self.console.append(f"File 'oscam.server' viewed successfully from {directory}")
+
+    def compare_oscam_server(self):
+        if self.check_ftp_configuration():
+            self.run_task("Compare", ftp_tasks.compare_oscam_server, self.ftp_target(),
+                          on_finished=self.show_reader_diff)
 
-                ftp.quit()
-                self.console.append("File 'oscam.server' downloaded successfully")
-            except ftplib.all_errors as e:
-                self.console.append("Error downloading file: " + str(e))
+    def show_reader_diff(self, difference):
+        if difference is not None:
+            ReaderDiffDialog(difference, "Receiver", "Local", self).exec_()
 
-    def view_oscam_server(self):
+    def backup_configuration(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            username = self.username_input.text()
-            password = self.password_input.text()
-            directory = self.directory_dropdown.currentText()
-
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(username, password)
-                ftp.cwd(directory)
-                file_data = []
-                ftp.retrlines('RETR oscam.server', file_data.append)
-                ftp.quit()
-
-                oscam_server_window = OscamServerWindow(file_data)
-                oscam_server_window.exec_()
-
-                self.console.append(f"File 'oscam.server' viewed successfully from {directory}")
-            except ftplib.all_errors as e:
-                self.console.append("Error viewing file: " + str(e))
+            self.run_task("Backup", backup.backup_configuration, self.ftp_target())
 
-    def backup_configuration(self):
+    def show_backups(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            username = self.username_input.text()
-            password = self.password_input.text()
-            directory = self.directory_dropdown.currentText()
-
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(username, password)
-                ftp.cwd(directory)
-
-                backup_dir = "oscam_backups"
-                if not os.path.exists(backup_dir):
-                    os.makedirs(backup_dir)
-
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_subdir = os.path.join(backup_dir, f"backup_{timestamp}")
-                os.makedirs(backup_subdir)
-
-                file_list = []
-                ftp.retrlines('LIST', file_list.append)
-
-                files_to_backup = []
-                for file_info in file_list:
-                    if file_info.startswith('d'):
-                        continue
-                    filename = file_info.split()[-1]
-                    files_to_backup.append(filename)
-
-                for filename in files_to_backup:
-                    try:
-                        with open(os.path.join(backup_subdir, filename), "wb") as local_file:
-                            ftp.retrbinary(f"RETR {filename}", local_file.write)
-                            self.console.append(f"Backed up {filename}")
-                    except ftplib.error_perm as e:
-                        self.console.append(f"Error backing up {filename}: {str(e)}")
-
-                ftp.quit()
-                self.console.append(f"Backup completed successfully in {backup_subdir}")
-                self.console.append(f"Total files backed up: {len(files_to_backup)}")
-
-            except ftplib.all_errors as e:
-                self.console.append(f"FTP Error during backup: {str(e)}")
-            except Exception as e:
-                self.console.append(f"Error during backup: {str(e)}")
+            backups_window = BackupsWindow(self, self.ftp_target())
+            backups_window.exec_()
+
+    def show_fleet(self):
+        # Kept alive so results of a running fleet operation still have a table to land in
+        if self.fleet_window is None:
+            self.fleet_window = FleetWindow(self)
+        self.fleet_window.exec_()
 
     def restart_oscam(self):
         if self.check_ftp_configuration():
-            host = self.host_input.text()
-            directory = self.directory_dropdown.currentText()
-
-            try:
-                ftp = ftplib.FTP(host)
-                ftp.login(self.username_input.text(), self.password_input.text())
-                ftp.cwd(directory)
-
-                conf_data = []
-                ftp.retrlines('RETR oscam.conf', conf_data.append)
-                ftp.quit()
-
-                http_port = None
-                for line in conf_data:
-                    if 'httpport' in line:
-                        try:
-                            http_port = line.split()[2]
-                            break
-                        except IndexError:
-                            continue
-
-                if not http_port:
-                    self.console.append("Error: Could not find httpport in oscam.conf")
-                    return
-                restart_url = f"http://{host}:{http_port}/shutdown.html?action=Restart"
-                try:
-                    response = requests.get(restart_url, timeout=5)
-                    if response.status_code == 200:
-                        self.console.append("Oscam restart command sent successfully")
-                    else:
-                        self.console.append(f"Error restarting Oscam (Status code: {response.status_code})")
-                except requests.exceptions.RequestException as e:
-                    self.console.append(f"Error sending restart command: {str(e)}")
-
-            except ftplib.all_errors as e:
-                self.console.append(f"FTP Error: {str(e)}")
-            except Exception as e:
-                self.console.append(f"Error: {str(e)}")
+            self.run_task("Restart", ftp_tasks.restart_oscam, self.ftp_target())
 
     def check_ftp_configuration(self):
         if (
@@ -394,6 +597,13 @@ class FTPConnectionWindow(QMainWindow):
             return False
         return True
 
+    def closeEvent(self, event):
+        # Cancelled operations stop at their next block; the ones waiting on
+        # the network fail once their connection is aborted
+        self.pool.cancel_all()
+        SESSIONS.close_all(wait=False)
+        super().closeEvent(event)
+
     def show_error_message(self, message):
         QMessageBox.critical(self, "Error", message)
 
@@ -0,0 +1,154 @@
+import ftplib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+def open_connection(target):
+    ftp = ftplib.FTP(target.host, timeout=target.timeout)
+    ftp.login(target.username, target.password)
+    return ftp
+
+
+class FTPSession:
+    def __init__(self, target):
+        self.host = target.host
+        self.ftp = None
+        self.lock = threading.Lock()
+        self.handshake_time = 0.0
+        self.last_used = 0.0
+        self.last_seen = 0.0
+
+    def connect(self, target):
+        started = time.monotonic()
+        ftp = open_connection(target)
+        self.handshake_time = time.monotonic() - started
+        self.last_seen = time.monotonic()
+        self.ftp = ftp
+
+    def close(self, quit=True):
+        ftp, self.ftp = self.ftp, None
+        if ftp is not None:
+            try:
+                if quit:
+                    ftp.quit()
+            except ftplib.all_errors:
+                pass
+            ftp.close()
+
+    def abort(self):
+        # From another thread than the one using the connection: shuts the
+        # socket down under its operation, which then fails like on a
+        # dropped connection and closes the session itself
+        ftp = self.ftp
+        sock = ftp.sock if ftp is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def alive(self):
+        try:
+            self.ftp.voidcmd("NOOP")
+            self.last_seen = time.monotonic()
+            return True
+        except ftplib.all_errors:
+            self.ftp.close()
+            self.ftp = None
+            return False
+
+
+class SessionManager:
+    # One authenticated connection per host and user, shared by every
+    # operation. Idle connections are kept open with NOOP and closed after
+    # IDLE_TIMEOUT; a connection that went stale is replaced on next use.
+    KEEPALIVE_INTERVAL = 30
+    IDLE_TIMEOUT = 300
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.saved = 0.0
+        self.stopped = threading.Event()
+        self.keepalive_thread = None
+
+    def get(self, target):
+        key = (target.host, target.username, target.password)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = FTPSession(target)
+            if self.keepalive_thread is None:
+                self.keepalive_thread = threading.Thread(target=self.keepalive, daemon=True)
+                self.keepalive_thread.start()
+            return session
+
+    @contextmanager
+    def session(self, target, task):
+        session = self.get(target)
+        with session.lock:
+            task.check()
+            # A connection seen within the keepalive interval is trusted, an older
+            # one is checked with NOOP first
+            ready = session.ftp is not None and (
+                time.monotonic() - session.last_seen < self.KEEPALIVE_INTERVAL or session.alive()
+            )
+            if ready:
+                self.reused += 1
+                self.saved += session.handshake_time
+                task.log(f"Reusing FTP session to {target.host} (saved {session.handshake_time * 1000:.0f} ms, "
+                         f"{self.saved * 1000:.0f} ms over {self.reused} operations)")
+            else:
+                session.connect(target)
+            try:
+                yield session.ftp
+            except ftplib.error_perm:
+                raise
+            except BaseException:
+                # The connection state is unknown after a failed or cancelled transfer
+                session.close()
+                raise
+            finally:
+                session.last_used = session.last_seen = time.monotonic()
+
+    def keepalive(self):
+        while not self.stopped.wait(self.KEEPALIVE_INTERVAL):
+            with self.lock:
+                sessions = list(self.sessions.values())
+            now = time.monotonic()
+            for session in sessions:
+                if session.ftp is None or not session.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if session.ftp is None:
+                        continue
+                    if now - session.last_used > self.IDLE_TIMEOUT:
+                        session.close()
+                    else:
+                        session.alive()
+                finally:
+                    session.lock.release()
+
+    def close_all(self, wait=True):
+        # Without wait nothing blocks, for the GUI thread on exit: idle
+        # connections are closed without QUIT and the ones in use aborted
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            if wait:
+                with session.lock:
+                    session.close()
+            elif session.lock.acquire(blocking=False):
+                try:
+                    session.close(quit=False)
+                finally:
+                    session.lock.release()
+            else:
+                session.abort()
+
+
+SESSIONS = SessionManager()
@@ -0,0 +1,562 @@
+import configparser
+import ftplib
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from converter import read_digest
+from ftp_sessions import SESSIONS
+from metrics import MetricsSettings, format_bytes, record_metrics, stage
+from oscam_config import diff_readers, load_oscam_server, parse_oscam_conf
+from webif import WebIF, WebIFError, reload_changed_readers
+
+CONFIG_FILE = "cccam2oscam.conf"
+CONFIG_LOCK = threading.Lock()
+UPLOAD_NAME = "oscam.server.part"
+CACHE_DIR = "remote_cache"
+METRICS_LOG = "transfers.jsonl"
+RESTART_LOG = "restarts.jsonl"
+# Worth retrying: timeouts, dropped connections and 4xx replies. A 5xx reply
+# (error_perm) will not change on the next attempt.
+SHA256_RE = re.compile(r"\b[0-9A-Fa-f]{64}\b")
+TRANSIENT_ERRORS = (ftplib.error_temp, ftplib.error_reply, ftplib.error_proto, OSError, EOFError)
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class FTPTarget:
+    def __init__(self, host, username, password, directory, timeout=30):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.directory = directory
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"{self.username}@{self.host}:{self.directory}"
+
+
+class TaskContext:
+    # Handed to every task; tasks report through it and call check() often
+    # enough that a cancel request stops them between blocks of a transfer.
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, log=print, progress=None, cancelled=None, parent=None):
+        self.log = log
+        self.progress = progress or (lambda message: None)
+        self.cancelled = cancelled or threading.Event()
+        self.parent = parent
+        self.errors = []
+        self.started = time.monotonic()
+        self.transferred_bytes = 0
+        self.last_progress = 0
+        self.lock = threading.Lock()
+        # RunMetrics the task times its stages with, set by whoever runs it.
+        # Sub tasks may run in parallel and do not share it.
+        self.metrics = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def error(self, message):
+        self.errors.append(message)
+        self.log(message)
+
+    def child(self, name):
+        # Same cancel flag, messages prefixed with the name of the sub task
+        return TaskContext(
+            lambda message: self.log(f"[{name}] {message}"),
+            lambda message: self.progress(f"[{name}] {message}"),
+            self.cancelled,
+            self
+        )
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise TaskCancelled()
+
+    def transferred(self, size):
+        self.check()
+        parent = self.parent
+        while parent is not None:
+            with parent.lock:
+                parent.transferred_bytes += size
+            parent = parent.parent
+        with self.lock:
+            self.transferred_bytes += size
+            now = time.monotonic()
+            if now - self.last_progress < self.PROGRESS_INTERVAL:
+                return
+            self.last_progress = now
+            transferred_bytes = self.transferred_bytes
+        rate = transferred_bytes / max(now - self.started, 0.001)
+        self.progress(f"{format_bytes(transferred_bytes)} transferred, {format_bytes(rate)}/s")
+
+    def writer(self, file):
+        def write(data):
+            self.transferred(len(data))
+            file.write(data)
+        return write
+
+
+def connect(target, task):
+    return SESSIONS.session(target, task)
+
+
+class TransferSettings:
+    def __init__(self, block_size=65536, retries=3, backoff=2.0):
+        self.block_size = block_size
+        self.retries = retries
+        self.backoff = backoff
+
+    @classmethod
+    def load(cls, path=CONFIG_FILE):
+        config = configparser.ConfigParser()
+        config.read(path)
+        return cls(
+            config.getint("Transfer", "block_size", fallback=65536),
+            config.getint("Transfer", "retries", fallback=3),
+            config.getfloat("Transfer", "backoff", fallback=2.0)
+        )
+
+
+class TransferMetrics:
+    def __init__(self, command, name, block_size):
+        self.host = None
+        self.command = command
+        self.name = name
+        self.block_size = block_size
+        self.size = 0
+        self.transferred = 0
+        self.resumed = 0
+        self.attempts = 0
+        self.started = time.time()
+        self.duration = 0.0
+
+    @property
+    def throughput(self):
+        return self.transferred / max(self.duration, 0.001)
+
+    def as_dict(self):
+        return {
+            "time": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "host": self.host,
+            "command": self.command,
+            "name": self.name,
+            "block_size": self.block_size,
+            "size": self.size,
+            "transferred": self.transferred,
+            "resumed": self.resumed,
+            "attempts": self.attempts,
+            "duration": round(self.duration, 3),
+            "throughput": round(self.throughput),
+        }
+
+    def __str__(self):
+        verb = "Downloaded" if self.command == "RETR" else "Uploaded"
+        text = (f"{verb} {self.name}: {format_bytes(self.size)} in {self.duration:.2f}s "
+                f"({format_bytes(self.throughput)}/s")
+        if self.attempts > 1:
+            text += f", {self.attempts} attempts, {format_bytes(self.resumed)} resumed"
+        return text + ")"
+
+
+@contextmanager
+def connect_to_directory(target, task):
+    with connect(target, task) as ftp:
+        ftp.cwd(target.directory)
+        yield ftp
+
+
+def supports_resume(ftp):
+    try:
+        return "REST STREAM" in ftp.sendcmd("FEAT").upper()
+    except ftplib.all_errors:
+        return False
+
+
+def resume_offset(ftp, command, name, file):
+    # Where an interrupted transfer can continue: the bytes already written
+    # locally for RETR, the size of the partial remote file for STOR.
+    if command == "RETR":
+        offset = file.tell()
+    else:
+        ftp.voidcmd("TYPE I")
+        try:
+            offset = ftp.size(name) or 0
+        except ftplib.error_perm:
+            offset = 0
+        if offset > file.seek(0, io.SEEK_END):
+            offset = 0
+    if offset and not supports_resume(ftp):
+        offset = 0
+    # A download is not truncated here: the viewer may have it mapped, and
+    # a mapped file shrinking under it crashes the process. Starting over
+    # overwrites the same bytes; transfer() cuts a tail left over only when
+    # the remote file turned out shorter.
+    file.seek(offset)
+    return offset
+
+
+def transfer(open_ftp, command, name, file, task, settings=None):
+    # Runs RETR or STOR with the configured block size. After a transient
+    # failure it reconnects through open_ftp(), waits with exponential
+    # backoff and continues from the REST offset when the server allows it.
+    settings = settings or TransferSettings.load()
+    metrics = TransferMetrics(command, name, settings.block_size)
+    started = time.monotonic()
+
+    def count(size):
+        task.transferred(size)
+        metrics.transferred += size
+
+    def write(data):
+        count(len(data))
+        file.write(data)
+
+    for attempt in range(1, settings.retries + 2):
+        metrics.attempts = attempt
+        try:
+            with open_ftp() as ftp:
+                metrics.host = ftp.host
+                offset = resume_offset(ftp, command, name, file) if attempt > 1 else 0
+                if offset:
+                    metrics.resumed += offset
+                    task.log(f"Resuming {name} at {format_bytes(offset)}")
+                if command == "RETR":
+                    ftp.retrbinary(f"RETR {name}", write, settings.block_size, rest=offset or None)
+                else:
+                    ftp.storbinary(f"STOR {name}", file, settings.block_size,
+                                   lambda block: count(len(block)), rest=offset or None)
+            if command == "RETR":
+                file.flush()
+                if file.tell() < os.fstat(file.fileno()).st_size:
+                    file.truncate()
+            break
+        except TRANSIENT_ERRORS as e:
+            if attempt > settings.retries:
+                raise
+            delay = settings.backoff * 2 ** (attempt - 1)
+            task.log(f"Transfer of {name} interrupted ({str(e) or type(e).__name__}), retrying in {delay:.0f}s")
+            if task.cancelled.wait(delay):
+                raise TaskCancelled()
+
+    metrics.size = file.tell()
+    metrics.duration = time.monotonic() - started
+    task.log(str(metrics))
+    log_record(METRICS_LOG, metrics.as_dict(), task)
+    return metrics
+
+
+def log_record(name, record, task):
+    # Appends record to the log name when [Metrics] log is on
+    path = MetricsSettings.load(CONFIG_FILE).log_path(name)
+    if path is None:
+        return
+    try:
+        record_metrics(path, record)
+    except OSError as e:
+        task.log(f"Could not write {path}: {str(e)}")
+
+
+def read_remote_file(ftp, name):
+    # Returns None when the file does not exist
+    data = bytearray()
+    try:
+        ftp.retrbinary(f"RETR {name}", data.extend)
+    except ftplib.error_perm:
+        return None
+    return bytes(data)
+
+
+def matches(data, size, digest):
+    return data is not None and len(data) == size and hashlib.sha256(data).hexdigest() == digest
+
+
+def digest_command(ftp):
+    # The command that has the server compute the SHA-256 digest of a file:
+    # HASH (draft-bryan-ftpext-hash) switched to SHA-256, or XSHA256. None
+    # when FEAT lists neither.
+    try:
+        features = [line.strip().upper() for line in ftp.sendcmd("FEAT").splitlines()[1:-1]]
+    except ftplib.all_errors:
+        return None
+    if any(feature.startswith("HASH ") and "SHA-256" in feature for feature in features):
+        try:
+            ftp.sendcmd("OPTS HASH SHA-256")
+            return "HASH"
+        except ftplib.error_perm:
+            pass
+    return "XSHA256" if "XSHA256" in features else None
+
+
+def remote_sha256(ftp, command, name):
+    # None when the server could not compute it
+    try:
+        match = SHA256_RE.search(ftp.sendcmd(f"{command} {name}"))
+    except ftplib.error_perm:
+        return None
+    return match.group(0).lower() if match else None
+
+
+def compare_remote_file(ftp, name, size, digest, command=None):
+    # Whether the remote file is identical to the local one, None when it
+    # does not exist, and its content when it had to be read. SIZE tells
+    # most changed files apart; a file of the same size is compared by the
+    # digest the server computes with command, and only read when there is
+    # no such command. Expects binary mode.
+    try:
+        remote_size = ftp.size(name)
+    except ftplib.error_perm as e:
+        if str(e).startswith("550"):
+            return None, None
+        # No SIZE on this server
+        remote_size = None
+    if remote_size is not None and remote_size != size:
+        return False, None
+    remote_digest = remote_sha256(ftp, command, name) if command else None
+    if remote_digest is not None:
+        return remote_digest == digest, None
+    data = read_remote_file(ftp, name)
+    return (None if data is None else matches(data, size, digest)), data
+
+
+def replace_remote_file(ftp, source, destination, task):
+    # RNTO over an existing file is an atomic rename on the receiver's
+    # filesystem; servers that refuse to overwrite get a delete first.
+    try:
+        ftp.rename(source, destination)
+    except ftplib.error_perm:
+        task.log(f"Server refused to overwrite {destination}, deleting it first")
+        ftp.delete(destination)
+        ftp.rename(source, destination)
+
+
+def stat_remote_file(ftp, name):
+    # Size and MDTM timestamp; the timestamp is None on servers without MDTM.
+    # Expects binary mode, many servers refuse SIZE in ASCII mode.
+    size = ftp.size(name)
+    try:
+        modify = ftp.voidcmd(f"MDTM {name}")[4:].strip()
+    except ftplib.error_perm:
+        modify = None
+    return size, modify
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RemoteFileCache:
+    # Copies of remote files under <root>/<host>/<directory>/, each with a
+    # .json file holding the SIZE and MDTM it was downloaded at. A copy is
+    # used as long as both still match, which costs two commands instead of
+    # a download.
+    #
+    # A changed file is downloaded to a new copy rather than over the old
+    # one, which a viewer may still have mapped: on Linux rewriting it would
+    # crash the viewer, on Windows the file cannot even be opened for writing.
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def path(self, target, name):
+        directory = re.sub(r"[^\w.-]", "_", target.directory.strip("/")) or "_"
+        return os.path.join(self.root, re.sub(r"[^\w.-]", "_", target.host), directory, name)
+
+    def load_metadata(self, path):
+        try:
+            with open(path + ".json", "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def copy_path(self, path, metadata):
+        # Caches written before copies were versioned keep the copy at path
+        return os.path.join(os.path.dirname(path), metadata.get("file", os.path.basename(path)))
+
+    def fetch(self, target, task, name, on_download=None):
+        # Returns the path of the copy. on_download(path) is called before a
+        # download starts writing to path, so a viewer can show the lines
+        # while they arrive.
+        path = self.path(target, name)
+        with connect_to_directory(target, task) as ftp:
+            ftp.voidcmd("TYPE I")
+            size, modify = stat_remote_file(ftp, name)
+        metadata = {"size": size, "modify": modify}
+        cached = self.load_metadata(path)
+        if (modify is not None and cached is not None and cached["size"] == size and cached["modify"] == modify
+                and os.path.exists(self.copy_path(path, cached))):
+            task.log(f"{name} on {target.host} is unchanged since {modify}, using the cached copy")
+            return self.copy_path(path, cached)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, copy_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{name}.", suffix=".copy")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                if on_download:
+                    on_download(copy_path)
+                transfer(lambda: connect_to_directory(target, task), "RETR", name, file, task)
+        except BaseException:
+            remove_quietly(copy_path)
+            raise
+        metadata["file"] = os.path.basename(copy_path)
+
+        with self.lock:
+            previous = self.load_metadata(path)
+            with open(path + ".json.tmp", "w", encoding="utf-8") as file:
+                json.dump(metadata, file)
+            os.replace(path + ".json.tmp", path + ".json")
+        if previous is not None and self.copy_path(path, previous) != copy_path:
+            # Still mapped by a viewer on Windows; such a copy stays behind
+            remove_quietly(self.copy_path(path, previous))
+        return copy_path
+
+
+REMOTE_CACHE = RemoteFileCache()
+
+
+def test_connection(target, task):
+    try:
+        with connect(target, task) as ftp:
+            response = ftp.getwelcome()
+        task.log("Connection successful!")
+        task.log(response)
+    except ftplib.all_errors as e:
+        task.error("Error connecting to FTP: " + str(e))
+
+
+def upload_oscam_server(target, task, local_path="oscam.server", reload=False):
+    # With reload=True the running OSCam is then updated through the WebIF,
+    # acting only on the readers that changed
+    try:
+        digest = read_digest(local_path)
+        size = os.path.getsize(local_path)
+    except OSError as e:
+        task.error("Error uploading file: " + str(e))
+        return
+
+    try:
+        with stage(task.metrics, "compare"), connect_to_directory(target, task) as ftp:
+            ftp.voidcmd("TYPE I")
+            command = digest_command(ftp)
+            identical, remote = compare_remote_file(ftp, "oscam.server", size, digest, command)
+        if identical:
+            task.log(f"Remote oscam.server in {target.directory} is identical, skipping upload")
+            return
+
+        # The new file goes to a temporary name and replaces oscam.server only
+        # once verified, so OSCam never sees a missing or partial file.
+        with stage(task.metrics, "transfer"), open(local_path, "rb") as file:
+            transfer(lambda: connect_to_directory(target, task), "STOR", UPLOAD_NAME, file, task)
+
+        with connect_to_directory(target, task) as ftp:
+            ftp.voidcmd("TYPE I")
+            with stage(task.metrics, "verify"):
+                verified, _ = compare_remote_file(ftp, UPLOAD_NAME, size, digest, command)
+            if not verified:
+                ftp.delete(UPLOAD_NAME)
+                task.error("Error uploading file: uploaded copy does not match the local file")
+                return
+            task.log(f"Verified uploaded copy ({format_bytes(size)}, sha256 {digest[:12]})")
+
+            with stage(task.metrics, "replace"):
+                if identical is None:
+                    task.log("No existing remote file to backup")
+                else:
+                    if remote is None:
+                        # Only a file that changed is read, for the backup
+                        # and for the readers the reload compares
+                        remote = read_remote_file(ftp, "oscam.server") or b""
+                    # Microseconds, as STOR silently replaces a backup taken
+                    # by a push in the same second
+                    backup_name = f"oscam.server.backup_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                    ftp.storbinary(f"STOR {backup_name}", io.BytesIO(remote))
+                    task.log(f"Created backup of remote file as {backup_name}")
+
+                replace_remote_file(ftp, UPLOAD_NAME, "oscam.server", task)
+        task.log(f"File 'oscam.server' uploaded successfully to {target.directory}")
+    except ftplib.all_errors as e:
+        task.error("Error uploading file: " + str(e))
+        return
+
+    if reload:
+        try:
+            with stage(task.metrics, "reload"), open(local_path, "rb") as file:
+                report = reload_changed_readers(connect_webif(target, task), task, remote or b"", file.read())
+        except (ftplib.all_errors, WebIFError) as e:
+            task.error(f"Error reloading readers: {str(e)}")
+            return
+        if report is not None:
+            return record_restart(report, task)
+
+
+def download_oscam_server(target, task, local_path="oscam.server"):
+    try:
+        if os.path.exists(local_path):
+            backup_name = f"{local_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+            os.rename(local_path, backup_name)
+            task.log(f"Created backup of local file as {backup_name}")
+
+        with stage(task.metrics, "transfer"), open(local_path, "wb") as file:
+            transfer(lambda: connect_to_directory(target, task), "RETR", "oscam.server", file, task)
+        task.log("File 'oscam.server' downloaded successfully")
+    except ftplib.all_errors as e:
+        task.error("Error downloading file: " + str(e))
+
+
+def fetch_oscam_server(target, task, on_download=None):
+    try:
+        return REMOTE_CACHE.fetch(target, task, "oscam.server", on_download)
+    except ftplib.all_errors as e:
+        task.error("Error viewing file: " + str(e))
+        return None
+
+
+def compare_oscam_server(target, task, local_path="oscam.server"):
+    # Reader changes an upload of local_path would make on the box
+    try:
+        remote = load_oscam_server(REMOTE_CACHE.fetch(target, task, "oscam.server"))
+        local = load_oscam_server(local_path)
+    except ftplib.all_errors as e:
+        task.error("Error comparing oscam.server: " + str(e))
+        return None
+    difference = diff_readers(remote, local)
+    task.log(f"Local oscam.server against {target.host}:{target.directory}: {difference}")
+    return difference
+
+
+def connect_webif(target, task):
+    with open(REMOTE_CACHE.fetch(target, task, "oscam.conf"), "rb") as file:
+        conf = parse_oscam_conf(file.read())
+    return WebIF.from_conf(target.host, conf, target.timeout)
+
+
+def record_restart(report, task):
+    task.log(str(report))
+    if not report.ready:
+        task.error(f"Error restarting Oscam: {report}")
+    log_record(RESTART_LOG, report.as_dict(), task)
+    return report
+
+
+def restart_oscam(target, task):
+    try:
+        webif = connect_webif(target, task)
+        task.check()
+        return record_restart(webif.restart_and_wait(task), task)
+    except WebIFError as e:
+        task.error(f"Error restarting Oscam: {str(e)}")
+    except ftplib.all_errors as e:
+        task.error(f"FTP Error: {str(e)}")
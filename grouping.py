@@ -0,0 +1,164 @@
+import hashlib
+import math
+from array import array
+from collections import Counter, defaultdict
+from readers import ReaderTable
+
+GROUPING_MODES = ("count", "caid", "latency")
+MAX_GROUPS = 64
+
+
+class GroupStats:
+    def __init__(self, mode):
+        self.mode = mode
+        self.readers = 0
+        self.groups = 0
+        self.smallest = 0
+        self.largest = 0
+        self.shards = Counter()
+
+    def update(self, table):
+        sizes = Counter((table.shard(row), table.group(row)) for row in range(len(table)))
+        self.readers = len(table)
+        self.groups = len({group for _, group in sizes})
+        self.smallest = min(sizes.values(), default=0)
+        self.largest = max(sizes.values(), default=0)
+        self.shards = Counter(table.shard(row) for row in range(len(table)))
+
+    def __str__(self):
+        if self.mode is None:
+            return f"{self.readers} readers split into {len(self.shards)} shards"
+        summary = (f"{self.readers} readers spread over {self.groups} groups by {self.mode}, "
+                   f"{self.smallest}-{self.largest} per group")
+        if len(self.shards) > 1:
+            summary += f", {len(self.shards)} shards"
+        return summary
+
+
+def reader_hash(record):
+    # Stable across runs and independent of the order of the lines, so a
+    # reader keeps its group as long as the groups do not fill up differently
+    identity = "\0".join(str(field) for field in record.identity)
+    return int.from_bytes(hashlib.blake2b(identity.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def spread(rows, hashes, slots):
+    # Consistent hashing with bounded loads: every reader goes to the slot its
+    # hash points at unless that one is full, then to the next one. Slots end
+    # up with at most one reader more than the others, and adding or removing
+    # a few readers moves only a few others.
+    if not rows:
+        return {}
+    capacity = -(-len(rows) // len(slots))
+    load = [0] * len(slots)
+    assignment = {}
+    for digest, row in sorted((hashes[row], row) for row in rows):
+        slot = digest % len(slots)
+        while load[slot] >= capacity:
+            slot = (slot + 1) % len(slots)
+        load[slot] += 1
+        assignment[row] = slots[slot]
+    return assignment
+
+
+class Readers:
+    # The readers to group as a ReaderTable, with the reader hash and, for
+    # CAID groups, the CAID of every row worked out in one pass
+    def __init__(self, records, caids=False):
+        self.table = ReaderTable()
+        self.hashes = array("Q")
+        self.caids = []
+        known = {}
+        for record in records:
+            self.table.append_record(record)
+            self.hashes.append(reader_hash(record))
+            if caids:
+                caid = record.caid.upper()
+                self.caids.append(known.setdefault(caid, caid))
+
+
+def group_by_count(readers, rows, group_count):
+    for row, group in spread(rows, readers.hashes, range(1, group_count + 1)).items():
+        readers.table.set_group(row, group)
+
+
+def allocate_groups(buckets, group_count):
+    # Every CAID gets at least one group and the rest go to the CAIDs with
+    # the most readers per group, but never more groups than readers
+    allocation = dict.fromkeys(buckets, 1)
+    for _ in range(group_count - len(buckets)):
+        candidates = [caid for caid in buckets if allocation[caid] < len(buckets[caid])]
+        if not candidates:
+            break
+        caid = max(candidates, key=lambda caid: (len(buckets[caid]) / allocation[caid], caid))
+        allocation[caid] += 1
+    return allocation
+
+
+def group_by_caid(readers, rows, group_count):
+    # Readers of one CAID share their groups. With more CAIDs than groups the
+    # CAIDs are packed largest first into the group with the fewest readers.
+    # C-lines and N-lines without an ident count as one more CAID.
+    table = readers.table
+    buckets = defaultdict(list)
+    for row in rows:
+        buckets[readers.caids[row]].append(row)
+
+    if len(buckets) >= group_count:
+        load = [0] * group_count
+        for caid in sorted(buckets, key=lambda caid: (-len(buckets[caid]), caid)):
+            group = load.index(min(load))
+            load[group] += len(buckets[caid])
+            for row in buckets[caid]:
+                table.set_group(row, group + 1)
+        return
+
+    allocation = allocate_groups(buckets, group_count)
+    first = 1
+    for caid in sorted(buckets):
+        for row, group in spread(buckets[caid], readers.hashes, range(first, first + allocation[caid])).items():
+            table.set_group(row, group)
+        first += allocation[caid]
+
+
+def group_by_latency(readers, rows, group_count):
+    # The fastest readers in group 1, the slowest and unreachable ones in the
+    # last group, so users can be given the tiers they should use
+    table = readers.table
+    latency = table.latency
+    ordered = sorted(rows, key=lambda row: (math.inf if latency(row) is None else latency(row), readers.hashes[row]))
+    tiers = min(group_count, len(ordered))
+    for tier in range(tiers):
+        for row in ordered[tier * len(ordered) // tiers:(tier + 1) * len(ordered) // tiers]:
+            table.set_group(row, tier + 1)
+
+
+GROUPERS = {"count": group_by_count, "caid": group_by_caid, "latency": group_by_latency}
+
+
+def assign_groups(records, mode, group_count=MAX_GROUPS, shards=1, stats=None):
+    # Sets the shard (1 to shards, spread by count) and, unless mode is None,
+    # the group (1 to group_count within its shard) of every reader and
+    # returns the readers as a ReaderTable
+    if mode is not None and mode not in GROUPERS:
+        raise ValueError(f"Unknown grouping mode '{mode}'")
+    if not 1 <= group_count <= MAX_GROUPS:
+        raise ValueError(f"Group count must be between 1 and {MAX_GROUPS}")
+    if shards < 1:
+        raise ValueError("Shard count must be at least 1")
+    readers = Readers(records, caids=mode == "caid")
+    table = readers.table
+    rows = range(len(table))
+    by_shard = defaultdict(lambda: array("L"))
+    if shards > 1:
+        for row, shard in sorted(spread(rows, readers.hashes, range(1, shards + 1)).items()):
+            table.set_shard(row, shard)
+            by_shard[shard].append(row)
+    else:
+        by_shard[1] = rows
+    if mode is not None:
+        for shard_rows in by_shard.values():
+            GROUPERS[mode](readers, shard_rows, group_count)
+    if stats is not None:
+        stats.update(table)
+    return table
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from cam_crypt import TripleDES, cccam_ciphers, md5_crypt, newcamd_key
+from readers import parse_file
+
+OK = "ok"
+BAD_CREDENTIALS = "bad credentials"
+TIMEOUT = "timeout"
+PROTOCOL_ERROR = "protocol error"
+UNREACHABLE = "unreachable"
+STATUSES = (OK, BAD_CREDENTIALS, TIMEOUT, PROTOCOL_ERROR, UNREACHABLE)
+
+NEWCAMD_LOGIN = 0xe0
+NEWCAMD_LOGIN_ACK = 0xe1
+NEWCAMD_LOGIN_NAK = 0xe2
+NEWCAMD_CLIENT_ID = 0x8888
+NEWCAMD_SALT = "abcdefgh"
+NEWCAMD_MAX_MESSAGE = 400
+
+
+class HandshakeError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class HandshakeResult:
+    __slots__ = ("record", "status", "detail", "duration")
+
+    def __init__(self, record, status, detail, duration):
+        self.record = record
+        self.status = status
+        self.detail = detail
+        self.duration = duration
+
+    def __str__(self):
+        detail = f" ({self.detail})" if self.detail else ""
+        return f"line {self.record.lineno} {self.record.label}: {self.status}{detail}"
+
+
+class HandshakeStats:
+    def __init__(self, results, duration):
+        self.counts = Counter(result.status for result in results)
+        self.readers = len(results)
+        self.duration = duration
+
+    def __str__(self):
+        counts = ", ".join(f"{self.counts[status]} {status}" for status in STATUSES if self.counts[status])
+        return f"{self.readers} readers checked in {self.duration:.1f}s: {counts or 'nothing to check'}"
+
+
+async def receive(reader, size, closed_status, stage):
+    try:
+        return await reader.readexactly(size)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        raise HandshakeError(closed_status, f"connection closed {stage}")
+
+
+async def send(writer, *parts):
+    # Servers hang up as soon as they see a wrong user, so a connection lost
+    # while the login is still being sent counts as refused
+    try:
+        for part in parts:
+            writer.write(part)
+        await writer.drain()
+    except ConnectionError:
+        raise HandshakeError(BAD_CREDENTIALS, "connection closed during the login")
+
+
+async def cccam_login(reader, writer, user, password):
+    # The server greets with 16 random bytes both sides derive the ciphers
+    # from. A CCcam server drops the connection on an unknown user or a wrong
+    # password and answers "CCcam" otherwise.
+    greeting = await receive(reader, 16, PROTOCOL_ERROR, "before the greeting")
+    receive_cipher, send_cipher, digest = cccam_ciphers(greeting)
+    digest = send_cipher.encrypt(digest)
+    user = send_cipher.encrypt(user.encode("utf-8")[:20].ljust(20, b"\0"))
+    send_cipher.encrypt(password.encode("utf-8"))
+    await send(writer, digest, user, send_cipher.encrypt(b"CCcam\0"))
+    answer = receive_cipher.decrypt(await receive(reader, 20, BAD_CREDENTIALS, "after the login"))
+    if answer[:5] != b"CCcam":
+        raise HandshakeError(PROTOCOL_ERROR, "login answer is not from a CCcam server")
+
+
+def newcamd_message(cipher, command, body, message_id=0, client_id=NEWCAMD_CLIENT_ID):
+    # 10 header bytes, the command with a 12 bit body length and the body,
+    # padded to whole DES blocks with an XOR checksum as the last byte. The
+    # random IV follows the ciphertext and a 2 byte length leads the frame.
+    data = bytes((command, (len(body) >> 8) & 0x0f, len(body) & 0xff)) + body
+    plain = message_id.to_bytes(2, "big") + client_id.to_bytes(2, "big") + bytes(6) + data
+    plain += os.urandom(7 - len(plain) % 8)
+    checksum = 0
+    for byte in plain:
+        checksum ^= byte
+    iv = os.urandom(8)
+    frame = cipher.encrypt(plain + bytes((checksum,)), iv) + iv
+    return len(frame).to_bytes(2, "big") + frame
+
+
+async def receive_newcamd_message(reader, cipher, closed_status, stage):
+    size = int.from_bytes(await receive(reader, 2, closed_status, stage), "big")
+    if size % 8 or not 24 <= size <= NEWCAMD_MAX_MESSAGE:
+        raise HandshakeError(PROTOCOL_ERROR, f"invalid newcamd message length {size}")
+    frame = await receive(reader, size, PROTOCOL_ERROR, "inside a message")
+    plain = cipher.decrypt(frame[:-8], frame[-8:])
+    checksum = 0
+    for byte in plain:
+        checksum ^= byte
+    if checksum:
+        raise HandshakeError(PROTOCOL_ERROR, "newcamd message checksum mismatch")
+    length = ((plain[11] & 0x0f) << 8) | plain[12]
+    return plain[10], plain[13:13 + length]
+
+
+async def newcamd_login(reader, writer, user, password, key):
+    # The server greets with 14 random bytes that modify the DES key for the
+    # login message. A wrong DES key makes the message unreadable and the
+    # server drops the connection; a wrong user or password gets a NAK.
+    modifier = await receive(reader, 14, PROTOCOL_ERROR, "before the greeting")
+    cipher = TripleDES(newcamd_key(bytes.fromhex(key), modifier))
+    crypted = md5_crypt(password, NEWCAMD_SALT)
+    body = user.encode("utf-8") + b"\0" + crypted.encode("ascii") + b"\0"
+    await send(writer, newcamd_message(cipher, NEWCAMD_LOGIN, body))
+    command, _ = await receive_newcamd_message(reader, cipher, BAD_CREDENTIALS, "after the login, wrong DES key or user")
+    if command == NEWCAMD_LOGIN_NAK:
+        raise HandshakeError(BAD_CREDENTIALS, "login refused")
+    if command != NEWCAMD_LOGIN_ACK:
+        raise HandshakeError(PROTOCOL_ERROR, f"unexpected answer 0x{command:02x} to the login")
+
+
+async def handshake(record, timeout):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(record.host, record.port), timeout)
+    except asyncio.TimeoutError:
+        return TIMEOUT, "connect timed out"
+    except OSError as e:
+        return UNREACHABLE, e.strerror or str(e)
+    except Exception as e:
+        # A host name that cannot be encoded for DNS raises UnicodeError
+        return UNREACHABLE, str(e)
+    try:
+        if record.protocol == "newcamd":
+            login = newcamd_login(reader, writer, record.user, record.password, record.key)
+        else:
+            login = cccam_login(reader, writer, record.user, record.password)
+        await asyncio.wait_for(login, timeout)
+    except asyncio.TimeoutError:
+        return TIMEOUT, "no answer to the login"
+    except HandshakeError as e:
+        return e.status, e.detail
+    except OSError as e:
+        return PROTOCOL_ERROR, e.strerror or str(e)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    return OK, ""
+
+
+async def verify_record(record, semaphore, timeout):
+    async with semaphore:
+        started = time.perf_counter()
+        status, detail = await handshake(record, timeout)
+        return HandshakeResult(record, status, detail, time.perf_counter() - started)
+
+
+async def verify_all(records, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(verify_record(record, semaphore, timeout) for record in records))
+
+
+def verify_records(records, concurrency=256, timeout=5.0):
+    # Logs in to every reader the way OSCam would, at most `concurrency`
+    # at once, and returns the results in the order of the records
+    started = time.monotonic()
+    results = asyncio.run(verify_all(list(records), concurrency, timeout))
+    return results, HandshakeStats(results, time.monotonic() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Log in to the servers of CCcam.cfg C/N-lines and report which logins work")
+    parser.add_argument("source", help="CCcam.cfg to check")
+    parser.add_argument("--timeout", type=float, default=5.0, help="connect and login timeout in seconds (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=256, help="logins in progress at once (default: %(default)s)")
+    parser.add_argument("--failed", action="store_true", help="only list the readers whose login did not work")
+    args = parser.parse_args(argv)
+
+    try:
+        results, stats = verify_records(parse_file(args.source), args.concurrency, args.timeout)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    for result in results:
+        if result.status != OK or not args.failed:
+            print(result)
+    print(stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+import configparser
+import cProfile
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from itertools import islice
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+APP_NAME = "cccam2oscam"
+RUN_LOG = "runs.jsonl"
+PROFILE_DIR = "profiles"
+METRICS_LOCK = threading.Lock()
+# Python allows one profiler per process (since 3.12 enabling a second one
+# raises), so only one run at a time is profiled
+PROFILE_LOCK = threading.Lock()
+# Runs in progress, to tell whether the memory peak belongs to one run
+ACTIVE_RUNS = set()
+ACTIVE_LOCK = threading.Lock()
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def app_data_dir():
+    # Per-user directory of the logs: %LOCALAPPDATA% on Windows,
+    # ~/Library/Application Support on macOS, $XDG_DATA_HOME elsewhere
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser(os.path.join("~", "Library", "Application Support"))
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser(os.path.join("~", ".local", "share"))
+    return os.path.join(base, APP_NAME)
+
+
+def record_metrics(path, record):
+    # One JSON object per line, so the log can be appended to from several
+    # threads and processed with standard line-based tools.
+    with METRICS_LOCK:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+
+def reset_peak_memory():
+    # Linux resets the VmHWM high-water mark on request, which makes the peak
+    # of a run measurable in a long-running process such as the GUI. Returns
+    # False where the peak can only be read for the whole process.
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [
+        ("cb", ctypes.c_uint32),
+        ("PageFaultCount", ctypes.c_uint32),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+def windows_peak_memory():
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not kernel32.K32GetProcessMemoryInfo(ctypes.c_void_p(kernel32.GetCurrentProcess()),
+                                            ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_memory():
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if sys.platform == "win32":
+        try:
+            return windows_peak_memory()
+        except (AttributeError, OSError):
+            return None
+    if resource is not None:
+        # Peak of the whole process; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class MetricsSettings:
+    def __init__(self, profile_slow=0.0, profile_dir=PROFILE_DIR, log=False, log_dir=None):
+        # Runs taking profile_slow seconds or longer leave a cProfile dump;
+        # 0 turns profiling off. Runs, transfers and restarts are only logged
+        # with log, to log_dir or the per-user app data directory.
+        self.profile_slow = profile_slow
+        self.profile_dir = profile_dir
+        self.log = log
+        self.log_dir = log_dir or app_data_dir()
+
+    def log_path(self, name):
+        # None when logging is off
+        return os.path.join(self.log_dir, name) if self.log else None
+
+    @classmethod
+    def load(cls, path):
+        config = configparser.ConfigParser()
+        config.read(path)
+        return cls(
+            config.getfloat("Metrics", "profile_slow", fallback=0.0),
+            config.get("Metrics", "profile_dir", fallback=PROFILE_DIR),
+            config.getboolean("Metrics", "log", fallback=False),
+            config.get("Metrics", "log_dir", fallback=None)
+        )
+
+
+class RunMetrics:
+    # Wall time per stage, counts and peak memory of one run. Stages nest:
+    # time spent in an inner stage is not counted for the outer one, so the
+    # stages of a streaming pipeline add up to the duration of the run.
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = settings or MetricsSettings()
+        self.time = None
+        self.stages = {}
+        self.items = {}
+        self.counts = {}
+        self.duration = 0.0
+        self.peak_memory = None
+        # "run" when the peak is this run's own, "concurrent" when other runs
+        # overlapped it, "process" where only the process peak can be read
+        self.peak_scope = None
+        self.profile_path = None
+        self.profiler = None
+        self.stack = []
+        self.switched = 0.0
+        self.started = 0.0
+
+    def start(self):
+        # Called on the thread doing the work, which is the one cProfile sees
+        self.time = datetime.now().isoformat(timespec="seconds")
+        with ACTIVE_LOCK:
+            if ACTIVE_RUNS:
+                # Resetting the peak would lose the one of the runs in progress
+                self.peak_scope = "concurrent"
+                for run in ACTIVE_RUNS:
+                    run.peak_scope = "concurrent"
+            else:
+                self.peak_scope = "run" if reset_peak_memory() else "process"
+            ACTIVE_RUNS.add(self)
+        if self.settings.profile_slow and PROFILE_LOCK.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler, such as a debugger's, is active
+                self.profiler = None
+                PROFILE_LOCK.release()
+        self.started = self.switched = time.perf_counter()
+        return self
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self.stack:
+            outer = self.stack[-1]
+            self.stages[outer] = self.stages.get(outer, 0.0) + now - self.switched
+        self.stack.append(stage)
+        self.switched = now
+
+    def leave(self):
+        now = time.perf_counter()
+        stage = self.stack.pop()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.switched
+        self.switched = now
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def timed(self, iterable, name, batch=1024):
+        # Times pulling items from an iterator as the stage and counts them.
+        # Items are pulled in batches, so switching stages costs nothing per
+        # item even when every record passes through several stages.
+        iterator = iter(iterable)
+        items = 0
+        try:
+            while True:
+                self.enter(name)
+                try:
+                    chunk = list(islice(iterator, batch))
+                finally:
+                    self.leave()
+                if not chunk:
+                    return
+                items += len(chunk)
+                yield from chunk
+        finally:
+            self.items[name] = self.items.get(name, 0) + items
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        self.peak_memory = peak_memory()
+        with ACTIVE_LOCK:
+            ACTIVE_RUNS.discard(self)
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                if self.duration >= self.settings.profile_slow:
+                    os.makedirs(self.settings.profile_dir, exist_ok=True)
+                    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    self.profile_path = os.path.join(self.settings.profile_dir, f"{self.name}-{stamp}.prof")
+                    self.profiler.dump_stats(self.profile_path)
+            finally:
+                self.profiler = None
+                PROFILE_LOCK.release()
+        path = self.settings.log_path(RUN_LOG)
+        if path is not None:
+            try:
+                record_metrics(path, self.as_dict())
+            except OSError:
+                pass
+        return self
+
+    def as_dict(self):
+        return {
+            "time": self.time,
+            "run": self.name,
+            "duration": round(self.duration, 4),
+            "stages": {
+                name: {"seconds": round(seconds, 4), **({"items": self.items[name]} if name in self.items else {})}
+                for name, seconds in self.stages.items()
+            },
+            "counts": self.counts,
+            "peak_memory": self.peak_memory,
+            "peak_scope": self.peak_scope,
+            "profile": self.profile_path,
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        counts = ", ".join(f"{value} {name}" for name, value in self.counts.items())
+        summary = f"{self.name} took {self.duration:.2f}s"
+        if stages:
+            summary += f" ({stages})"
+        if counts:
+            summary += f"\n{counts}"
+        if self.peak_memory is not None:
+            summary += f"\npeak memory {format_bytes(self.peak_memory)}"
+            if self.peak_scope == "concurrent":
+                summary += " (shared with runs at the same time)"
+            elif self.peak_scope == "process":
+                summary += " (since the program started)"
+        if self.profile_path:
+            summary += f"\nprofile written to {self.profile_path}"
+        return summary
+
+
+def stage(metrics, name):
+    # For code that runs with or without metrics
+    return nullcontext() if metrics is None else metrics.stage(name)
+
+
+def timed(metrics, iterable, name):
+    return iterable if metrics is None else metrics.timed(iterable, name)
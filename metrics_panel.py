@@ -0,0 +1,33 @@
+from PyQt5.QtWidgets import QFileDialog, QHBoxLayout, QLabel, QMessageBox, QPushButton, QWidget
+
+
+class MetricsPanel(QWidget):
+    # Timings of the last run, with the JSON export for sharing in bug reports
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.metrics = None
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.label = QLabel("No run measured yet")
+        self.label.setWordWrap(True)
+        layout.addWidget(self.label, 1)
+        self.export_button = QPushButton("Export JSON")
+        self.export_button.setEnabled(False)
+        self.export_button.clicked.connect(self.export_metrics)
+        layout.addWidget(self.export_button)
+
+    def show_metrics(self, metrics):
+        self.metrics = metrics
+        self.label.setText(str(metrics))
+        self.export_button.setEnabled(True)
+
+    def export_metrics(self):
+        file_name, _ = QFileDialog.getSaveFileName(
+            self, "Export run metrics", f"{self.metrics.name}-metrics.json", "JSON (*.json)"
+        )
+        if not file_name:
+            return
+        try:
+            self.metrics.save(file_name)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Cannot write {file_name}: {e}")
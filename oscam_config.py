@@ -0,0 +1,175 @@
+import argparse
+import sys
+from conversion_cache import ReaderChanges
+
+SECRET_KEYS = frozenset(("password", "key"))
+# The converter writes the conversion time into every reader's description,
+# which would otherwise make each reader differ between two conversions
+VOLATILE_KEYS = frozenset(("description",))
+
+
+class ConfigSection:
+    __slots__ = ("name", "lineno", "values")
+
+    def __init__(self, name, lineno):
+        self.name = name
+        self.lineno = lineno
+        self.values = {}
+
+    @property
+    def label(self):
+        return self.values.get("label")
+
+    @property
+    def device(self):
+        return self.values.get("device")
+
+    def __repr__(self):
+        return f"ConfigSection({self.name!r}, line {self.lineno})"
+
+
+def parse_sections(buffer):
+    # Plain string operations per line measured faster than one regex over
+    # the whole buffer. Keys are lower-cased, OSCam does not distinguish them.
+    sections = []
+    section = None
+    keys = {}
+    for lineno, line in enumerate(buffer.decode("utf-8", errors="replace").splitlines(), 1):
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line[0] == "[":
+            end = line.find("]")
+            if end > 0:
+                section = ConfigSection(line[1:end].strip().lower(), lineno)
+                sections.append(section)
+            continue
+        key, separator, value = line.partition("=")
+        if not separator or section is None:
+            continue
+        key = key.rstrip()
+        name = keys.get(key)
+        if name is None:
+            name = keys[key] = sys.intern(key.lower())
+        section.values[name] = value.lstrip()
+    return sections
+
+
+class OscamServer:
+    # Readers indexed by label, and by device for lookups of every reader
+    # pointing at the same server. Readers without a label are keyed by
+    # their device.
+    def __init__(self, sections):
+        self.readers = {}
+        self.devices = {}
+        self.duplicates = []
+        for section in sections:
+            if section.name != "reader":
+                continue
+            key = section.label or f"device {section.device}"
+            if key in self.readers:
+                self.duplicates.append(section)
+                continue
+            self.readers[key] = section
+            if section.device:
+                self.devices.setdefault(section.device, []).append(key)
+
+    def __len__(self):
+        return len(self.readers)
+
+
+def read_buffer(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def parse_oscam_server(data):
+    return OscamServer(parse_sections(data))
+
+
+def parse_oscam_conf(data):
+    # Section name -> values; a section repeated in the file is merged
+    config = {}
+    for section in parse_sections(data):
+        config.setdefault(section.name, {}).update(section.values)
+    return config
+
+
+def load_oscam_server(path):
+    return parse_oscam_server(read_buffer(path))
+
+
+def load_oscam_conf(path):
+    return parse_oscam_conf(read_buffer(path))
+
+
+class ReaderDiff(ReaderChanges):
+    def __init__(self, added, removed, changed, fields):
+        super().__init__(added, removed, changed)
+        # label -> [(key, old value, new value)] for every changed reader
+        self.fields = fields
+
+
+def diff_readers(old, new, ignore=VOLATILE_KEYS):
+    # Dictionary lookups only, so the cost grows linearly with the number of
+    # readers and the order of the readers in the files does not matter.
+    added = [label for label in new.readers if label not in old.readers]
+    removed = [label for label in old.readers if label not in new.readers]
+    changed = []
+    fields = {}
+    for label, section in new.readers.items():
+        previous = old.readers.get(label)
+        if previous is None or previous.values == section.values:
+            continue
+        differences = [
+            (key, previous.values.get(key), section.values.get(key))
+            for key in dict.fromkeys([*previous.values, *section.values])
+            if key not in ignore and previous.values.get(key) != section.values.get(key)
+        ]
+        if differences:
+            changed.append(label)
+            fields[label] = differences
+    return ReaderDiff(added, removed, changed, fields)
+
+
+def format_value(key, value):
+    if value is None:
+        return "(unset)"
+    return "***" if key in SECRET_KEYS else value
+
+
+def format_diff(difference):
+    lines = [f"+ {label}" for label in difference.added]
+    lines += [f"- {label}" for label in difference.removed]
+    for label in difference.changed:
+        lines.append(f"~ {label}")
+        for key, old, new in difference.fields[label]:
+            lines.append(f"    {key}: {format_value(key, old)} -> {format_value(key, new)}")
+    lines.append(str(difference))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the readers of two oscam.server files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--ignore", action="append", metavar="KEY",
+                        help="reader setting to leave out of the comparison (default: description)")
+    args = parser.parse_args(argv)
+
+    try:
+        old = load_oscam_server(args.old)
+        new = load_oscam_server(args.new)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    for path, servers in ((args.old, old), (args.new, new)):
+        for section in servers.duplicates:
+            print(f"{path}: line {section.lineno}: duplicate reader {section.label or section.device}", file=sys.stderr)
+    ignore = frozenset(key.lower() for key in args.ignore) if args.ignore else VOLATILE_KEYS
+    print("\n".join(format_diff(diff_readers(old, new, ignore))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
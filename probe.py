@@ -0,0 +1,69 @@
+import asyncio
+import math
+import time
+from readers import ReaderTable
+
+PROBE_POLICIES = ("keep", "fallback", "disable", "drop")
+UNREACHABLE = math.inf
+
+
+class ProbeStats:
+    def __init__(self):
+        self.endpoints = 0
+        self.reachable = 0
+        self.unreachable = 0
+        self.dropped = 0
+        self.duration = 0.0
+
+    def __str__(self):
+        return (f"{self.endpoints} endpoints probed in {self.duration:.1f}s, "
+                f"{self.unreachable} unreachable, {self.dropped} readers dropped")
+
+
+async def probe_endpoint(host, port, semaphore, timeout):
+    # Connect latency in seconds, including the DNS lookup, or UNREACHABLE
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except Exception:
+            # Besides connection errors, a host name that cannot be encoded
+            # for DNS raises UnicodeError; one bad line must not end the probe
+            return UNREACHABLE
+        latency = time.perf_counter() - started
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return latency
+
+
+async def probe_all(endpoints, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = await asyncio.gather(*(probe_endpoint(host, port, semaphore, timeout) for host, port in endpoints))
+    return dict(zip(endpoints, latencies))
+
+
+def probe_endpoints(endpoints, concurrency=256, timeout=3.0):
+    # At most `concurrency` connections are open at once, so the whole run
+    # takes about len(endpoints) / concurrency * timeout in the worst case
+    return asyncio.run(probe_all(list(endpoints), concurrency, timeout))
+
+
+def probe_records(records, policy, stats, concurrency=256, timeout=3.0):
+    # Readers sharing a server are probed once; every reader gets the latency
+    # of its endpoint and unreachable ones are dropped under the drop policy
+    records = ReaderTable(records)
+    started = time.monotonic()
+    latencies = probe_endpoints(dict.fromkeys((record.host, record.port) for record in records), concurrency, timeout)
+    stats.duration = time.monotonic() - started
+    stats.endpoints = len(latencies)
+    stats.unreachable = sum(1 for latency in latencies.values() if latency == UNREACHABLE)
+    stats.reachable = stats.endpoints - stats.unreachable
+    for record in records:
+        record.latency = latencies[(record.host, record.port)]
+        if record.latency == UNREACHABLE and policy == "drop":
+            stats.dropped += 1
+            continue
+        yield record
@@ -0,0 +1,486 @@
+import math
+import mmap
+import re
+from array import array
+
+
+class LineError(ValueError):
+    pass
+
+
+class Diagnostic:
+    __slots__ = ("lineno", "reason", "text")
+
+    def __init__(self, lineno, reason, text):
+        self.lineno = lineno
+        self.reason = reason
+        self.text = text
+
+    def __str__(self):
+        return f"line {self.lineno}: {self.reason}: {self.text}"
+
+
+# Record kinds, the first value of a ReaderTable row
+KIND_C = 0
+KIND_N = 1
+KIND_EXTENDED_N = 2
+
+# A row of ReaderTable.fields: the kind, the port and the start and end
+# offsets in the line of the host, user, password, key and ident
+ROW = 12
+WHITESPACE = b" \t\x0b\x0c"
+NOT_PROBED = math.nan
+# Rows per table when parsing streams records, so a consumer that does not
+# keep them lets the memory go batch by batch
+BATCH_SIZE = 4096
+MAX_LINE = 0xffff
+
+
+class ReaderTable:
+    # Parsed readers stored column by column: numbers in typed arrays and
+    # the text fields as offsets into the buffer the line was read from, so
+    # a row takes about 40 bytes and the table holds no str. Records are
+    # decoded from a row when they are read; suffix, latency, group and
+    # shard set on a record are stored when it is appended to a table.
+    def __init__(self, records=()):
+        self.buffers = []
+        self.buffer_ids = {}
+        self.sources = array("H")
+        self.starts = array("Q")
+        self.linenos = array("L")
+        self.fields = array("H")
+        # Filled in by later stages; rows past the end have the default
+        self.suffixes = {}
+        self.latencies = array("d")
+        self.groups = bytearray()
+        self.shards = array("H")
+        for record in records:
+            self.append_record(record)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, row):
+        fields = self.fields[row * ROW:(row + 1) * ROW]
+        start = self.starts[row]
+        # The ident, or the empty span at the end of the line, comes last
+        line = self.buffers[self.sources[row]][start:start + fields[-1]]
+        record = RECORD_CLASSES[fields[0]](self, row, *decode_fields(line, fields))
+        if self.suffixes:
+            record.suffix = self.suffixes.get(row, "")
+        if row < len(self.latencies):
+            record.latency = self.latency(row)
+        if row < len(self.groups):
+            record.group = self.groups[row] or None
+        if row < len(self.shards):
+            record.shard = self.shards[row] or 1
+        return record
+
+    def __iter__(self):
+        for row in range(len(self.starts)):
+            yield self[row]
+
+    def line(self, row):
+        # The part of the line the row was parsed from
+        start = self.starts[row]
+        return self.buffers[self.sources[row]][start:start + self.fields[row * ROW + ROW - 1]]
+
+    def add_buffer(self, buffer):
+        source = self.buffer_ids.get(id(buffer))
+        if source is None:
+            source = self.buffer_ids[id(buffer)] = len(self.buffers)
+            self.buffers.append(buffer)
+        return source
+
+    def append(self, source, start, lineno, fields):
+        self.sources.append(source)
+        self.starts.append(start)
+        self.linenos.append(lineno)
+        self.fields.extend(fields)
+        return len(self.starts) - 1
+
+    def append_record(self, record):
+        table = record.table
+        row = record.row
+        new_row = self.append(self.add_buffer(table.buffers[table.sources[row]]), table.starts[row],
+                              table.linenos[row], table.fields[row * ROW:(row + 1) * ROW])
+        if record.suffix:
+            self.suffixes[new_row] = record.suffix
+        if record.latency is not None:
+            self.set_latency(new_row, record.latency)
+        if record.group is not None:
+            self.set_group(new_row, record.group)
+        if record.shard != 1:
+            self.set_shard(new_row, record.shard)
+
+    @staticmethod
+    def fill(column, row, default):
+        if len(column) <= row:
+            column.extend([default] * (row + 1 - len(column)))
+
+    def latency(self, row):
+        latency = self.latencies[row] if row < len(self.latencies) else NOT_PROBED
+        return None if math.isnan(latency) else latency
+
+    def set_latency(self, row, latency):
+        self.fill(self.latencies, row, NOT_PROBED)
+        self.latencies[row] = latency
+
+    def group(self, row):
+        # 0 is no group, OSCam groups are 1 to 64
+        return (self.groups[row] if row < len(self.groups) else 0) or None
+
+    def set_group(self, row, group):
+        self.fill(self.groups, row, 0)
+        self.groups[row] = group
+
+    def shard(self, row):
+        return (self.shards[row] if row < len(self.shards) else 0) or 1
+
+    def set_shard(self, row, shard):
+        self.fill(self.shards, row, 0)
+        self.shards[row] = shard
+
+
+
+class CLine:
+    # A reader decoded from a row of a ReaderTable. latency is the connect
+    # time in seconds once probed, math.inf when the server did not answer,
+    # None when it was not probed. group is None unless groups are assigned
+    # automatically.
+    __slots__ = ("table", "row", "host", "port", "user", "password", "suffix", "latency", "group", "shard")
+    kind = "C"
+    protocol = "cccam"
+    key = ""
+    caid = ""
+    ident = ""
+
+    def __init__(self, table, row, host, port, user, password, key, ident):
+        self.table = table
+        self.row = row
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.suffix = ""
+        self.latency = None
+        self.group = None
+        self.shard = 1
+
+    @property
+    def lineno(self):
+        return self.table.linenos[self.row]
+
+    @property
+    def endpoint(self):
+        return (self.host.lower(), self.port, self.user)
+
+    @property
+    def identity(self):
+        return (self.kind, self.host.lower(), self.port, self.user, self.ident)
+
+    @property
+    def secret(self):
+        return (self.password, self.key)
+
+    @property
+    def label(self):
+        return f"{self.user}@{self.host}:{self.port}{self.suffix}"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.label!r}, line {self.lineno})"
+
+
+class NLine(CLine):
+    __slots__ = ("key",)
+    kind = "N"
+    protocol = "newcamd"
+
+    def __init__(self, table, row, host, port, user, password, key, ident):
+        self.table = table
+        self.row = row
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.suffix = ""
+        self.latency = None
+        self.group = None
+        self.shard = 1
+        self.key = key
+
+
+class ExtendedNLine(NLine):
+    __slots__ = ("caid", "ident")
+
+    def __init__(self, table, row, host, port, user, password, key, ident):
+        self.table = table
+        self.row = row
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.suffix = ""
+        self.latency = None
+        self.group = None
+        self.shard = 1
+        self.key = key
+        self.ident = ident
+        self.caid = ident.split(":")[0]
+
+    @property
+    def label(self):
+        return f"{self.user}@{self.host}:{self.port} {self.ident}{self.suffix}"
+
+
+RECORD_CLASSES = (CLine, NLine, ExtendedNLine)
+
+READER_LINE_RE = re.compile(rb"^[CN]:[^\r\n]*", re.MULTILINE)
+TOKEN_RE = re.compile(rb"\S+")
+HEX_RE = re.compile(rb"[0-9A-Fa-f]+")
+PORT_RE = re.compile(rb"[0-9]+")
+CAID_IDENT_RE = re.compile(rb"[0-9A-Fa-f]{4}:[0-9A-Fa-f]{1,6}(,[0-9A-Fa-f]{1,6})*")
+# The usual layouts, matched in one go; anything else is tokenized
+C_LINE_RE = re.compile(rb"C:\s+(\S+)\s+([0-9]+)\s+(\S+)\s+(\S+)")
+N_LINE_RE = re.compile(rb"N:\s+(\S+)\s+([0-9]+)\s+(\S+)\s+(\S+)\s+([0-9A-Fa-f][0-9A-Fa-f\s]*[0-9A-Fa-f])"
+                       rb"(?:\s+#\s+(\S+))?\s*$")
+
+
+def span_text(line, start, end):
+    return line[start:end].decode("utf-8", errors="replace")
+
+
+def parse_port(line, start, end):
+    port = int(line[start:end]) if PORT_RE.fullmatch(line, start, end) else 0
+    if not 0 < port < 65536:
+        raise LineError(f"Invalid port '{span_text(line, start, end)}'")
+    return port
+
+
+def check_ident(line, start, end):
+    if not CAID_IDENT_RE.fullmatch(line, start, end):
+        raise LineError(f"Malformed caid:ident '{span_text(line, start, end)}'")
+
+
+def parse_tokens(line):
+    # The general case: whitespace separated tokens, the DES key as the
+    # tokens up to a standalone '#' joined, the caid:ident the token after it
+    tokens = [match.span() for match in TOKEN_RE.finditer(line)]
+    if len(tokens) < 5:
+        raise LineError("Line is incomplete")
+    if tokens[0][1] - tokens[0][0] != 2:
+        # "C:host ..." is not a reader line
+        return None
+    (host_start, host_end), port, (user_start, user_end), (password_start, password_end) = tokens[1:5]
+    port = parse_port(line, *port)
+    end = len(line)
+    if line[0] == ord("C"):
+        return KIND_C, port, host_start, host_end, user_start, user_end, password_start, password_end, end, end, end, end
+
+    key_tokens = tokens[5:]
+    ident_start = ident_end = end
+    for index, (token_start, token_end) in enumerate(key_tokens):
+        if token_end - token_start == 1 and line[token_start] == ord("#"):
+            if index + 1 >= len(key_tokens):
+                raise LineError("Missing caid:ident after '#'")
+            ident_start, ident_end = key_tokens[index + 1]
+            check_ident(line, ident_start, ident_end)
+            key_tokens = key_tokens[:index]
+            break
+    if (sum(token_end - token_start for token_start, token_end in key_tokens) != 28
+            or not all(HEX_RE.fullmatch(line, token_start, token_end) for token_start, token_end in key_tokens)):
+        key = "".join(span_text(line, token_start, token_end) for token_start, token_end in key_tokens)
+        raise LineError(f"Malformed DES key '{key}'")
+    return (KIND_N if ident_start == end else KIND_EXTENDED_N), port, host_start, host_end, user_start, user_end, \
+        password_start, password_end, key_tokens[0][0], key_tokens[-1][1], ident_start, ident_end
+
+
+def parse_reader(line):
+    # The row of a reader line for ReaderTable.fields, None when it is not a
+    # reader line after all. The usual layouts are matched by one regex, the
+    # rest is tokenized.
+    if len(line) > MAX_LINE:
+        raise LineError("Line is too long")
+    if line[0] == ord("C"):
+        match = C_LINE_RE.match(line)
+        if match is None:
+            return parse_tokens(line)
+        _, (host_start, host_end), (port_start, port_end), (user_start, user_end), \
+            (password_start, password_end) = match.regs
+        kind = KIND_C
+        key_start = key_end = ident_start = ident_end = len(line)
+    else:
+        match = N_LINE_RE.match(line)
+        if match is None:
+            return parse_tokens(line)
+        _, (host_start, host_end), (port_start, port_end), (user_start, user_end), \
+            (password_start, password_end), (key_start, key_end), (ident_start, ident_end) = match.regs
+        if len(line[key_start:key_end].translate(None, WHITESPACE)) != 28:
+            return parse_tokens(line)
+        if ident_start == -1:
+            kind = KIND_N
+            ident_start = ident_end = len(line)
+        else:
+            kind = KIND_EXTENDED_N
+            check_ident(line, ident_start, ident_end)
+    port = int(line[port_start:port_end])
+    if not 0 < port < 65536:
+        raise LineError(f"Invalid port '{span_text(line, port_start, port_end)}'")
+    return kind, port, host_start, host_end, user_start, user_end, password_start, password_end, \
+        key_start, key_end, ident_start, ident_end
+
+
+def reader_lines(buffer):
+    # (lineno, start, end) of every C:/N: line; everything else is skipped by
+    # the regex scan and only counted to keep line numbers right
+    lineno = 1
+    position = 0
+    for match in READER_LINE_RE.finditer(buffer):
+        start = match.start()
+        if start > position:
+            lineno += buffer[position:start].count(b"\n")
+        position = start
+        yield lineno, start, match.end()
+
+
+def decode_fields(line, fields):
+    # (host, port, user, password, key, ident) of a row, the key without the
+    # whitespace between its bytes
+    _, port, host_start, host_end, user_start, user_end, password_start, password_end, key_start, key_end, \
+        ident_start, ident_end = fields
+    return (line[host_start:host_end].decode("utf-8", "replace"), port,
+            line[user_start:user_end].decode("utf-8", "replace"),
+            line[password_start:password_end].decode("utf-8", "replace"),
+            line[key_start:key_end].translate(None, WHITESPACE).decode("ascii"),
+            line[ident_start:ident_end].decode("ascii"))
+
+
+def report_error(diagnostics, lineno, error, line):
+    if diagnostics is not None:
+        diagnostics.append(Diagnostic(lineno, str(error), line.decode("utf-8", errors="replace")))
+
+
+def parse_buffer(buffer, diagnostics=None, batch_size=BATCH_SIZE):
+    # Yields a record per reader line; only its fields are decoded. Records
+    # share a table per batch_size lines, which refers to the buffer.
+    row = batch_size
+    for lineno, start, end in reader_lines(buffer):
+        if row >= batch_size:
+            table = ReaderTable()
+            source = table.add_buffer(buffer)
+        line = buffer[start:end]
+        try:
+            parsed = parse_reader(line)
+        except LineError as e:
+            report_error(diagnostics, lineno, e, line)
+            continue
+        if parsed is not None:
+            row = table.append(source, start, lineno, parsed)
+            yield RECORD_CLASSES[parsed[0]](table, row, *decode_fields(line, parsed))
+            row += 1
+
+
+def parse_lines(lines, diagnostics=None, batch_size=BATCH_SIZE):
+    # The reader lines are copied into a buffer per batch
+    row = batch_size
+    for lineno, line in enumerate(lines, 1):
+        if not line.startswith(("C:", "N:")):
+            continue
+        if row >= batch_size:
+            table = ReaderTable()
+            buffer = bytearray()
+            source = table.add_buffer(buffer)
+        line = line.encode("utf-8")
+        try:
+            parsed = parse_reader(line)
+        except LineError as e:
+            report_error(diagnostics, lineno, e, line)
+            continue
+        if parsed is not None:
+            row = table.append(source, len(buffer), lineno, parsed)
+            buffer += line
+            yield RECORD_CLASSES[parsed[0]](table, row, *decode_fields(line, parsed))
+            row += 1
+
+
+def parse_line(line, lineno=0):
+    # A single line, for callers outside the streaming parsers; None for a
+    # line that is not a reader line
+    if not line.startswith(("C:", "N:")):
+        return None
+    buffer = line.encode("utf-8")
+    parsed = parse_reader(buffer)
+    if parsed is None:
+        return None
+    table = ReaderTable()
+    row = table.append(table.add_buffer(buffer), 0, lineno, parsed)
+    return RECORD_CLASSES[parsed[0]](table, row, *decode_fields(buffer, parsed))
+
+
+def count_reader_lines(buffer, chunk_size=8 * 1024 * 1024):
+    # Counts C:/N: lines in fixed size chunks; each chunk reads two bytes past
+    # its end so a line start split across two chunks is counted exactly once.
+    c_lines = 1 if buffer[:2] == b"C:" else 0
+    n_lines = 1 if buffer[:2] == b"N:" else 0
+    for start in range(0, len(buffer), chunk_size):
+        chunk = buffer[start:start + chunk_size + 2]
+        c_lines += chunk.count(b"\nC:")
+        n_lines += chunk.count(b"\nN:")
+    return c_lines, n_lines
+
+
+def preview_lines(buffer, limit):
+    preview = []
+    for match in READER_LINE_RE.finditer(buffer):
+        if len(preview) >= limit:
+            break
+        preview.append(match.group().decode("utf-8", errors="replace"))
+    return preview
+
+
+class FileScan:
+    def __init__(self, path, size, c_lines, n_lines, preview):
+        self.path = path
+        self.size = size
+        self.c_lines = c_lines
+        self.n_lines = n_lines
+        self.preview = preview
+
+
+def scan_file(path, preview_limit=500):
+    with open(path, "rb") as file:
+        size = file.seek(0, 2)
+        if not size:
+            return FileScan(path, 0, 0, 0, [])
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            c_lines, n_lines = count_reader_lines(buffer)
+            return FileScan(path, size, c_lines, n_lines, preview_lines(buffer, preview_limit))
+
+
+def map_file(path):
+    # The mapping is closed when the last record referring to it is gone
+    with open(path, "rb") as file:
+        if not file.seek(0, 2):
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_file(path, diagnostics=None):
+    yield from parse_buffer(map_file(path), diagnostics)
+
+
+def load_readers(path, diagnostics=None):
+    # All readers of a file in one table, for callers that keep them
+    table = ReaderTable()
+    buffer = map_file(path)
+    source = table.add_buffer(buffer)
+    for lineno, start, end in reader_lines(buffer):
+        line = buffer[start:end]
+        try:
+            parsed = parse_reader(line)
+        except LineError as e:
+            report_error(diagnostics, lineno, e, line)
+            continue
+        if parsed is not None:
+            table.append(source, start, lineno, parsed)
+    return table
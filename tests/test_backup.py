@@ -0,0 +1,110 @@
+import ftplib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup
+import ftp_sessions
+import ftp_tasks
+from ftp_tasks import FTPTarget, TaskContext, TransferSettings
+
+FILES = {"oscam.conf": b"[global]\n", "oscam.server": b"[reader]\nlabel = a\n" * 100, "oscam.user": b"[account]\n"}
+
+
+class FakeFTP:
+    # The parts of ftplib.FTP a backup uses. Like ftplib.FTP, quit() after
+    # close() raises AttributeError. The first RETR of fail_once drops the
+    # connection.
+    failed = set()
+
+    def __init__(self, fail_once=None):
+        self.host = "receiver"
+        self.sock = object()
+        self.fail_once = fail_once
+
+    def check(self):
+        if self.sock is None:
+            raise AttributeError("'NoneType' object has no attribute 'sendall'")
+
+    def cwd(self, directory):
+        self.check()
+
+    def mlsd(self, facts=None):
+        self.check()
+        return [(name, {"type": "file", "size": str(len(data)), "modify": "20260101000000"}) for name, data in FILES.items()]
+
+    def sendcmd(self, command):
+        self.check()
+        return "211 REST STREAM"
+
+    def voidcmd(self, command):
+        self.check()
+        return "200 OK"
+
+    def size(self, name):
+        self.check()
+        return len(FILES[name])
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        self.check()
+        name = command.split(" ", 1)[1]
+        data = FILES[name][rest or 0:]
+        if name == self.fail_once and name not in self.failed:
+            self.failed.add(name)
+            callback(data[:10])
+            raise ConnectionResetError("connection reset by peer")
+        callback(data)
+        return "226 Transfer complete"
+
+    def quit(self):
+        self.check()
+        self.sock = None
+
+    def close(self):
+        self.sock = None
+
+
+class BackupRetryTest(unittest.TestCase):
+    def setUp(self):
+        FakeFTP.failed = set()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        connect = mock.patch.object(ftp_sessions, "open_connection", lambda target: FakeFTP())
+        retry = mock.patch.object(backup, "open_connection", lambda target: FakeFTP("oscam.server"))
+        settings = mock.patch.object(ftp_tasks.TransferSettings, "load", classmethod(lambda cls: TransferSettings(backoff=0)))
+        metrics = mock.patch.object(ftp_tasks, "record_metrics", lambda path, record: None)
+        for patch in (connect, retry, settings, metrics):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(ftp_sessions.SESSIONS.close_all)
+
+    def test_failed_transfer_is_retried_and_backup_completes(self):
+        task = TaskContext(log=lambda message: None)
+        path = backup.backup_configuration(FTPTarget("receiver", "root", "pw", "/etc/tuxbox/config"), task,
+                                           backup_dir=os.path.join(self.tmp_dir.name, "backups"), max_connections=1)
+
+        self.assertIsNotNone(path)
+        self.assertEqual(FakeFTP.failed, {"oscam.server"})
+        self.assertEqual(task.errors, [])
+        store = backup.BackupStore(os.path.join(self.tmp_dir.name, "backups"))
+        snapshot = store.latest_snapshot("receiver", "/etc/tuxbox/config")
+        self.assertEqual(set(snapshot["files"]), set(FILES))
+        self.assertEqual(store.read(snapshot["files"]["oscam.server"]["sha256"]), FILES["oscam.server"])
+
+    def test_closed_connections_are_not_quit(self):
+        connections = backup.ConnectionPerThread(FTPTarget("receiver", "root", "pw", "/"))
+        with self.assertRaises(ConnectionResetError):
+            with connections.session():
+                raise ConnectionResetError()
+        with connections.session():
+            pass
+        self.assertEqual(len(connections.connections), 1)
+        connections.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
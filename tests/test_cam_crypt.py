@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cam_crypt import CCcamCipher, cccam_ciphers
+
+# Computed with cc_init_crypt, cc_crypt and cc_xor copied from OSCam's
+# module-cccam.c and OpenSSL's SHA1, following the client side of
+# cc_cli_connect
+KEY = bytes(i * 7 + 3 for i in range(20))
+PLAINTEXT = b"The quick brown fox jumps over!!"
+CIPHERTEXT = bytes.fromhex("1ff8f2d31b97d9bbded738bf76cc8e6251599d6bbf99d16368608abc064b6aac")
+GREETING = bytes(0xa0 + i * 3 for i in range(16))
+LOGIN_HASH = bytes.fromhex("3911e182e8d2a3a7f51c0c986e42fb72ba486571")
+LOGIN_USER = bytes.fromhex("6c4a8080efb3f81d36ec679b57b82a5589f36d89")
+LOGIN_CCCAM = bytes.fromhex("f86443f547f2")
+SERVER_ACK = bytes.fromhex("f1453c956ea50c731a0ffccebdf1427e70d4afd5")
+
+
+class CCcamCipherTest(unittest.TestCase):
+    def test_encrypt_matches_oscam(self):
+        cipher = CCcamCipher(KEY)
+        self.assertEqual(cipher.encrypt(PLAINTEXT[:16]) + cipher.encrypt(PLAINTEXT[16:]), CIPHERTEXT)
+
+    def test_decrypt_matches_oscam(self):
+        self.assertEqual(CCcamCipher(KEY).decrypt(CIPHERTEXT), PLAINTEXT)
+
+    def test_client_login_matches_oscam(self):
+        receive_cipher, send_cipher, digest = cccam_ciphers(GREETING)
+        self.assertEqual(send_cipher.encrypt(digest), LOGIN_HASH)
+        self.assertEqual(send_cipher.encrypt(b"user1".ljust(20, b"\0")), LOGIN_USER)
+        send_cipher.encrypt(b"secret")
+        self.assertEqual(send_cipher.encrypt(b"CCcam\0"), LOGIN_CCCAM)
+        self.assertEqual(receive_cipher.decrypt(SERVER_ACK), b"CCcam".ljust(20, b"\0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
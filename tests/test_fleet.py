@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fleet
+
+CONFIG = """\
+[FTP]
+username = root
+password = secret
+
+[host lab1]
+host = 10.0.0.1
+groups = lab
+
+[host lab2]
+groups = lab
+
+[host lab3]
+host = 10.0.0.3
+timeout = soon
+"""
+
+
+class LoadInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "cccam2oscam.conf")
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(CONFIG)
+
+    def test_invalid_hosts_are_skipped_and_reported_with_their_line(self):
+        diagnostics = []
+        hosts = fleet.load_inventory(self.path, diagnostics)
+
+        self.assertEqual([(host.name, host.host, host.password, host.timeout) for host in hosts],
+                         [("lab1", "10.0.0.1", "secret", 30)])
+        self.assertEqual([(diagnostic.lineno, diagnostic.text) for diagnostic in diagnostics],
+                         [(9, "[host lab2]"), (14, "timeout = soon")])
+        self.assertIn("no host", diagnostics[0].reason)
+        self.assertIn("timeout", diagnostics[1].reason)
+
+    def test_invalid_default_timeout_points_at_the_ftp_section(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(CONFIG.replace("password = secret\n", "password = secret\ntimeout = -1\n"))
+        diagnostics = []
+        self.assertEqual(fleet.load_inventory(self.path, diagnostics), [])
+        self.assertEqual([diagnostic.lineno for diagnostic in diagnostics], [4, 10, 15])
+
+
+if __name__ == "__main__":
+    unittest.main()
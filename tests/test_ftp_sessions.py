@@ -0,0 +1,90 @@
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ftp_sessions
+from ftp_tasks import FTPTarget, TaskContext
+
+
+class FakeFTP:
+    # A control connection on one end of a socket pair; quit() waits for a
+    # reply that never comes, like a server that stopped answering
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.quit_called = False
+
+    def read_reply(self):
+        data = self.sock.recv(1)
+        if not data:
+            raise EOFError()
+        return data
+
+    def voidcmd(self, command):
+        return "200 OK"
+
+    def quit(self):
+        self.quit_called = True
+        self.read_reply()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.peer.close()
+        self.sock = None
+
+
+class CloseAllTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        patch = mock.patch.object(ftp_sessions, "open_connection", self.open_connection)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.sessions = ftp_sessions.SessionManager()
+        self.addCleanup(self.sessions.stopped.set)
+        self.task = TaskContext(log=lambda message: None)
+
+    def open_connection(self, target):
+        ftp = FakeFTP()
+        self.connections.append(ftp)
+        return ftp
+
+    def test_close_all_without_wait_does_not_block_on_busy_sessions(self):
+        busy = threading.Event()
+        failed = []
+
+        def operation():
+            try:
+                with self.sessions.session(FTPTarget("busy", "root", "pw", "/"), self.task) as ftp:
+                    busy.set()
+                    ftp.read_reply()
+            except EOFError as e:
+                failed.append(e)
+
+        with self.sessions.session(FTPTarget("idle", "root", "pw", "/"), self.task):
+            pass
+        thread = threading.Thread(target=operation)
+        thread.start()
+        self.assertTrue(busy.wait(5))
+
+        started = time.monotonic()
+        self.sessions.close_all(wait=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(self.sessions.sessions, {})
+        idle, busy_connection = self.connections
+        self.assertFalse(idle.quit_called)
+        self.assertIsNone(idle.sock)
+        self.assertIsNone(busy_connection.sock)
+
+
+if __name__ == "__main__":
+    unittest.main()
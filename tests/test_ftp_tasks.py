@@ -0,0 +1,130 @@
+import ftplib
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ftp_sessions
+import ftp_tasks
+from ftp_tasks import FTPTarget, TaskContext, TransferSettings
+
+LOCAL = b"[reader]\nlabel = new\n" * 50
+
+
+class FakeFTP:
+    # A directory of files in memory, with the features of the server given
+    # as FEAT lines. Every command sent is kept in commands.
+    def __init__(self, files, features=()):
+        self.host = "receiver"
+        self.files = files
+        self.features = features
+        self.commands = []
+
+    def cwd(self, directory):
+        pass
+
+    def voidcmd(self, command):
+        self.commands.append(command)
+        return "200 OK"
+
+    def sendcmd(self, command):
+        self.commands.append(command)
+        verb, _, name = command.partition(" ")
+        if verb == "FEAT":
+            return "\n".join(["211-Features:"] + [f" {feature}" for feature in self.features] + ["211 End"])
+        if verb == "OPTS":
+            return "200 OPTS HASH SHA-256"
+        if verb == "HASH" and any(feature.startswith("HASH") for feature in self.features):
+            data = self.files[name]
+            return f"213 SHA-256 0-{len(data)} {hashlib.sha256(data).hexdigest()} {name}"
+        if verb == "XSHA256" and "XSHA256" in self.features:
+            return f"250 {hashlib.sha256(self.files[name]).hexdigest()}"
+        raise ftplib.error_perm("500 Unknown command")
+
+    def size(self, name):
+        self.commands.append(f"SIZE {name}")
+        if name not in self.files:
+            raise ftplib.error_perm("550 No such file")
+        return len(self.files[name])
+
+    def retrbinary(self, command, callback, blocksize=8192, rest=None):
+        self.commands.append(command)
+        name = command.split(" ", 1)[1]
+        if name not in self.files:
+            raise ftplib.error_perm("550 No such file")
+        callback(self.files[name])
+        return "226 Transfer complete"
+
+    def storbinary(self, command, file, blocksize=8192, callback=None, rest=None):
+        self.commands.append(command)
+        self.files[command.split(" ", 1)[1]] = file.read()
+        return "226 Transfer complete"
+
+    def rename(self, source, destination):
+        self.files[destination] = self.files.pop(source)
+
+    def delete(self, name):
+        del self.files[name]
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.local_path = os.path.join(self.tmp_dir.name, "oscam.server")
+        with open(self.local_path, "wb") as file:
+            file.write(LOCAL)
+        settings = mock.patch.object(ftp_tasks.TransferSettings, "load", classmethod(lambda cls: TransferSettings(backoff=0)))
+        metrics = mock.patch.object(ftp_tasks, "record_metrics", lambda path, record: None)
+        for patch in (settings, metrics):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(ftp_sessions.SESSIONS.close_all)
+
+    def upload(self, files, features=()):
+        ftp = FakeFTP(files, features)
+        with mock.patch.object(ftp_sessions, "open_connection", lambda target: ftp):
+            task = TaskContext(log=lambda message: None)
+            ftp_tasks.upload_oscam_server(FTPTarget("receiver", "root", "pw", "/etc/tuxbox/config"), task, self.local_path)
+        self.assertEqual(task.errors, [])
+        return ftp
+
+    def retrieved(self, ftp):
+        return [command for command in ftp.commands if command.startswith("RETR")]
+
+    def test_identical_file_is_compared_by_the_server_digest(self):
+        for features in (["HASH SHA-1*;SHA-256;MD5"], ["XSHA256"]):
+            ftp = self.upload({"oscam.server": LOCAL}, features)
+            self.assertEqual(self.retrieved(ftp), [])
+            self.assertFalse(any(command.startswith("STOR") for command in ftp.commands))
+
+    def test_file_of_another_size_is_not_read_to_compare(self):
+        ftp = self.upload({"oscam.server": b"[reader]\nlabel = old\n"}, ["XSHA256"])
+        # Only for the backup, after the upload was verified by its digest
+        self.assertEqual(self.retrieved(ftp), ["RETR oscam.server"])
+        self.assertEqual(ftp.files["oscam.server"], LOCAL)
+        self.assertIn(b"[reader]\nlabel = old\n", ftp.files.values())
+
+    def test_file_is_read_when_the_server_computes_no_digest(self):
+        ftp = self.upload({"oscam.server": LOCAL})
+        self.assertEqual(self.retrieved(ftp), ["RETR oscam.server"])
+        self.assertFalse(any(command.startswith("STOR") for command in ftp.commands))
+
+    def test_missing_file_is_uploaded_without_backup(self):
+        ftp = self.upload({}, ["HASH SHA-256"])
+        self.assertEqual(self.retrieved(ftp), [])
+        self.assertEqual(ftp.files, {"oscam.server": LOCAL})
+
+
+if __name__ == "__main__":
+    unittest.main()
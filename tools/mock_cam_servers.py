@@ -0,0 +1,145 @@
+# Local CCcam and newcamd stand-ins, for trying the login check without real
+# servers. Opens a CCcam and a newcamd server with --count accounts each,
+# plus a server that never answers and one that answers garbage, and writes
+# C/N-lines whose user name says what the check should report for them:
+#
+#     python tools/mock_cam_servers.py --count 500 -o mock.cfg
+#     python handshake.py mock.cfg --failed
+import argparse
+import asyncio
+import os
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cam_crypt import TripleDES, cccam_ciphers, md5_crypt, newcamd_key
+from handshake import (NEWCAMD_LOGIN, NEWCAMD_LOGIN_ACK, NEWCAMD_LOGIN_NAK, HandshakeError, newcamd_message,
+                       receive_newcamd_message)
+
+DES_KEY = bytes(range(1, 15))
+WRONG_DES_KEY = bytes(range(2, 16))
+
+
+async def close(writer, reader=None):
+    # Waiting for the client to hang up first keeps a connection reset from
+    # racing the last answer
+    if reader is not None:
+        try:
+            await asyncio.wait_for(reader.read(), 5)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+async def cccam_server(accounts, reader, writer):
+    greeting = os.urandom(16)
+    writer.write(greeting)
+    receive_cipher, send_cipher, digest = cccam_ciphers(greeting, server=True)
+    try:
+        if receive_cipher.decrypt(await reader.readexactly(20)) != digest:
+            return
+        user = receive_cipher.decrypt(await reader.readexactly(20)).rstrip(b"\0").decode("utf-8", "replace")
+        password = accounts.get(user)
+        if password is None:
+            return
+        receive_cipher.encrypt(password.encode("utf-8"))
+        if receive_cipher.decrypt(await reader.readexactly(6)) != b"CCcam\0":
+            return
+        writer.write(send_cipher.encrypt(b"CCcam".ljust(20, b"\0")))
+        await writer.drain()
+        await close(writer, reader)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        await close(writer)
+
+
+async def newcamd_server(accounts, reader, writer):
+    modifier = os.urandom(14)
+    writer.write(modifier)
+    cipher = TripleDES(newcamd_key(DES_KEY, modifier))
+    try:
+        command, body = await receive_newcamd_message(reader, cipher, None, "")
+        user, crypted = body.split(b"\0")[:2]
+        password = accounts.get(user.decode("utf-8", "replace"))
+        accepted = (command == NEWCAMD_LOGIN and password is not None
+                    and md5_crypt(password, crypted.decode("ascii", "replace")[3:11]) == crypted.decode("ascii", "replace"))
+        writer.write(newcamd_message(cipher, NEWCAMD_LOGIN_ACK if accepted else NEWCAMD_LOGIN_NAK, b""))
+        await writer.drain()
+        await close(writer, reader)
+    except (HandshakeError, ValueError, ConnectionError):
+        # A message that does not decrypt means a wrong DES key, like a real
+        # server the stand-in just hangs up
+        pass
+    finally:
+        await close(writer)
+
+
+async def silent_server(reader, writer):
+    await reader.read()
+    await close(writer)
+
+
+async def garbage_server(greeting_size, reader, writer):
+    writer.write(os.urandom(greeting_size))
+    try:
+        await reader.read(1)
+        await asyncio.sleep(0.1)
+        writer.write((24).to_bytes(2, "big") + os.urandom(24))
+        await writer.drain()
+        await close(writer, reader)
+    except ConnectionError:
+        pass
+    await close(writer)
+
+
+def format_key(key):
+    return " ".join(f"{byte:02x}" for byte in key)
+
+
+async def serve(count, output):
+    accounts = {f"ok{i}": f"pass{i}" for i in range(count)}
+    servers = {
+        "cccam": await asyncio.start_server(partial(cccam_server, accounts), "127.0.0.1", 0, backlog=4096),
+        "newcamd": await asyncio.start_server(partial(newcamd_server, accounts), "127.0.0.1", 0, backlog=4096),
+        "silent": await asyncio.start_server(silent_server, "127.0.0.1", 0, backlog=4096),
+        "garbage-c": await asyncio.start_server(partial(garbage_server, 16), "127.0.0.1", 0, backlog=4096),
+        "garbage-n": await asyncio.start_server(partial(garbage_server, 14), "127.0.0.1", 0, backlog=4096),
+    }
+    ports = {name: server.sockets[0].getsockname()[1] for name, server in servers.items()}
+    key, wrong_key = format_key(DES_KEY), format_key(WRONG_DES_KEY)
+    with open(output, "w", encoding="utf-8") as file:
+        for i in range(count):
+            file.write(f"C: 127.0.0.1 {ports['cccam']} ok{i} pass{i}\n")
+            file.write(f"N: 127.0.0.1 {ports['newcamd']} ok{i} pass{i} {key}\n")
+        for i in range(max(count // 10, 1)):
+            file.write(f"C: 127.0.0.1 {ports['cccam']} ok{i} badpassword{i}\n")
+            file.write(f"N: 127.0.0.1 {ports['newcamd']} ok{i} badpassword{i} {key}\n")
+            file.write(f"N: 127.0.0.1 {ports['newcamd']} badkey{i} pass{i} {wrong_key}\n")
+            file.write(f"C: 127.0.0.1 {ports['silent']} timeout{i} pass{i}\n")
+            file.write(f"N: 127.0.0.1 {ports['silent']} timeout{i} pass{i} {key}\n")
+            file.write(f"C: 127.0.0.1 {ports['garbage-c']} protocolerror{i} pass{i}\n")
+            file.write(f"N: 127.0.0.1 {ports['garbage-n']} protocolerror{i} pass{i} {key}\n")
+    print(f"Servers listening on {ports}, lines written to {output}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local CCcam and newcamd servers for trying the login check")
+    parser.add_argument("--count", type=int, default=100, help="working accounts per protocol (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="mock.cfg", help="CCcam.cfg to write (default: %(default)s)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.count, args.output))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# Local stand-ins for the servers of a CCcam.cfg, for trying the reachability
+# probe without touching real servers. Opens --count listeners on 127.0.0.1,
+# writes C-lines for them plus --dead C-lines pointing at closed ports, and
+# keeps the listeners open until interrupted:
+#
+#     python tools/mock_listeners.py --count 1000 --dead 200 -o mock.cfg
+#     python converter.py mock.cfg -o oscam.server --probe drop
+import argparse
+import asyncio
+import socket
+import sys
+
+
+async def accept(reader, writer):
+    writer.close()
+
+
+def closed_ports(count):
+    # Ports that were free a moment ago; nothing listens on them afterwards
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+async def serve(count, dead, output):
+    servers = [await asyncio.start_server(accept, "127.0.0.1", 0) for _ in range(count)]
+    ports = [server.sockets[0].getsockname()[1] for server in servers]
+    with open(output, "w", encoding="utf-8") as file:
+        for number, port in enumerate(ports):
+            file.write(f"C: 127.0.0.1 {port} alive{number} password\n")
+        for number, port in enumerate(closed_ports(dead)):
+            file.write(f"C: 127.0.0.1 {port} dead{number} password\n")
+    print(f"{count} listeners open, {dead} dead endpoints, lines written to {output}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local TCP listeners standing in for CCcam servers")
+    parser.add_argument("--count", type=int, default=100, help="listening endpoints (default: %(default)s)")
+    parser.add_argument("--dead", type=int, default=20, help="endpoints nothing listens on (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="mock.cfg", help="CCcam.cfg to write (default: %(default)s)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.count, args.dead, args.output))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
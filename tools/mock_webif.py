@@ -0,0 +1,73 @@
+# Stand-in for the OSCam WebIF, for trying restarts and reader reloads
+# without a receiver. Every request is printed and answered like OSCam would:
+#
+#     python tools/mock_webif.py --port 8888
+#
+# Point an oscam.conf with "httpport = 8888" at it, for example through a
+# local FTP server.
+import argparse
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGES = ("/shutdown.html", "/readers.html", "/status.html")
+
+
+class WebIFHandler(BaseHTTPRequestHandler):
+    server_version = "OSCam-standin"
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if self.server.restart_until > time.monotonic():
+            # OSCam is down while it restarts
+            self.close_connection = True
+            return
+        if url.path not in PAGES:
+            self.send_error(404)
+            return
+        self.server.requests.append((url.path, params))
+        print(f"{url.path} {params}", flush=True)
+        if url.path == "/shutdown.html" and params.get("action") == "Restart":
+            self.server.restart_until = time.monotonic() + self.server.restart_time
+
+        body = f"<html><body>OSCam stand-in: {url.path}</body></html>".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockWebIF(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, restart_time=5.0):
+        super().__init__(address, WebIFHandler)
+        self.requests = []
+        self.restart_time = restart_time
+        self.restart_until = 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in OSCam WebIF")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--restart-time", type=float, default=5.0,
+                        help="seconds the WebIF stays unreachable after a restart (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    server = MockWebIF((args.host, args.port), args.restart_time)
+    print(f"OSCam WebIF stand-in listening on {args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_right
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QListView, QLineEdit,
+                             QPushButton, QLabel, QAbstractItemView)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+
+LABEL_RE = re.compile(rb"^[ \t]*label[ \t]*=[ \t]*([^\r\n]*?)[ \t]*\r?$", re.MULTILINE)
+
+
+class LazyFileModel(QAbstractListModel):
+    # Lines are indexed by byte offset in chunks as the view asks for them and
+    # decoded only when displayed, so the file is never loaded as a whole.
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path, parent=None, complete=True):
+        super().__init__(parent)
+        self.file = open(path, "rb")
+        self.complete = complete
+        self.size = 0
+        self.buffer = b""
+        self.remap()
+        self.offsets = array("Q", [0])
+        self.scanned = 0
+        self.labels = {}
+
+    def remap(self):
+        size = os.fstat(self.file.fileno()).st_size
+        if size == self.size:
+            return
+        if self.size:
+            self.buffer.close()
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.size = size
+
+    def grow(self, complete=False):
+        # For a file that is still being written: maps what arrived since the
+        # last call and shows the next chunk of complete lines
+        self.complete = complete
+        self.remap()
+        if self.canFetchMore():
+            self.fetchMore()
+
+    def available(self):
+        # A file still being written may end in the middle of a line
+        if self.complete:
+            return self.size
+        return max(self.buffer.rfind(b"\n", self.scanned) + 1, self.scanned) if self.size else 0
+
+    def close(self):
+        if self.size:
+            self.buffer.close()
+        self.file.close()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.offsets) - 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        row = index.row()
+        line = self.buffer[self.offsets[row]:self.offsets[row + 1]]
+        return line.rstrip(b"\r\n").decode("utf-8", errors="replace")
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.scanned < self.available()
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        start = self.scanned
+        limit = self.available()
+        end = min(start + self.CHUNK_SIZE, limit)
+        if end < limit:
+            newline = self.buffer.find(b"\n", end)
+            end = limit if newline == -1 else newline + 1
+        chunk = self.buffer[start:end]
+
+        first_row = len(self.offsets) - 1
+        offsets = [start + match.end() for match in re.finditer(b"\n", chunk)]
+        if end == limit and (not offsets or offsets[-1] != end):
+            offsets.append(end)
+
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(offsets) - 1)
+        self.offsets.extend(offsets)
+        self.scanned = end
+        self.endInsertRows()
+
+        for match in LABEL_RE.finditer(chunk):
+            label = match.group(1).decode("utf-8", errors="replace")
+            self.labels.setdefault(label, self.rowAt(start + match.start()))
+
+    def rowAt(self, position):
+        return bisect_right(self.offsets, position) - 1
+
+    def findLabel(self, label):
+        while label not in self.labels and self.canFetchMore():
+            self.fetchMore()
+        return self.labels.get(label)
+
+    def search(self, text, row):
+        # The regex runs over the mapped file, rows are only resolved for the hit
+        pattern = re.compile(re.escape(text.encode("utf-8")), re.IGNORECASE)
+        position = self.offsets[row] if row < len(self.offsets) else self.scanned
+        match = pattern.search(self.buffer, position)
+        if match is None and position:
+            match = pattern.search(self.buffer, 0)
+        if match is None:
+            return None
+        while self.scanned <= match.start() and self.canFetchMore():
+            self.fetchMore()
+        return self.rowAt(match.start())
+
+
+class FileViewerDialog(QDialog):
+    # With streaming=True the file is still being downloaded; it is polled
+    # until finishStreaming() is called.
+    POLL_INTERVAL = 200
+
+    def __init__(self, path, title="View oscam.server", parent=None, streaming=False):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(500, 800)
+
+        layout = QVBoxLayout(self)
+
+        searchLayout = QHBoxLayout()
+        self.jumpEdit = QLineEdit()
+        self.jumpEdit.setPlaceholderText("Jump to reader label")
+        self.jumpEdit.returnPressed.connect(self.jumpToReader)
+        searchLayout.addWidget(self.jumpEdit)
+
+        self.searchEdit = QLineEdit()
+        self.searchEdit.setPlaceholderText("Search")
+        self.searchEdit.textChanged.connect(lambda: self.searchNext(0))
+        self.searchEdit.returnPressed.connect(lambda: self.searchNext(1))
+        searchLayout.addWidget(self.searchEdit)
+
+        nextButton = QPushButton("Next")
+        nextButton.clicked.connect(lambda: self.searchNext(1))
+        searchLayout.addWidget(nextButton)
+        layout.addLayout(searchLayout)
+
+        self.model = LazyFileModel(path, self, complete=not streaming)
+        self.listView = QListView()
+        self.listView.setUniformItemSizes(True)
+        self.listView.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.listView.setFont(QFont("Monospace"))
+        self.listView.setModel(self.model)
+        layout.addWidget(self.listView)
+
+        self.statusLabel = QLabel("")
+        layout.addWidget(self.statusLabel)
+        self.pollTimer = QTimer(self)
+        self.pollTimer.timeout.connect(lambda: self.model.grow())
+        if streaming:
+            self.pollTimer.start(self.POLL_INTERVAL)
+
+        self.model.rowsInserted.connect(self.updateStatus)
+        self.updateStatus()
+
+    def finishStreaming(self):
+        self.pollTimer.stop()
+        self.model.grow(complete=True)
+        self.updateStatus()
+
+    def updateStatus(self):
+        loaded = "downloading" if self.pollTimer.isActive() else f"{self.model.scanned * 100 // max(self.model.size, 1)}%"
+        self.statusLabel.setText(
+            f"{self.model.rowCount()} lines loaded ({loaded}), {len(self.model.labels)} readers indexed"
+        )
+
+    def selectRow(self, row):
+        index = self.model.index(row)
+        self.listView.setCurrentIndex(index)
+        self.listView.scrollTo(index, QAbstractItemView.PositionAtTop)
+
+    def jumpToReader(self):
+        label = self.jumpEdit.text().strip()
+        if not label:
+            return
+        row = self.model.findLabel(label)
+        if row is None:
+            self.statusLabel.setText(f"Reader '{label}' not found")
+        else:
+            self.selectRow(row)
+
+    def searchNext(self, step):
+        text = self.searchEdit.text()
+        if not text:
+            return
+        current = self.listView.currentIndex()
+        row = self.model.search(text, current.row() + step if current.isValid() else 0)
+        if row is None:
+            self.statusLabel.setText(f"'{text}' not found")
+        else:
+            self.selectRow(row)
+
+    def done(self, result):
+        self.pollTimer.stop()
+        self.model.close()
+        super().done(result)
@@ -0,0 +1,256 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from functools import partial
+from itertools import chain
+from converter import ConversionReport, add_conversion_arguments, read_digest, settings_from_arguments, write_conversion
+from fleet import load_inventory, run_fleet, select_hosts
+from ftp_tasks import CONFIG_FILE, TaskCancelled, TaskContext, upload_oscam_server
+from metrics import MetricsSettings, RunMetrics
+from readers import parse_file
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+EVENT_HEADER = struct.Struct("iIII")
+
+DEBOUNCE = 0.3
+MAX_DELAY = 2.0
+RETRY_INTERVAL = 30.0
+
+
+class InotifyWatcher:
+    # Watches the directories of the files rather than the files, so a file
+    # an editor replaces by renaming a new copy over it is still seen
+    kind = "inotify"
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.directories = {}
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                self.close()
+                raise OSError(errno, f"Cannot watch {directory}")
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        # Paths changed within timeout seconds, an empty set when none did
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return set(self.paths)
+            path = os.path.join(self.directories.get(wd, ""), os.fsdecode(name))
+            if path in self.paths:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    # Compares modification time, size and inode of every file
+    kind = "polling"
+
+    def __init__(self, paths, interval=0.5):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.interval = interval
+        self.states = {path: self.state(path) for path in self.paths}
+
+    @staticmethod
+    def state(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self.paths:
+                state = self.state(path)
+                if state != self.states[path]:
+                    self.states[path] = state
+                    changed.add(path)
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+def create_watcher(paths, polling=False, interval=0.5):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError):
+            # No inotify (or no libc to reach it through), fall back to polling
+            pass
+    return PollingWatcher(paths, interval)
+
+
+def wait_for_change(watcher, task, debounce=DEBOUNCE, max_delay=MAX_DELAY, timeout=None):
+    # Blocks until a file changes, then until the files have been quiet for
+    # `debounce` seconds, so an editor's write, flush and rename end up in a
+    # single rebuild. A file written continuously is rebuilt every max_delay.
+    # Returns no changes when nothing changed within timeout seconds.
+    changed = set()
+    waited = time.monotonic()
+    while not changed:
+        task.check()
+        if timeout is not None and time.monotonic() - waited >= timeout:
+            return changed, None
+        changed = watcher.wait(1.0)
+    first = time.monotonic()
+    while time.monotonic() - first < max_delay:
+        more = watcher.wait(debounce)
+        if not more:
+            break
+        changed |= more
+    return changed, first
+
+
+def push(destination, digest, hosts, pushed, task, reload=False, concurrency=8, retries=1):
+    # Uploads destination to the hosts that were not sent this digest yet.
+    # pushed maps host names to the digest last uploaded to them and is only
+    # updated for hosts that succeeded, so failed ones are tried again.
+    pending = [host for host in hosts if pushed.get(host.name) != digest]
+    if not pending:
+        return
+    upload = partial(upload_oscam_server, local_path=destination, reload=reload)
+    for result in run_fleet(pending, upload, task, concurrency, retries):
+        if result.status == "ok":
+            pushed[result.name] = digest
+
+
+def rebuild(sources, destination, settings, task, hosts=(), reload=False, concurrency=8, retries=1, changed_at=None,
+            metrics_settings=None, pushed=None, cache_path=None):
+    # Reconverts the sources into destination, reusing the readers rendered
+    # for the previous oscam.server from cache_path when one is given, and
+    # pushes the result to the hosts that do not have it yet. Returns the
+    # digest of destination, None when the conversion failed.
+    started = changed_at or time.monotonic()
+    pushed = {} if pushed is None else pushed
+    previous = read_digest(destination) if os.path.exists(destination) else None
+    report = ConversionReport()
+    report.metrics = RunMetrics("watch", metrics_settings)
+    try:
+        records = chain.from_iterable(parse_file(source, report.diagnostics) for source in sources)
+        write_conversion(destination, records, settings, report, cache_path)
+    except (OSError, ValueError) as e:
+        task.error(f"Conversion failed: {e}")
+        return None
+    task.log(f"{destination}: {report.summary()}")
+    task.log(str(report.metrics))
+    for diagnostic in report.diagnostics:
+        task.log(str(diagnostic))
+
+    if report.digest == previous:
+        task.log(f"{destination} did not change")
+    pending = [host for host in hosts if pushed.get(host.name) != report.digest]
+    if pending:
+        push(destination, report.digest, pending, pushed, task, reload, concurrency, retries)
+        task.log(f"Push to {len(pending)} hosts finished {time.monotonic() - started:.1f}s after the change")
+    return report.digest
+
+
+def watch(sources, destination, settings, task, hosts=(), reload=False, polling=False, debounce=DEBOUNCE,
+          concurrency=8, retries=1, metrics_settings=None, cache_path=None):
+    # Runs until the task is cancelled. Every host is pushed to once at the
+    # start, where the upload itself skips receivers that already have the
+    # file, and hosts whose push failed are retried every RETRY_INTERVAL.
+    watcher = create_watcher(sources, polling)
+    task.log(f"Watching {', '.join(sources)} ({watcher.kind}), writing {destination}"
+             + (f" and pushing to {', '.join(host.name for host in hosts)}" if hosts else ""))
+    pushed = {}
+    try:
+        digest = rebuild(sources, destination, settings, task, hosts, reload, concurrency, retries,
+                         metrics_settings=metrics_settings, pushed=pushed, cache_path=cache_path)
+        while True:
+            if digest is None and os.path.exists(destination):
+                # The conversion failed; the previous file is still there
+                digest = read_digest(destination)
+            pending = [host for host in hosts if digest is not None and pushed.get(host.name) != digest]
+            changed, changed_at = wait_for_change(watcher, task, debounce,
+                                                  timeout=RETRY_INTERVAL if pending else None)
+            if not changed:
+                task.log(f"Retrying the push to {', '.join(host.name for host in pending)}")
+                push(destination, digest, pending, pushed, task, reload, concurrency, retries)
+                continue
+            task.log(f"Changed: {', '.join(sorted(changed))}")
+            digest = rebuild(sources, destination, settings, task, hosts, reload, concurrency, retries, changed_at,
+                             metrics_settings, pushed, cache_path)
+    finally:
+        watcher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconvert CCcam.cfg files whenever they change and push oscam.server to the receivers")
+    parser.add_argument("sources", nargs="+", help="CCcam.cfg files to watch, their readers are merged into one oscam.server")
+    parser.add_argument("-o", "--output", default="oscam.server", help="oscam.server to write (default: %(default)s)")
+    parser.add_argument("--cache", metavar="PATH", help="reuse readers rendered by previous rebuilds from this cache file and report what changed")
+    parser.add_argument("--push", nargs="*", metavar="HOST", help="upload to these inventory hosts or groups after every change (all hosts when none are named)")
+    parser.add_argument("--reload", action="store_true", help="apply the changed readers through the OSCam WebIF after the upload")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE, help="seconds without writes before reconverting (default: %(default)s)")
+    parser.add_argument("--poll", action="store_true", help="poll the files instead of using inotify")
+    parser.add_argument("--concurrency", type=int, default=8, help="hosts pushed to at the same time (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=1, help="retries per failed host (default: %(default)s)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="configuration file with the host inventory (default: %(default)s)")
+    add_conversion_arguments(parser)
+    args = parser.parse_args(argv)
+
+    hosts = []
+    if args.push is not None:
+        diagnostics = []
+        hosts = select_hosts(load_inventory(args.config, diagnostics), args.push)
+        for diagnostic in diagnostics:
+            print(f"{args.config} {diagnostic}", file=sys.stderr)
+        if not hosts:
+            parser.error("--push selects no hosts of the inventory")
+    settings = settings_from_arguments(args)
+
+    try:
+        watch(args.sources, args.output, settings, TaskContext(), hosts, args.reload, args.poll, args.debounce,
+              args.concurrency, args.retries, MetricsSettings.load(args.config), args.cache)
+    except (KeyboardInterrupt, TaskCancelled):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import threading
+import time
+from datetime import datetime
+import requests
+from requests.auth import HTTPDigestAuth
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from oscam_config import diff_readers, parse_oscam_server
+
+# One requests.Session per WebIF, so repeated requests to a box reuse the
+# TCP (and TLS) connection instead of reconnecting for every page
+HTTP_SESSIONS = {}
+HTTP_SESSIONS_LOCK = threading.Lock()
+READY_TIMEOUT = 120
+DOWN_TIMEOUT = 15
+
+
+class WebIFError(Exception):
+    pass
+
+
+def parse_httpport(value):
+    # "8888" is plain HTTP, "+8888" is HTTPS on 8888; 0 disables the WebIF
+    value = value.strip()
+    ssl = value.startswith("+")
+    port = value[1:].strip() if ssl else value
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise WebIFError(f"WebIF is disabled or httpport '{value}' is invalid in oscam.conf")
+    return int(port), ssl
+
+
+def http_session(base_url, auth, verify):
+    with HTTP_SESSIONS_LOCK:
+        session = HTTP_SESSIONS.get(base_url)
+        if session is None:
+            session = HTTP_SESSIONS[base_url] = requests.Session()
+        session.auth = auth
+        session.verify = verify
+        return session
+
+
+class RestartReport:
+    def __init__(self, host):
+        self.host = host
+        self.time = datetime.now().isoformat(timespec="seconds")
+        self.went_down = False
+        self.ready = False
+        self.downtime = None
+        self.server = None
+
+    def as_dict(self):
+        return {
+            "time": self.time,
+            "host": self.host,
+            "went_down": self.went_down,
+            "ready": self.ready,
+            "downtime": None if self.downtime is None else round(self.downtime, 3),
+            "server": self.server,
+        }
+
+    def __str__(self):
+        if not self.ready:
+            return f"OSCam on {self.host} did not come back within {READY_TIMEOUT}s"
+        if not self.went_down:
+            return f"OSCam on {self.host} kept answering, the restart was not observed"
+        return f"OSCam on {self.host} was back after {self.downtime:.1f}s"
+
+
+class WebIF:
+    # The few OSCam WebIF pages needed to restart OSCam or act on single
+    # readers. The WebIF uses digest authentication when httpuser is set.
+    def __init__(self, host, port, username=None, password=None, timeout=30, ssl=False):
+        self.host = host
+        self.base_url = f"{'https' if ssl else 'http'}://{host}:{port}"
+        self.timeout = timeout
+        if ssl:
+            # OSCam serves a self-signed certificate
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        auth = HTTPDigestAuth(username, password or "") if username else None
+        self.session = http_session(self.base_url, auth, not ssl)
+
+    @classmethod
+    def from_conf(cls, host, conf, timeout=30):
+        settings = conf.get("webif", {})
+        if not settings.get("httpport", "").strip():
+            raise WebIFError("Could not find httpport in oscam.conf")
+        port, ssl = parse_httpport(settings["httpport"])
+        return cls(host, port, settings.get("httpuser"), settings.get("httppwd"), timeout, ssl)
+
+    def request(self, page, timeout=None, **params):
+        try:
+            response = self.session.get(f"{self.base_url}/{page}", params=params, timeout=timeout or self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise WebIFError(str(e))
+        if response.status_code != 200:
+            raise WebIFError(f"{page} returned status code {response.status_code}")
+        return response
+
+    def ping(self):
+        try:
+            return self.request("status.html", timeout=min(self.timeout, 3))
+        except WebIFError:
+            return None
+
+    def restart(self):
+        self.request("shutdown.html", action="Restart")
+
+    def restart_and_wait(self, task, ready_timeout=READY_TIMEOUT, down_timeout=DOWN_TIMEOUT):
+        # OSCam answers the restart request before it shuts down, so the
+        # WebIF is first polled until it stops answering and then, with a
+        # growing interval, until it answers again. The downtime is measured
+        # from the restart command to the first answer.
+        report = RestartReport(self.host)
+        self.restart()
+        sent = time.monotonic()
+        task.log("Oscam restart command sent successfully")
+
+        delay = 0.2
+        while time.monotonic() - sent < down_timeout:
+            task.cancelled.wait(delay)
+            task.check()
+            if self.ping() is None:
+                report.went_down = True
+                break
+            delay = min(delay * 2, 2.0)
+
+        delay = 0.5
+        while True:
+            response = self.ping()
+            if response is not None:
+                report.ready = True
+                # Without an observed outage the time measured is only how
+                # long the first loop polled, not a downtime
+                if report.went_down:
+                    report.downtime = time.monotonic() - sent
+                report.server = response.headers.get("Server")
+                break
+            if time.monotonic() - sent + delay > ready_timeout:
+                break
+            task.cancelled.wait(delay)
+            task.check()
+            delay = min(delay * 2, 5.0)
+        return report
+
+    def reader_action(self, action, label=None):
+        if action == "reloadreaders":
+            self.request("readers.html", action="reloadreaders")
+        elif action == "restart":
+            self.request("status.html", action="restart", label=label)
+        else:
+            self.request("readers.html", action=action, label=label)
+
+
+def plan_reload(difference, new):
+    # WebIF actions that bring the running OSCam in line with the new
+    # oscam.server. Readers whose only change is the enable flag are switched
+    # on or off; any other change makes OSCam reread oscam.server once and
+    # restarts just the changed readers. Untouched readers and their clients
+    # stay connected.
+    actions = []
+    restarts = []
+    for label in difference.changed:
+        if {key for key, _, _ in difference.fields[label]} == {"enable"}:
+            enabled = new.readers[label].values.get("enable", "1").strip() != "0"
+            actions.append(("enable" if enabled else "disable", label))
+        else:
+            restarts.append(("restart", label))
+    if difference.added or difference.removed or restarts:
+        actions.insert(0, ("reloadreaders", None))
+    return actions + restarts
+
+
+def reload_changed_readers(webif, task, old_data, new_data):
+    # Returns the RestartReport when it had to fall back to a full restart
+    new = parse_oscam_server(new_data)
+    difference = diff_readers(parse_oscam_server(old_data), new)
+    actions = plan_reload(difference, new)
+    if not actions:
+        task.log("No reader changes, OSCam does not need a reload")
+        return
+    task.log(f"Reloading OSCam readers: {difference}")
+    try:
+        for action, label in actions:
+            task.check()
+            webif.reader_action(action, label)
+            task.log(f"WebIF {action} {label}" if label else f"WebIF {action}")
+    except WebIFError as e:
+        task.log(f"Reader reload failed ({str(e)}), falling back to a full restart")
+        return webif.restart_and_wait(task)
@@ -0,0 +1,65 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from ftp_tasks import TaskCancelled, TaskContext
+from metrics import RunMetrics
+
+
+class WorkerSignals(QObject):
+    message = pyqtSignal(str)
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    done = pyqtSignal(object)
+    measured = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    # Runs function(*args, context) on the pool; everything it reports reaches
+    # the GUI thread through queued signals.
+    def __init__(self, name, function, *args, metrics_settings=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.name = name
+        self.function = function
+        self.args = args
+        self.signals = WorkerSignals()
+        self.context = TaskContext(self.signals.message.emit, self.report_progress)
+        self.metrics = RunMetrics(name.lower(), metrics_settings)
+
+    def report_progress(self, message):
+        self.signals.progress.emit(f"{self.name}: {message}")
+
+    def cancel(self):
+        self.context.cancel()
+
+    def run(self):
+        try:
+            self.context.metrics = self.metrics.start()
+            result = self.function(*self.args, self.context)
+        except TaskCancelled:
+            self.signals.failed.emit(f"{self.name} cancelled")
+        except Exception as e:
+            self.signals.failed.emit(f"Error during {self.name.lower()}: {str(e)}")
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            self.metrics.count("bytes transferred", self.context.transferred_bytes)
+            self.signals.measured.emit(self.metrics.finish())
+            self.signals.done.emit(self)
+
+
+class WorkerPool:
+    def __init__(self, max_threads=4):
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self.workers = set()
+
+    def start(self, worker):
+        self.workers.add(worker)
+        worker.signals.done.connect(self.workers.discard)
+        self.pool.start(worker)
+        return worker
+
+    def cancel_all(self):
+        for worker in list(self.workers):
+            worker.cancel()
+        return len(self.workers)